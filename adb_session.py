@@ -0,0 +1,249 @@
+'''
+Record/replay transport for the commands of an exploration session.
+
+In record mode (XBOT_RECORD=<folder>) every command run through
+ExplorationSession._run_adb_command and _run_shell_command is captured with its
+stdout, stderr, exit code and duration, together with the files adb pulled,
+into <folder>/<apk_name>.zip. The decoded manifest and the Soot parameters file
+are stored as well, so the session is self-contained.
+
+In replay mode the same commands are answered from the archive, in order,
+without a device: pulled files are recreated, waits are scaled by a factor (0
+runs at full speed). Local file operations (mv, unzip, ...) are executed for
+real because the following code depends on their effects.
+
+The mode and the archive are process-wide: only one session of a process can be
+recorded or replayed at a time.
+
+    python adb_session.py <archive.zip> [time_scale] [results_folder]
+'''
+
+import atexit
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+RECORD = 'record'
+REPLAY = 'replay'
+LOCAL_COMMANDS = ('mv', 'unzip', 'cp', 'rm', 'mkdir')  # Shell commands executed even during replay
+SESSION_FILE = 'session.jsonl'
+META_FILE = 'meta.json'
+
+mode = None  # None (live), RECORD or REPLAY
+record_folder = ''  # Archives are written here in record mode
+time_scale = 0.0  # Replay waits are multiplied by this (0: full speed)
+
+_archive = None  # zipfile.ZipFile being written
+_entries = []  # Recorded or loaded command entries
+_position = 0  # Next entry to serve in replay
+_QUOTED_PATH = re.compile(r'''(["'])(/[^"']*)\1''')
+
+
+def _normalize(cmd):
+    """Makes a command comparable between runs: no device serial, host paths reduced to their names."""
+    if isinstance(cmd, str):
+        return _QUOTED_PATH.sub(lambda m: m.group(1) + os.path.basename(m.group(2).rstrip('/')) + m.group(1), cmd)
+    tokens = list(cmd)
+    if len(tokens) > 2 and tokens[1] == '-s':
+        del tokens[1:3]
+    return [os.path.basename(t.rstrip('/')) if os.path.isabs(t) and not t.startswith(('/sdcard', '/data'))
+            else t for t in tokens]
+
+
+def _is_local(cmd):
+    return isinstance(cmd, str) and cmd.split(' ', 1)[0] in LOCAL_COMMANDS
+
+
+def begin(apk_name, meta, inputs):
+    """
+    Starts the archive of an APK session (record mode only).
+    Args:
+        apk_name (str): APK name, the archive is <record_folder>/<apk_name>.zip.
+        meta (dict): exploreActivity arguments needed to replay the session.
+        inputs (dict): Archive name -> host file (decoded manifest, parameters file).
+    """
+    global _archive, _entries
+    if mode != RECORD:
+        return
+    finish()
+    os.makedirs(record_folder, exist_ok=True)
+    path = os.path.join(record_folder, f"{apk_name}.zip")
+    _archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    _entries = []
+    _archive.writestr(META_FILE, json.dumps(dict(meta, apk_name=apk_name)))
+    for name, host_path in inputs.items():
+        if host_path and os.path.isfile(host_path):
+            _archive.write(host_path, f"inputs/{name}")
+    print(f"Recording session to {path}")
+
+
+def finish():
+    """Writes the command log and closes the archive being recorded."""
+    global _archive
+    if mode != RECORD or _archive is None:
+        return
+    _archive.writestr(SESSION_FILE, ''.join(json.dumps(e) + '\n' for e in _entries))
+    _archive.close()
+    _archive = None
+
+
+atexit.register(finish) # Keeps the archive readable if the run ends inside a session
+
+
+def _snapshot(folder):
+    files = {}
+    for dirpath, _, filenames in os.walk(folder):
+        for f in filenames:
+            path = os.path.join(dirpath, f)
+            try:
+                st = os.stat(path)
+                files[os.path.relpath(path, folder)] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                pass
+    return files
+
+
+def run(cmd, runner, pull_dest=None):
+    """
+    Runs, records or replays one command.
+    Args:
+        cmd (list or str): Command as passed to deadlines.run (used for matching).
+        runner (callable): Runs the command for real, returning a CompletedProcess (check=True semantics).
+        pull_dest (str): Host destination of an 'adb pull', whose new files are captured/recreated.
+    Returns:
+        subprocess.CompletedProcess: The (recorded) result.
+    Raises:
+        subprocess.CalledProcessError, subprocess.TimeoutExpired: As recorded.
+    """
+    if mode == REPLAY and not _is_local(cmd):
+        return _replay(cmd, pull_dest)
+    if mode != RECORD or _archive is None:
+        return runner()
+
+    before = _snapshot(pull_dest) if pull_dest and os.path.isdir(pull_dest) else {}
+    entry = {'cmd': _normalize(cmd), 'returncode': 0, 'stdout': '', 'stderr': '', 'timeout': False, 'files': []}
+    started = time.monotonic()
+    try:
+        result = runner()
+        entry['stdout'] = result.stdout or ''
+        entry['stderr'] = result.stderr or ''
+        return result
+    except subprocess.CalledProcessError as e:
+        entry.update(returncode=e.returncode, stdout=e.stdout or '', stderr=e.stderr or '')
+        raise
+    except subprocess.TimeoutExpired:
+        entry['timeout'] = True
+        raise
+    finally:
+        entry['duration'] = round(time.monotonic() - started, 3)
+        if pull_dest and os.path.isdir(pull_dest):
+            after = _snapshot(pull_dest)
+            for rel in sorted(f for f in after if before.get(f) != after[f]):
+                member = f"files/{len(_entries)}/{rel}"
+                _archive.write(os.path.join(pull_dest, rel), member)
+                entry['files'].append(rel)
+        _entries.append(entry)
+
+
+def load(path):
+    """
+    Loads an archive for replay.
+    Returns:
+        dict: The meta information of the session.
+    """
+    global _archive, _entries, _position, mode
+    _archive = zipfile.ZipFile(path, 'r')
+    _entries = [json.loads(line) for line in _archive.read(SESSION_FILE).decode('utf-8').splitlines() if line]
+    _position = 0
+    mode = REPLAY
+    return json.loads(_archive.read(META_FILE).decode('utf-8'))
+
+
+def _replay(cmd, pull_dest):
+    global _position
+    key = _normalize(cmd)
+    # Tolerate skipped commands by searching forward for the next identical one
+    for index in range(_position, len(_entries)):
+        if _entries[index]['cmd'] == key:
+            break
+    else:
+        print(f"Replay: no recorded response for {key}")
+        raise subprocess.CalledProcessError(1, cmd, '', 'not in session archive')
+    skipped = [e for e in _entries[_position:index] if not _is_local(e['cmd'])] # Local ones ran for real
+    if skipped:
+        print(f"Replay: skipped {len(skipped)} recorded commands before {key}")
+    entry = _entries[index]
+    _position = index + 1
+
+    if time_scale:
+        time.sleep(entry.get('duration', 0) * time_scale)
+    for rel in entry['files']:
+        target = os.path.join(pull_dest, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with _archive.open(f"files/{index}/{rel}") as src, open(target, 'wb') as dest:
+            shutil.copyfileobj(src, dest)
+    if entry['timeout']:
+        raise subprocess.TimeoutExpired(cmd, entry.get('duration', 0))
+    if entry['returncode'] != 0:
+        raise subprocess.CalledProcessError(entry['returncode'], cmd, entry['stdout'], entry['stderr'])
+    return subprocess.CompletedProcess(cmd, 0, entry['stdout'], entry['stderr'])
+
+
+def scaled(seconds):
+    """Scales a fixed wait of the explorer; waits shrink with time_scale during replay."""
+    return seconds * time_scale if mode == REPLAY else seconds
+
+
+def replay_session(archive_path, scale=0.0, results_folder=None):
+    """
+    Runs exploreActivity offline against a recorded session.
+    Args:
+        archive_path (str): Session archive.
+        scale (float): Time-scaling factor for recorded command durations and waits.
+        results_folder (str): Where the replayed results go (a new temporary folder by default).
+    Returns:
+        str: The results folder.
+    """
+    global time_scale
+    import explore_activity  # Imported here: explore_activity imports this module
+
+    meta = load(archive_path)
+    time_scale = scale
+    results_folder = results_folder or tempfile.mkdtemp(prefix='xbot-replay-')
+    apk_name = meta['apk_name']
+    decompile_root = os.path.join(results_folder, 'apktool')
+    manifest_dir = os.path.join(decompile_root, apk_name)
+    os.makedirs(manifest_dir, exist_ok=True)
+    inputs = {'AndroidManifest.xml': os.path.join(manifest_dir, 'AndroidManifest.xml'),
+              'activity_paras.txt': os.path.join(results_folder, 'activity_paras.txt')}
+    for name, target in inputs.items():
+        if f"inputs/{name}" in _archive.namelist():
+            with _archive.open(f"inputs/{name}") as src, open(target, 'wb') as dest:
+                shutil.copyfileobj(src, dest)
+    # The APK itself is not archived; installs are answered from the session
+    apk_path = os.path.join(results_folder, meta['apk'])
+    open(apk_path, 'wb').close()
+    tmp_folder = os.path.join(results_folder, 'tmp')
+    os.makedirs(tmp_folder, exist_ok=True)
+
+    started = time.monotonic()
+    explore_activity.exploreActivity(apk_path, apk_name, results_folder, meta['emulator'], tmp_folder,
+                                     inputs['activity_paras.txt'], meta.get('uninstall', True), decompile_root)
+    print(f"Replayed {_position}/{len(_entries)} commands in {round(time.monotonic() - started, 2)}s. "
+          f"Results in {results_folder}")
+    return results_folder
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python adb_session.py <archive.zip> [time_scale] [results_folder]")
+        sys.exit(1)
+    import adb_session  # The module state explore_activity sees, not this __main__ copy
+    adb_session.replay_session(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 0.0,
+                               sys.argv[3] if len(sys.argv) > 3 else None)
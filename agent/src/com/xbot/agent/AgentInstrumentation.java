@@ -0,0 +1,244 @@
+package com.xbot.agent;
+
+import android.app.Instrumentation;
+import android.app.UiAutomation;
+import android.graphics.Rect;
+import android.net.LocalServerSocket;
+import android.net.LocalSocket;
+import android.os.Bundle;
+import android.os.ParcelFileDescriptor;
+import android.os.SystemClock;
+import android.view.accessibility.AccessibilityNodeInfo;
+
+import org.json.JSONArray;
+import org.json.JSONException;
+import org.json.JSONObject;
+
+import java.io.BufferedReader;
+import java.io.FileInputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.nio.charset.StandardCharsets;
+import java.util.concurrent.TimeoutException;
+
+/**
+ * On-device helper of Xbot (see device_agent.py for the protocol).
+ *
+ * Started with: am instrument -w -e socket xbot-agent com.xbot.agent/.AgentInstrumentation
+ * Listens on the abstract socket, launches each activity of a batch, waits for the UI to go idle,
+ * serializes the active window in uiautomator dump format and reports crash dialogs.
+ */
+public class AgentInstrumentation extends Instrumentation {
+
+    private static final int PROTOCOL_VERSION = 1;
+    private static final String[] CRASH_KEYWORDS = {"has stopped", "isn't responding", "keeps stopping"};
+
+    private String socketName = "xbot-agent";
+
+    @Override
+    public void onCreate(Bundle arguments) {
+        super.onCreate(arguments);
+        if (arguments != null && arguments.getString("socket") != null) {
+            socketName = arguments.getString("socket");
+        }
+        start();
+    }
+
+    @Override
+    public void onStart() {
+        try {
+            LocalServerSocket server = new LocalServerSocket(socketName);
+            while (true) {
+                LocalSocket client = server.accept();
+                if (!serve(client)) {
+                    break;
+                }
+            }
+            server.close();
+        } catch (IOException e) {
+            Bundle result = new Bundle();
+            result.putString("error", e.toString());
+            finish(1, result);
+            return;
+        }
+        finish(0, new Bundle());
+    }
+
+    /** Serves one host connection. Returns false once the host asked the agent to shut down. */
+    private boolean serve(LocalSocket client) {
+        try {
+            BufferedReader reader = new BufferedReader(
+                    new InputStreamReader(client.getInputStream(), StandardCharsets.UTF_8));
+            OutputStream out = client.getOutputStream();
+            String line;
+            while ((line = reader.readLine()) != null) {
+                JSONObject message = new JSONObject(line);
+                String op = message.optString("op");
+                if ("hello".equals(op)) {
+                    send(out, new JSONObject().put("op", "hello").put("version", PROTOCOL_VERSION));
+                } else if ("batch".equals(op)) {
+                    JSONArray launches = message.optJSONArray("launches");
+                    long idleTimeout = message.optLong("idle_timeout_ms", 5000);
+                    int count = launches == null ? 0 : launches.length();
+                    for (int i = 0; i < count; i++) {
+                        send(out, launch(launches.getJSONObject(i), idleTimeout));
+                    }
+                    send(out, new JSONObject().put("op", "done").put("count", count));
+                } else if ("shutdown".equals(op)) {
+                    client.close();
+                    return false;
+                }
+            }
+            client.close();
+        } catch (IOException | JSONException e) {
+            try {
+                client.close();
+            } catch (IOException ignored) {
+            }
+        }
+        return true;
+    }
+
+    private static void send(OutputStream out, JSONObject message) throws IOException {
+        out.write((message.toString() + "\n").getBytes(StandardCharsets.UTF_8));
+        out.flush();
+    }
+
+    private JSONObject launch(JSONObject spec, long idleTimeout) throws JSONException {
+        JSONObject result = new JSONObject().put("op", "result").put("id", spec.opt("id"));
+        UiAutomation automation = getUiAutomation();
+        long started = SystemClock.uptimeMillis();
+
+        String output = shell(automation, amStart(spec));
+        if (output.contains("does not exist") || output.contains("Unable to resolve Intent")) {
+            return fill(result, "not_found", "", "", output.trim(), started);
+        }
+        if (output.contains("Error:") || output.contains("Exception")) {
+            return fill(result, "error", "", "", output.trim(), started);
+        }
+
+        String status = "ok";
+        try {
+            automation.waitForIdle(500, idleTimeout);
+        } catch (TimeoutException e) {
+            status = "timeout";
+        }
+
+        AccessibilityNodeInfo root = automation.getRootInActiveWindow();
+        if (root == null) {
+            return fill(result, "error", "", "", "no active window", started);
+        }
+        StringBuilder xml = new StringBuilder(
+                "<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation=\"0\">");
+        dumpNode(root, 0, xml);
+        xml.append("</hierarchy>");
+        String hierarchy = xml.toString();
+        String pkg = root.getPackageName() == null ? "" : root.getPackageName().toString();
+
+        for (String keyword : CRASH_KEYWORDS) {
+            if (hierarchy.contains(keyword)) {
+                return fill(result, "crashed", pkg, hierarchy, "crash dialog: " + keyword, started);
+            }
+        }
+        return fill(result, status, pkg, hierarchy, "", started);
+    }
+
+    private static JSONObject fill(JSONObject result, String status, String pkg, String hierarchy, String crash,
+                                   long started) throws JSONException {
+        return result.put("status", status).put("package", pkg).put("hierarchy", hierarchy).put("crash", crash)
+                .put("launch_ms", SystemClock.uptimeMillis() - started);
+    }
+
+    /** Builds the 'am start' command of a spec; run through UiAutomation it needs no host round trip. */
+    private static String amStart(JSONObject spec) throws JSONException {
+        StringBuilder cmd = new StringBuilder(spec.optBoolean("stop") ? "am start -W -S -n " : "am start -W -n ")
+                .append(quote(spec.getString("component")));
+        if (!spec.optString("action").isEmpty()) {
+            cmd.append(" -a ").append(quote(spec.getString("action")));
+        }
+        if (!spec.optString("category").isEmpty()) {
+            cmd.append(" -c ").append(quote(spec.getString("category")));
+        }
+        JSONArray extras = spec.optJSONArray("extras");
+        for (int i = 0; extras != null && i < extras.length(); i++) {
+            JSONObject extra = extras.getJSONObject(i);
+            String flag = extraFlag(extra.optString("type"));
+            if (flag != null) {
+                cmd.append(' ').append(flag).append(' ').append(quote(extra.getString("key")))
+                        .append(' ').append(quote(extra.getString("value")));
+            }
+        }
+        return cmd.toString();
+    }
+
+    private static String extraFlag(String type) {
+        switch (type) {
+            case "string": return "--es";
+            case "int": return "--ei";
+            case "long": return "--el";
+            case "float": return "--ef";
+            case "boolean": return "--ez";
+            case "uri": return "--eu";
+            case "string_array": return "--esa";
+            case "int_array": return "--eia";
+            default: return null;
+        }
+    }
+
+    private static String quote(String value) {
+        return "'" + value.replace("'", "'\\''") + "'";
+    }
+
+    private static String shell(UiAutomation automation, String cmd) {
+        ParcelFileDescriptor pfd = automation.executeShellCommand(cmd);
+        StringBuilder output = new StringBuilder();
+        try (FileInputStream in = new ParcelFileDescriptor.AutoCloseInputStream(pfd)) {
+            byte[] buffer = new byte[4096];
+            int n;
+            while ((n = in.read(buffer)) > 0) {
+                output.append(new String(buffer, 0, n, StandardCharsets.UTF_8));
+            }
+        } catch (IOException e) {
+            output.append("Error: ").append(e);
+        }
+        return output.toString();
+    }
+
+    /** Appends a node and its children in the attribute format of 'uiautomator dump'. */
+    private static void dumpNode(AccessibilityNodeInfo node, int index, StringBuilder xml) {
+        Rect bounds = new Rect();
+        node.getBoundsInScreen(bounds);
+        xml.append("<node index=\"").append(index).append('"')
+                .append(attr("text", node.getText()))
+                .append(attr("resource-id", node.getViewIdResourceName()))
+                .append(attr("class", node.getClassName()))
+                .append(attr("package", node.getPackageName()))
+                .append(attr("content-desc", node.getContentDescription()))
+                .append(attr("checkable", node.isCheckable()))
+                .append(attr("checked", node.isChecked()))
+                .append(attr("clickable", node.isClickable()))
+                .append(attr("enabled", node.isEnabled()))
+                .append(attr("focusable", node.isFocusable()))
+                .append(attr("focused", node.isFocused()))
+                .append(attr("scrollable", node.isScrollable()))
+                .append(attr("long-clickable", node.isLongClickable()))
+                .append(attr("password", node.isPassword()))
+                .append(attr("selected", node.isSelected()))
+                .append(" bounds=\"[").append(bounds.left).append(',').append(bounds.top).append("][")
+                .append(bounds.right).append(',').append(bounds.bottom).append("]\">");
+        for (int i = 0; i < node.getChildCount(); i++) {
+            AccessibilityNodeInfo child = node.getChild(i);
+            if (child != null && child.isVisibleToUser()) {
+                dumpNode(child, i, xml);
+            }
+        }
+        xml.append("</node>");
+    }
+
+    private static String attr(String name, Object value) {
+        String text = value == null ? "" : value.toString();
+        text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\"", "&quot;");
+        return " " + name + "=\"" + text + "\"";
+    }
+}
@@ -0,0 +1,127 @@
+'''
+Helpers for `am start -W` results: parsing the reported launch status and
+latencies, classifying failed launches and recording them per activity.
+
+A launch that `am start` itself reports as failed (unknown activity, permission
+denial, timeout) or that left a fatal exception in the crash log gets a typed
+outcome, so the explorer can skip the UI dump for it.
+'''
+
+import csv
+import os
+import re
+
+# Launch outcomes
+LAUNCHED = 'launched'
+NOT_FOUND = 'not-found'  # Unknown activity class or unresolvable intent
+PERMISSION_DENIED = 'permission-denied'  # Not exported or protected by a permission
+CRASHED = 'crashed-on-start'  # The app died while starting the activity
+TIMEOUT = 'timeout'  # 'am start -W' timed out or was killed
+FAILED = 'start-failed'  # Any other error reported by 'am start'
+FAILURES = (NOT_FOUND, PERMISSION_DENIED, CRASHED, TIMEOUT, FAILED)
+
+_NOT_FOUND = re.compile(r'does not exist|unable to resolve intent|no activity found', re.IGNORECASE)
+_PERMISSION = re.compile(r'SecurityException|Permission Denial|not exported', re.IGNORECASE)
+_BROUGHT_TO_FRONT = 'its current task has been brought to the front'
+
+_FIELD = re.compile(r'^\s*(Status|Activity|ThisTime|TotalTime|WaitTime|LaunchState):\s*(.*)$')
+
+
+def parse_wait_output(output):
+    """
+    Parses the output of `am start -W`.
+    Args:
+        output (str): stdout of the command.
+    Returns:
+        dict: 'status' (str, '' if missing), 'activity' (str) and 'this_time', 'total_time',
+              'wait_time' (int milliseconds, None if missing).
+    """
+    result = {'status': '', 'activity': '', 'this_time': None, 'total_time': None, 'wait_time': None}
+    keys = {'Status': 'status', 'Activity': 'activity', 'ThisTime': 'this_time', 'TotalTime': 'total_time',
+            'WaitTime': 'wait_time'}
+    for line in (output or '').split('\n'):
+        m = _FIELD.match(line)
+        if not m or m.group(1) not in keys:
+            continue
+        key = keys[m.group(1)]
+        value = m.group(2).strip()
+        if key.endswith('_time'):
+            result[key] = int(value) if value.isdigit() else None
+        else:
+            result[key] = value
+    return result
+
+
+def classify(output):
+    """
+    Classifies the combined stdout/stderr of `am start`.
+    Args:
+        output (str): Output of the command.
+    Returns:
+        str: One of FAILURES, or LAUNCHED if nothing went wrong as far as `am start` can tell.
+    """
+    output = output or ''
+    if _NOT_FOUND.search(output):
+        return NOT_FOUND
+    if _PERMISSION.search(output):
+        return PERMISSION_DENIED
+    if parse_wait_output(output)['status'] == 'timeout':
+        return TIMEOUT
+    errors = [line for line in output.split('\n') if line.strip().startswith('Error') or 'Exception' in line]
+    if any(_BROUGHT_TO_FRONT not in line for line in errors):
+        return FAILED
+    return LAUNCHED
+
+
+def crashed(crash_log, pkg):
+    """
+    Tells whether the crash log (`logcat -b crash -d`) holds a fatal exception of a package.
+    Args:
+        crash_log (str): Crash buffer, cleared before the launch.
+        pkg (str): Package (process name) of the app.
+    Returns:
+        bool: True if the app crashed.
+    """
+    crash_log = crash_log or ''
+    return 'FATAL EXCEPTION' in crash_log and f"Process: {pkg}" in crash_log
+
+
+def save_launch_time(results_outputs, appname, activity, mode, launch, outcome=LAUNCHED):
+    """
+    Appends the measured launch latency of an activity to outputs/<app>/launch_times.csv.
+    Args:
+        results_outputs (str): Folder for specific outputs.
+        appname (str): Application name.
+        activity (str): Full activity name.
+        mode (str): 'warm' or 'cold'.
+        launch (dict): Result of parse_wait_output.
+        outcome (str): LAUNCHED or one of FAILURES.
+    """
+    app_folder = os.path.join(results_outputs, appname)
+    os.makedirs(app_folder, exist_ok=True)
+    csv_file = os.path.join(app_folder, 'launch_times.csv')
+    with open(csv_file, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if os.stat(csv_file).st_size == 0:
+            writer.writerow(('activity', 'mode', 'status', 'this_time_ms', 'total_time_ms', 'wait_time_ms',
+                             'outcome'))
+        writer.writerow((activity, mode, launch['status'], launch['this_time'], launch['total_time'],
+                         launch['wait_time'], outcome))
+
+
+def save_outcomes(results_folder, apk_name, launched_act_num, not_launched):
+    """
+    Appends the launch outcome counters of an APK to launch_outcomes.csv.
+    Args:
+        results_folder (str): Base results folder.
+        apk_name (str): APK name.
+        launched_act_num (int): Number of launched activities.
+        not_launched (dict): Outcome (one of FAILURES, or 'abnormal' for a bad screen) -> activities.
+    """
+    csv_file = os.path.join(results_folder, 'launch_outcomes.csv')
+    with open(csv_file, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if os.stat(csv_file).st_size == 0:
+            writer.writerow(('apk_name', 'launched') + FAILURES + ('abnormal',))
+        writer.writerow((apk_name, launched_act_num) + tuple(not_launched.get(o, 0)
+                                                             for o in FAILURES + ('abnormal',)))
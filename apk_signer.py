@@ -0,0 +1,632 @@
+'''
+In-process APK signer (JAR signature v1 + APK Signature Scheme v2).
+
+Replaces the jarsigner subprocess: the keystore is read directly, every zip
+entry is streamed once (its compressed bytes are copied as-is while the
+uncompressed bytes are hashed) and the signed APK is written in one pass to
+its final name. No JDK is needed and nothing here touches module state, so
+several APKs can be signed concurrently from threads.
+'''
+
+import base64
+import hashlib
+import os
+import struct
+import zlib
+
+# Defaults matching the bundled config/coolapk.keystore
+DEFAULT_KEY_ALIAS = 'coolapk'
+DEFAULT_KEY_PASSWORD = '123456'
+
+CHUNK_SIZE = 1024 * 1024  # Chunk size used both for streaming and for v2 digests
+STORED_ALIGNMENT = 4  # zipalign for uncompressed entries
+SO_ALIGNMENT = 4096  # page alignment for uncompressed native libraries
+
+JKS_MAGIC = 0xFEEDFEED
+JKS_KEY_PROTECTOR_OID = '1.3.6.1.4.1.42.2.17.1.1'
+RSA_ENCRYPTION_OID = '1.2.840.113549.1.1.1'
+SHA256_OID = '2.16.840.1.101.3.4.2.1'
+PKCS7_DATA_OID = '1.2.840.113549.1.7.1'
+PKCS7_SIGNED_DATA_OID = '1.2.840.113549.1.7.2'
+
+APK_SIG_BLOCK_MAGIC = b'APK Sig Block 42'
+APK_SIGNATURE_SCHEME_V2_ID = 0x7109871a
+SIGNATURE_RSA_PKCS1_V1_5_WITH_SHA256 = 0x0103
+
+# DigestInfo prefix for SHA-256 (PKCS#1 v1.5, RFC 8017 section 9.2)
+_SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')
+
+_LOCAL_HEADER_SIG = 0x04034b50
+_CENTRAL_HEADER_SIG = 0x02014b50
+_EOCD_SIG = 0x06054b50
+_ALIGNMENT_EXTRA_ID = 0xd935  # Same extra field id apksigner uses for alignment padding
+
+
+class SignError(Exception):
+    """Raised when the keystore cannot be read or the APK cannot be signed."""
+
+
+# ---------------------------------------------------------------------------
+# Minimal DER reading/writing (just what keystores, certificates and PKCS#7 need)
+# ---------------------------------------------------------------------------
+
+def _der_read(data, pos):
+    """
+    Reads one DER TLV.
+    Returns:
+        tuple: (tag, content_start, content_end), content_end is also the next position.
+    """
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        num = length & 0x7f
+        length = int.from_bytes(data[pos:pos + num], 'big')
+        pos += num
+    return tag, pos, pos + length
+
+
+def _der_children(data, start, end):
+    """Returns (tag, content_start, content_end, tlv_start) for each child of a constructed value."""
+    children = []
+    pos = start
+    while pos < end:
+        tag, c_start, c_end = _der_read(data, pos)
+        children.append((tag, c_start, c_end, pos))
+        pos = c_end
+    return children
+
+
+def _der(tag, content):
+    length = len(content)
+    if length < 0x80:
+        return bytes([tag, length]) + content
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([tag, 0x80 | len(encoded)]) + encoded + content
+
+
+def _der_seq(*items):
+    return _der(0x30, b''.join(items))
+
+
+def _der_set(*items):
+    return _der(0x31, b''.join(items))
+
+
+def _der_int(value):
+    return _der(0x02, value.to_bytes(value.bit_length() // 8 + 1, 'big'))
+
+
+def _der_oid(dotted):
+    parts = [int(p) for p in dotted.split('.')]
+    body = bytes([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        encoded = [part & 0x7f]
+        part >>= 7
+        while part:
+            encoded.insert(0, 0x80 | (part & 0x7f))
+            part >>= 7
+        body += bytes(encoded)
+    return _der(0x06, body)
+
+
+def _oid_to_str(content):
+    first = content[0]
+    parts = [first // 40, first % 40]
+    value = 0
+    for b in content[1:]:
+        value = (value << 7) | (b & 0x7f)
+        if not b & 0x80:
+            parts.append(value)
+            value = 0
+    return '.'.join(str(p) for p in parts)
+
+
+def _der_null():
+    return b'\x05\x00'
+
+
+# ---------------------------------------------------------------------------
+# Keystore
+# ---------------------------------------------------------------------------
+
+class SigningKey(object):
+    """RSA private key plus the certificate chain it signs with."""
+
+    def __init__(self, n, e, d, p, q, certificates):
+        self.n = n
+        self.e = e
+        self.d = d
+        self.p = p
+        self.q = q
+        self.certificates = certificates  # list of DER-encoded X.509 certificates, leaf first
+        self.modulus_len = (n.bit_length() + 7) // 8
+        # CRT parameters, recomputed so we do not depend on what the keystore stored
+        self._dp = d % (p - 1)
+        self._dq = d % (q - 1)
+        self._qinv = pow(q, -1, p)
+
+    def sign_sha256(self, data):
+        """
+        Signs data with RSASSA-PKCS1-v1_5 / SHA-256.
+        Args:
+            data (bytes): Message to sign.
+        Returns:
+            bytes: The signature.
+        """
+        digest_info = _SHA256_DIGEST_INFO + hashlib.sha256(data).digest()
+        padding = b'\xff' * (self.modulus_len - len(digest_info) - 3)
+        m = int.from_bytes(b'\x00\x01' + padding + b'\x00' + digest_info, 'big')
+        m1 = pow(m, self._dp, self.p)
+        m2 = pow(m, self._dq, self.q)
+        h = (self._qinv * (m1 - m2)) % self.p
+        s = m2 + h * self.q
+        return s.to_bytes(self.modulus_len, 'big')
+
+
+def _read_java_utf(data, pos):
+    length = struct.unpack('>H', data[pos:pos + 2])[0]
+    pos += 2
+    return data[pos:pos + length].decode('utf-8', errors='replace'), pos + length
+
+
+def _jks_decrypt_key(protected, password):
+    """
+    Decrypts a JKS-protected private key (Sun's proprietary SHA-1 keystream).
+    Returns:
+        bytes: The PKCS#8 PrivateKeyInfo.
+    """
+    _, start, end = _der_read(protected, 0)
+    (_, a_start, a_end, _), (_, k_start, k_end, _) = _der_children(protected, start, end)
+    _, oid_start, oid_end = _der_read(protected, a_start)
+    if _oid_to_str(protected[oid_start:oid_end]) != JKS_KEY_PROTECTOR_OID:
+        raise SignError("Unsupported private key protection algorithm in keystore")
+
+    blob = protected[k_start:k_end]
+    salt, encrypted, check = blob[:20], blob[20:-20], blob[-20:]
+    pw = password.encode('utf-16-be')
+
+    keystream = bytearray()
+    digest = salt
+    while len(keystream) < len(encrypted):
+        digest = hashlib.sha1(pw + digest).digest()
+        keystream += digest
+    plain = bytes(a ^ b for a, b in zip(encrypted, keystream))
+
+    if hashlib.sha1(pw + plain).digest() != check:
+        raise SignError("Wrong key password for keystore entry")
+    return plain
+
+
+def _parse_rsa_pkcs8(pkcs8):
+    _, start, end = _der_read(pkcs8, 0)
+    children = _der_children(pkcs8, start, end)
+    alg_tag, alg_start, alg_end, _ = children[1]
+    _, oid_start, oid_end = _der_read(pkcs8, alg_start)
+    if _oid_to_str(pkcs8[oid_start:oid_end]) != RSA_ENCRYPTION_OID:
+        raise SignError("Only RSA signing keys are supported")
+    _, key_start, key_end, _ = children[2]
+    _, rsa_start, rsa_end = _der_read(pkcs8, key_start)
+    ints = [int.from_bytes(pkcs8[s:e], 'big') for _, s, e, _ in _der_children(pkcs8, rsa_start, rsa_end)]
+    # RSAPrivateKey: version, n, e, d, p, q, dp, dq, qinv
+    return ints[1], ints[2], ints[3], ints[4], ints[5]
+
+
+def load_keystore(keystore_path, password=DEFAULT_KEY_PASSWORD, alias=DEFAULT_KEY_ALIAS, key_password=None):
+    """
+    Loads an RSA private key and its certificate chain from a JKS keystore.
+    Args:
+        keystore_path (str): Path to the .keystore file.
+        password (str): Keystore password (used to check the file's integrity).
+        alias (str): Alias of the private key entry.
+        key_password (str): Password of the key entry, defaults to the keystore password.
+    Returns:
+        SigningKey: The loaded key.
+    """
+    with open(keystore_path, 'rb') as f:
+        data = f.read()
+
+    magic, version, count = struct.unpack('>III', data[:12])
+    if magic != JKS_MAGIC or version not in (1, 2):
+        raise SignError(f"{keystore_path} is not a JKS keystore")
+
+    body, stored_digest = data[:-20], data[-20:]
+    pw = password.encode('utf-16-be')
+    if hashlib.sha1(pw + b'Mighty Aphrodite' + body).digest() != stored_digest:
+        raise SignError(f"Keystore password incorrect or keystore corrupted: {keystore_path}")
+
+    pos = 12
+    for _ in range(count):
+        tag = struct.unpack('>I', data[pos:pos + 4])[0]
+        entry_alias, pos = _read_java_utf(data, pos + 4)
+        pos += 8  # creation timestamp
+        if tag == 1:  # private key entry
+            key_len = struct.unpack('>I', data[pos:pos + 4])[0]
+            protected = data[pos + 4:pos + 4 + key_len]
+            pos += 4 + key_len
+            cert_count = struct.unpack('>I', data[pos:pos + 4])[0]
+            pos += 4
+            certificates = []
+            for _ in range(cert_count):
+                if version == 2:
+                    _, pos = _read_java_utf(data, pos)  # certificate type, always X.509
+                cert_len = struct.unpack('>I', data[pos:pos + 4])[0]
+                certificates.append(data[pos + 4:pos + 4 + cert_len])
+                pos += 4 + cert_len
+            if entry_alias.lower() == alias.lower():
+                pkcs8 = _jks_decrypt_key(protected, key_password or password)
+                n, e, d, p, q = _parse_rsa_pkcs8(pkcs8)
+                return SigningKey(n, e, d, p, q, certificates)
+        elif tag == 2:  # trusted certificate entry
+            if version == 2:
+                _, pos = _read_java_utf(data, pos)
+            cert_len = struct.unpack('>I', data[pos:pos + 4])[0]
+            pos += 4 + cert_len
+        else:
+            raise SignError(f"Unknown keystore entry type {tag}")
+
+    raise SignError(f"Alias '{alias}' not found in {keystore_path}")
+
+
+def _certificate_fields(cert):
+    """
+    Returns:
+        tuple: (issuer DER, serial DER, SubjectPublicKeyInfo DER) of an X.509 certificate.
+    """
+    _, start, end = _der_read(cert, 0)
+    _, tbs_start, tbs_end = _der_read(cert, start)
+    fields = _der_children(cert, tbs_start, tbs_end)
+    if fields[0][0] == 0xa0:  # explicit version
+        fields = fields[1:]
+    # serialNumber, signature, issuer, validity, subject, subjectPublicKeyInfo
+    serial = cert[fields[0][3]:fields[0][2]]
+    issuer = cert[fields[2][3]:fields[2][2]]
+    spki = cert[fields[5][3]:fields[5][2]]
+    return issuer, serial, spki
+
+
+# ---------------------------------------------------------------------------
+# v1 (JAR) signature
+# ---------------------------------------------------------------------------
+
+def _manifest_line(line):
+    """Wraps a manifest header to the 72-byte line limit of the JAR spec."""
+    data = line.encode('utf-8')
+    if len(data) <= 70:
+        return data + b'\r\n'
+    out = [data[:70]]
+    data = data[70:]
+    while data:
+        out.append(b' ' + data[:69])
+        data = data[69:]
+    return b'\r\n'.join(out) + b'\r\n'
+
+
+def _is_v1_signature_file(name):
+    if not name.startswith('META-INF/') or '/' in name[len('META-INF/'):]:
+        return False
+    base = name[len('META-INF/'):].upper()
+    return base == 'MANIFEST.MF' or base.startswith('SIG-') or \
+        base.endswith(('.SF', '.RSA', '.DSA', '.EC'))
+
+
+def _build_v1_files(entry_digests, key, v2_signed):
+    """
+    Builds MANIFEST.MF, CERT.SF and CERT.RSA.
+    Args:
+        entry_digests (list): (name, sha256 digest) for every entry, in zip order.
+        key (SigningKey): Signing key.
+        v2_signed (bool): Whether an APK Signature Scheme v2 block will be added as well.
+    Returns:
+        list: (name, bytes) for the three signature files.
+    """
+    main = _manifest_line('Manifest-Version: 1.0') + _manifest_line('Created-By: 1.0 (Android)') + b'\r\n'
+    sections = []
+    for name, digest in entry_digests:
+        section = _manifest_line(f'Name: {name}') + \
+            _manifest_line('SHA-256-Digest: ' + base64.b64encode(digest).decode('ascii')) + b'\r\n'
+        sections.append((name, section))
+    manifest = main + b''.join(s for _, s in sections)
+
+    sf = _manifest_line('Signature-Version: 1.0') + _manifest_line('Created-By: 1.0 (Android)')
+    sf += _manifest_line('SHA-256-Digest-Manifest: ' +
+                         base64.b64encode(hashlib.sha256(manifest).digest()).decode('ascii'))
+    sf += _manifest_line('SHA-256-Digest-Manifest-Main-Attributes: ' +
+                         base64.b64encode(hashlib.sha256(main).digest()).decode('ascii'))
+    if v2_signed:
+        # Stripping protection: v2-aware verifiers reject the APK if the v2 block is removed
+        sf += _manifest_line('X-Android-APK-Signed: 2')
+    sf += b'\r\n'
+    for name, section in sections:
+        sf += _manifest_line(f'Name: {name}')
+        sf += _manifest_line('SHA-256-Digest: ' + base64.b64encode(hashlib.sha256(section).digest()).decode('ascii'))
+        sf += b'\r\n'
+
+    issuer, serial, _ = _certificate_fields(key.certificates[0])
+    sha256_alg = _der_seq(_der_oid(SHA256_OID), _der_null())
+    signer_info = _der_seq(
+        _der_int(1),
+        _der_seq(issuer, serial),
+        sha256_alg,
+        _der_seq(_der_oid(RSA_ENCRYPTION_OID), _der_null()),
+        _der(0x04, key.sign_sha256(sf)),
+    )
+    signed_data = _der_seq(
+        _der_int(1),
+        _der_set(sha256_alg),
+        _der_seq(_der_oid(PKCS7_DATA_OID)),
+        _der(0xa0, b''.join(key.certificates)),
+        _der_set(signer_info),
+    )
+    pkcs7 = _der_seq(_der_oid(PKCS7_SIGNED_DATA_OID), _der(0xa0, signed_data))
+
+    return [('META-INF/MANIFEST.MF', manifest), ('META-INF/CERT.SF', sf), ('META-INF/CERT.RSA', pkcs7)]
+
+
+# ---------------------------------------------------------------------------
+# v2 (APK Signature Scheme v2)
+# ---------------------------------------------------------------------------
+
+class _ChunkedDigest(object):
+    """Computes the v2 per-1MB chunk digests of a byte stream as it is written."""
+
+    def __init__(self):
+        self.chunks = []
+        self._current = bytearray()
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            take = min(CHUNK_SIZE - len(self._current), len(view))
+            self._current += view[:take]
+            view = view[take:]
+            if len(self._current) == CHUNK_SIZE:
+                self._flush()
+
+    def _flush(self):
+        self.chunks.append(hashlib.sha256(b'\xa5' + struct.pack('<I', len(self._current)) +
+                                          bytes(self._current)).digest())
+        self._current = bytearray()
+
+    def finish(self):
+        if self._current:
+            self._flush()
+        return self.chunks
+
+
+def _lp(data):
+    """uint32 little-endian length-prefixed bytes, as used throughout the v2 block."""
+    return struct.pack('<I', len(data)) + data
+
+
+def _build_v2_block(chunk_digests, key):
+    """
+    Builds the APK Signing Block carrying one v2 signer.
+    Args:
+        chunk_digests (list): Chunk digests of the contents, central directory and EOCD sections.
+        key (SigningKey): Signing key.
+    Returns:
+        bytes: The complete APK Signing Block.
+    """
+    top_digest = hashlib.sha256(b'\x5a' + struct.pack('<I', len(chunk_digests)) + b''.join(chunk_digests)).digest()
+    _, _, spki = _certificate_fields(key.certificates[0])
+
+    digests = _lp(_lp(struct.pack('<I', SIGNATURE_RSA_PKCS1_V1_5_WITH_SHA256) + _lp(top_digest)))
+    certificates = _lp(b''.join(_lp(c) for c in key.certificates))
+    signed_data = digests + certificates + _lp(b'')
+    signatures = _lp(_lp(struct.pack('<I', SIGNATURE_RSA_PKCS1_V1_5_WITH_SHA256) + _lp(key.sign_sha256(signed_data))))
+    signer = _lp(signed_data) + signatures + _lp(spki)
+    value = _lp(_lp(signer))
+
+    pair = struct.pack('<I', APK_SIGNATURE_SCHEME_V2_ID) + value
+    pairs = struct.pack('<Q', len(pair)) + pair
+    size = len(pairs) + 8 + 16  # pairs + trailing size field + magic
+    return struct.pack('<Q', size) + pairs + struct.pack('<Q', size) + APK_SIG_BLOCK_MAGIC
+
+
+# ---------------------------------------------------------------------------
+# Zip streaming
+# ---------------------------------------------------------------------------
+
+class _ZipEntry(object):
+    def __init__(self, name, method, crc, compressed_size, size, dos_time, dos_date, flags, offset,
+                 external_attr):
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.size = size
+        self.dos_time = dos_time
+        self.dos_date = dos_date
+        self.flags = flags
+        self.offset = offset
+        self.external_attr = external_attr
+
+
+def _read_central_directory(f):
+    """
+    Reads the entries of a (non zip64) zip file from its central directory.
+    Returns:
+        list: _ZipEntry objects in central directory order.
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    tail_size = min(file_size, 22 + 0xffff)
+    f.seek(file_size - tail_size)
+    tail = f.read(tail_size)
+    eocd = tail.rfind(struct.pack('<I', _EOCD_SIG))
+    if eocd < 0:
+        raise SignError("Not a zip file: end of central directory not found")
+    (_, _, _, _, total, cd_size, cd_offset, _) = struct.unpack('<IHHHHIIH', tail[eocd:eocd + 22])
+    if cd_offset == 0xffffffff or total == 0xffff:
+        raise SignError("Zip64 APKs are not supported")
+
+    f.seek(cd_offset)
+    cd = f.read(cd_size)
+    entries = []
+    pos = 0
+    for _ in range(total):
+        fields = struct.unpack('<IHHHHHHIIIHHHHHII', cd[pos:pos + 46])
+        if fields[0] != _CENTRAL_HEADER_SIG:
+            raise SignError("Corrupted central directory")
+        flags, method, dos_time, dos_date, crc, csize, usize = fields[3:10]
+        name_len, extra_len, comment_len = fields[10:13]
+        external_attr, offset = fields[15], fields[16]
+        raw_name = cd[pos + 46:pos + 46 + name_len]
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+        if flags & 0x1:
+            raise SignError(f"Encrypted zip entry not supported: {name}")
+        entries.append(_ZipEntry(name, method, crc, csize, usize, dos_time, dos_date, flags, offset, external_attr))
+        pos += 46 + name_len + extra_len + comment_len
+    return entries
+
+
+class _ZipWriter(object):
+    """Writes zip entries sequentially, feeding every byte of the contents section to a digest."""
+
+    def __init__(self, f, contents_digest=None):
+        self.f = f
+        self.offset = 0
+        self.central = []
+        self.contents_digest = contents_digest
+
+    def _write(self, data):
+        self.f.write(data)
+        self.offset += len(data)
+        if self.contents_digest is not None:
+            self.contents_digest.update(data)
+
+    def write_local_header(self, name, method, crc, compressed_size, size, dos_time, dos_date, alignment=0):
+        raw_name = name.encode('utf-8')
+        extra = b''
+        if alignment:
+            data_start = self.offset + 30 + len(raw_name) + 6
+            padding = (alignment - data_start % alignment) % alignment
+            extra = struct.pack('<HHH', _ALIGNMENT_EXTRA_ID, 2 + padding, alignment) + b'\x00' * padding
+        self.central.append((raw_name, method, crc, compressed_size, size, dos_time, dos_date, self.offset))
+        self._write(struct.pack('<IHHHHHIIIHH', _LOCAL_HEADER_SIG, 20, 0x800, method, dos_time, dos_date,
+                                crc, compressed_size, size, len(raw_name), len(extra)) + raw_name + extra)
+
+    def write_data(self, data):
+        self._write(data)
+
+    def write_file(self, name, data, dos_time, dos_date):
+        """Writes a whole new (deflated) entry."""
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        self.write_local_header(name, 8, zlib.crc32(data), len(compressed), len(data), dos_time, dos_date)
+        self._write(compressed)
+
+    def central_directory(self):
+        records = []
+        for raw_name, method, crc, csize, usize, dos_time, dos_date, offset in self.central:
+            records.append(struct.pack('<IHHHHHHIIIHHHHHII', _CENTRAL_HEADER_SIG, 20, 20, 0x800, method,
+                                       dos_time, dos_date, crc, csize, usize, len(raw_name), 0, 0, 0, 0, 0,
+                                       offset) + raw_name)
+        return b''.join(records)
+
+    @staticmethod
+    def eocd(entry_count, cd_size, cd_offset):
+        return struct.pack('<IHHHHIIH', _EOCD_SIG, 0, 0, entry_count, entry_count, cd_size, cd_offset, 0)
+
+
+def _copy_entry(src, writer, entry):
+    """
+    Copies one entry's compressed bytes to the writer while hashing its uncompressed content.
+    Returns:
+        bytes: SHA-256 of the uncompressed content.
+    """
+    src.seek(entry.offset)
+    header = src.read(30)
+    if struct.unpack('<I', header[:4])[0] != _LOCAL_HEADER_SIG:
+        raise SignError(f"Corrupted local header for {entry.name}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    src.seek(entry.offset + 30 + name_len + extra_len)
+
+    alignment = 0
+    if entry.method == 0:
+        alignment = SO_ALIGNMENT if entry.name.endswith('.so') else STORED_ALIGNMENT
+    elif entry.method != 8:
+        raise SignError(f"Unsupported compression method {entry.method} for {entry.name}")
+
+    writer.write_local_header(entry.name, entry.method, entry.crc, entry.compressed_size, entry.size,
+                              entry.dos_time, entry.dos_date, alignment)
+
+    digest = hashlib.sha256()
+    crc = 0
+    decompressor = zlib.decompressobj(-15) if entry.method == 8 else None
+    remaining = entry.compressed_size
+    while remaining:
+        chunk = src.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise SignError(f"Truncated data for {entry.name}")
+        remaining -= len(chunk)
+        writer.write_data(chunk)
+        plain = decompressor.decompress(chunk) if decompressor else chunk
+        digest.update(plain)
+        crc = zlib.crc32(plain, crc)
+    if decompressor:
+        plain = decompressor.flush()
+        digest.update(plain)
+        crc = zlib.crc32(plain, crc)
+    if crc != entry.crc:
+        raise SignError(f"CRC mismatch for {entry.name}")
+    return digest.digest()
+
+
+def sign(input_apk, output_apk, key, v2=True):
+    """
+    Signs an APK in one streaming pass.
+    Args:
+        input_apk (str): Path to the unsigned (or previously signed) APK.
+        output_apk (str): Path of the signed APK to write; may not be the input path.
+        key (SigningKey): Key loaded with load_keystore.
+        v2 (bool): Also add an APK Signature Scheme v2 block.
+    """
+    if os.path.abspath(input_apk) == os.path.abspath(output_apk):
+        raise SignError("Input and output APK must be different files")
+
+    tmp_path = output_apk + '.part'
+    try:
+        with open(input_apk, 'rb') as src, open(tmp_path, 'wb') as dst:
+            entries = _read_central_directory(src)
+            contents_digest = _ChunkedDigest() if v2 else None
+            writer = _ZipWriter(dst, contents_digest)
+
+            entry_digests = []
+            seen = set()
+            last_time, last_date = 0, 0x21  # 1980-01-01 if the APK has no entries at all
+            for entry in entries:
+                if _is_v1_signature_file(entry.name) or entry.name in seen:
+                    continue
+                seen.add(entry.name)
+                digest = _copy_entry(src, writer, entry)
+                if not entry.name.endswith('/'):
+                    entry_digests.append((entry.name, digest))
+                last_time, last_date = entry.dos_time, entry.dos_date
+
+            for name, data in _build_v1_files(entry_digests, key, v2):
+                writer.write_file(name, data, last_time, last_date)
+
+            contents_end = writer.offset
+            writer.contents_digest = None
+            central_directory = writer.central_directory()
+            entry_count = len(writer.central)
+
+            if v2:
+                # The EOCD is digested with the central directory offset pointing at the signing block
+                eocd_for_digest = _ZipWriter.eocd(entry_count, len(central_directory), contents_end)
+                cd_digest = _ChunkedDigest()
+                cd_digest.update(central_directory)
+                eocd_digest = _ChunkedDigest()
+                eocd_digest.update(eocd_for_digest)
+                chunk_digests = contents_digest.finish() + cd_digest.finish() + eocd_digest.finish()
+                writer.write_data(_build_v2_block(chunk_digests, key))
+
+            cd_offset = writer.offset
+            writer.write_data(central_directory)
+            writer.write_data(_ZipWriter.eocd(entry_count, len(central_directory), cd_offset))
+        os.replace(tmp_path, output_apk)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
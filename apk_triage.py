@@ -0,0 +1,185 @@
+'''
+Fast pre-flight triage of input APKs.
+
+Everything here only reads the zip directory, the manifest through aapt and the
+CRCs of the manifest and dex entries (resources and native libraries are not
+decompressed), so a verdict costs about a second even for large APKs. Broken, split-only, incompatible or
+oversized APKs are filtered out before Soot, apktool or the emulator see them.
+'''
+
+import csv
+import os
+import re
+import subprocess
+import zipfile
+import zlib
+
+import deadlines
+
+RUN = 'run'
+SKIP = 'skip'
+SPECIAL = 'special'  # Runs, but needs special handling (reported with the reason)
+
+MAX_APK_SIZE_MB = 500  # Larger APKs are skipped
+LARGE_APK_SIZE_MB = 150  # Larger APKs get the 'special' verdict
+MANY_ACTIVITIES = 300  # Apps with more activities get the 'special' verdict
+
+_BADGING_PATTERNS = {
+    'package': re.compile(r"^package: name='([^']*)'"),
+    'split': re.compile(r"^package: .*\bsplit='([^']*)'"),
+    'min_sdk': re.compile(r"^(?:sdkVersion|minSdkVersion):'([^']*)'"),
+    'target_sdk': re.compile(r"^targetSdkVersion:'([^']*)'"),
+    'launcher': re.compile(r"^launchable-activity: name='([^']*)'"),
+}
+_NATIVE_CODE = re.compile(r"^(?:alt-)?native-code: (.*)$")
+_XMLTREE_ACTIVITY = re.compile(r'^\s*E: (?:activity|activity-alias) ')
+_DEX_ENTRY = re.compile(r'^classes\d*\.dex$')
+
+
+def _first_bad_entry(z, names):
+    """Reads the given zip entries through, checking their CRC. Returns the first corrupted one, or None."""
+    for name in sorted(names):
+        try:
+            with z.open(name) as f:
+                while f.read(1024 * 1024):
+                    pass
+        except (zipfile.BadZipFile, zlib.error, EOFError):
+            return name
+    return None
+
+
+def get_device_info(emulator):
+    """
+    Reads the ABIs and SDK level of a device, used to check APK compatibility.
+    Args:
+        emulator (str): Emulator/device serial.
+    Returns:
+        dict: {'abis': list of ABI names, 'sdk': int or None}.
+    """
+    info = {'abis': [], 'sdk': None}
+    try:
+        abis = deadlines.run(["adb", "-s", emulator, "shell", "getprop", "ro.product.cpu.abilist"],
+                             'shell', capture_output=True).stdout.strip()
+        sdk = deadlines.run(["adb", "-s", emulator, "shell", "getprop", "ro.build.version.sdk"],
+                            'shell', capture_output=True).stdout.strip()
+        info['abis'] = [a for a in abis.split(',') if a]
+        info['sdk'] = int(sdk) if sdk.isdigit() else None
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Error reading device info for {emulator}: {e}")
+    print(f"Device {emulator}: ABIs {info['abis']}, SDK {info['sdk']}")
+    return info
+
+
+def _aapt(args):
+    result = deadlines.run(["aapt"] + args, 'shell', capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"aapt exited with {result.returncode}")
+    return result.stdout
+
+
+def read_manifest_info(apk_path):
+    """
+    Reads package, SDK levels, launcher, native ABIs and activity count with aapt.
+    Args:
+        apk_path (str): Path to the APK.
+    Returns:
+        dict: Manifest information.
+    """
+    info = {'package': '', 'split': '', 'min_sdk': None, 'target_sdk': None, 'launcher': '',
+            'native_abis': [], 'activity_count': 0}
+    for line in _aapt(["dump", "badging", apk_path]).split('\n'):
+        for key, pattern in _BADGING_PATTERNS.items():
+            m = pattern.match(line)
+            if m and not info[key]:
+                info[key] = int(m.group(1)) if key.endswith('_sdk') and m.group(1).isdigit() else m.group(1)
+        m = _NATIVE_CODE.match(line)
+        if m:
+            info['native_abis'].extend(re.findall(r"'([^']+)'", m.group(1)))
+
+    xmltree = _aapt(["dump", "xmltree", apk_path, "AndroidManifest.xml"])
+    info['activity_count'] = sum(1 for line in xmltree.split('\n') if _XMLTREE_ACTIVITY.match(line))
+    return info
+
+
+def triage_apk(apk_path, device_info=None):
+    """
+    Decides whether an APK is worth running.
+    Args:
+        apk_path (str): Path to the APK.
+        device_info (dict): Result of get_device_info, or None to skip device checks.
+    Returns:
+        dict: Triage record with 'verdict' (run/skip/special) and 'reason'.
+    """
+    record = {'apk_name': os.path.splitext(os.path.basename(apk_path))[0], 'verdict': RUN, 'reason': '',
+              'package': '', 'min_sdk': None, 'target_sdk': None, 'activity_count': 0,
+              'native_abis': [], 'size_mb': round(os.path.getsize(apk_path) / (1024.0 * 1024.0), 1)}
+
+    def verdict(v, reason):
+        record['verdict'] = v
+        record['reason'] = reason
+        return record
+
+    if record['size_mb'] > MAX_APK_SIZE_MB:
+        return verdict(SKIP, f"APK larger than {MAX_APK_SIZE_MB} MB")
+
+    try:
+        with zipfile.ZipFile(apk_path) as z:
+            names = set(z.namelist())
+            bad = _first_bad_entry(z, [n for n in names if n == 'AndroidManifest.xml' or _DEX_ENTRY.match(n)])
+        if bad:
+            return verdict(SKIP, f"corrupted zip entry: {bad}")
+    except (zipfile.BadZipFile, OSError) as e:
+        return verdict(SKIP, f"not a valid zip: {e}")
+    if 'AndroidManifest.xml' not in names:
+        return verdict(SKIP, "no AndroidManifest.xml")
+
+    try:
+        info = read_manifest_info(apk_path)
+    except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+        return verdict(SKIP, f"manifest unreadable: {e}")
+    for key in ('package', 'min_sdk', 'target_sdk', 'activity_count', 'native_abis'):
+        record[key] = info[key]
+
+    if info['split']:
+        return verdict(SKIP, f"split APK ({info['split']}) without its base")
+    if not any(n.startswith('classes') and n.endswith('.dex') for n in names):
+        return verdict(SKIP, "no classes.dex")
+    if info['activity_count'] == 0:
+        return verdict(SKIP, "no activities")
+
+    if device_info:
+        sdk = device_info.get('sdk')
+        if sdk and info['min_sdk'] and info['min_sdk'] > sdk:
+            return verdict(SKIP, f"minSdkVersion {info['min_sdk']} above device SDK {sdk}")
+        device_abis = device_info.get('abis') or []
+        if info['native_abis'] and device_abis and not set(info['native_abis']) & set(device_abis):
+            return verdict(SKIP, f"native ABIs {info['native_abis']} not supported by device {device_abis}")
+
+    reasons = []
+    if not info['launcher']:
+        reasons.append("no launcher activity")
+    if record['size_mb'] > LARGE_APK_SIZE_MB:
+        reasons.append(f"larger than {LARGE_APK_SIZE_MB} MB")
+    if info['activity_count'] > MANY_ACTIVITIES:
+        reasons.append(f"{info['activity_count']} activities")
+    if reasons:
+        return verdict(SPECIAL, '; '.join(reasons))
+    return record
+
+
+def save_triage_to_csv(results_folder, record):
+    """
+    Appends a triage record to triage.csv.
+    Args:
+        results_folder (str): Base results folder.
+        record (dict): Record returned by triage_apk.
+    """
+    csv_file = os.path.join(results_folder, 'triage.csv')
+    with open(csv_file, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if os.stat(csv_file).st_size == 0:
+            writer.writerow(('apk_name', 'pkg_name', 'verdict', 'reason', 'min_sdk', 'target_sdk',
+                             'activity_count', 'native_abis', 'size_mb'))
+        writer.writerow((record['apk_name'], record['package'], record['verdict'], record['reason'],
+                         record['min_sdk'], record['target_sdk'], record['activity_count'],
+                         ' '.join(record['native_abis']), record['size_mb']))
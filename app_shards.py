@@ -0,0 +1,168 @@
+'''
+Intra-app parallel exploration: the activities of one large app spread over
+several devices.
+
+The activity list (in exploration order) is dealt round-robin into one deque per
+device. Each device runs in its own worker process and takes the next activity
+from the front of its own deque; once that is empty it steals from the back of
+the longest other deque, so the devices finish together however unevenly the
+activities cost. Activities in flight on a device that is lost go back to the
+other devices.
+
+Workers are forked, so they inherit the exploration session of the app (package
+names, extras index, ...) and may be given closures that switch it to their device.
+
+Every worker writes its outputs into a shard folder of its own; merge_outputs
+folds the shards into outputs/<app> once all devices are done.
+'''
+
+import csv
+import multiprocessing
+import os
+import shutil
+from collections import deque
+from multiprocessing.connection import wait
+
+MIN_ACTIVITIES = 20  # Smaller apps are explored on one device
+
+# Worker -> dispatcher message kinds
+READY = 'ready'
+DONE = 'done'
+LOST = 'lost'  # The device cannot go on; its in-flight activity is handed to another device
+STOPPED = 'stopped'  # A budget wider than one activity expired; nothing more is handed out
+
+
+def partition(activities, k):
+    """
+    Deals activities round-robin into k deques, keeping their order within each deque.
+    Returns:
+        list: k deques.
+    """
+    deques = [deque() for _ in range(k)]
+    for i, activity in enumerate(activities):
+        deques[i % k].append(activity)
+    return deques
+
+
+def next_activity(deques, index):
+    """
+    Takes the next activity for a device: the front of its own deque, else the back of the longest other deque.
+    Args:
+        deques (list): Deques of all devices.
+        index (int): Device index.
+    Returns:
+        tuple: (activity, stolen) or (None, False) if no work is left.
+    """
+    if deques[index]:
+        return deques[index].popleft(), False
+    victim = max(range(len(deques)), key=lambda i: len(deques[i]))
+    if deques[victim]:
+        return deques[victim].pop(), True
+    return None, False
+
+
+def _worker_main(device, conn, setup, work, finish):
+    try:
+        if not setup(device):
+            conn.send((LOST, None, None))
+            return
+        conn.send((READY, None, None))
+        while True:
+            activity = conn.recv()
+            if activity is None:
+                return
+            kind, outcome = work(device, activity)
+            conn.send((kind, activity, outcome))
+            if kind != DONE:
+                return
+    finally:
+        finish(device)
+
+
+def run(devices, activities, setup, work, finish, on_result):
+    """
+    Explores activities on several devices with work stealing.
+    Args:
+        devices (list): Device serials, one worker process each.
+        activities (list): Activities, most promising first.
+        setup (callable): setup(device) -> bool, prepares the device in its worker (False: device unusable).
+        work (callable): work(device, activity) -> (DONE, outcome), (LOST, None) or (STOPPED, None).
+        finish (callable): finish(device), run in each worker before it exits.
+        on_result (callable): on_result(activity, outcome, device), run here for every explored activity.
+    Returns:
+        list: Activities left unexplored (every device lost or a budget expired).
+    """
+    deques = partition(activities, len(devices))
+    running = {}  # conn -> activity
+    workers = {}  # conn -> (index, device, proc)
+    stopped = False
+    context = multiprocessing.get_context('fork')
+    for index, device in enumerate(devices):
+        parent_conn, child_conn = context.Pipe()
+        proc = context.Process(target=_worker_main, args=(device, child_conn, setup, work, finish),
+                               name=f"xbot-shard-{device}")
+        proc.start()
+        workers[parent_conn] = (index, device, proc)
+
+    stolen = 0
+    while workers:
+        for conn in wait(list(workers)):
+            index, device, proc = workers[conn]
+            try:
+                kind, activity, outcome = conn.recv()
+            except EOFError:
+                print(f"Shard worker of {device} exited unexpectedly.")
+                kind, activity, outcome = LOST, None, None
+            in_flight = running.pop(conn, None)
+            if kind == DONE:
+                on_result(activity, outcome, device)
+            elif kind in (LOST, STOPPED):
+                if in_flight is not None:
+                    # Hand the interrupted activity to the device with the most work left
+                    deques[max(range(len(deques)), key=lambda i: len(deques[i]))].appendleft(in_flight)
+                if kind == STOPPED:
+                    stopped = True
+                else:
+                    print(f"Device {device} dropped out of the shard. {len(workers) - 1} device(s) left.")
+                proc.join(5)
+                del workers[conn]
+                continue
+
+            activity, was_stolen = (None, False) if stopped else next_activity(deques, index)
+            if activity is None:
+                conn.send(None)
+                proc.join()
+                del workers[conn]
+                continue
+            stolen += was_stolen
+            running[conn] = activity
+            conn.send(activity)
+
+    if stolen:
+        print(f"{stolen} activities were stolen by idle devices.")
+    return [a for d in deques for a in d]
+
+
+def merge_outputs(shard_outputs, results_outputs, appname):
+    """
+    Folds the outputs/<app> folder of a shard into the app's outputs.
+    Files are per activity and move over as they are; CSV logs are appended without their header.
+    Args:
+        shard_outputs (str): Outputs folder of the shard.
+        results_outputs (str): Folder of the merged outputs.
+        appname (str): Application name.
+    """
+    source = os.path.join(shard_outputs, appname)
+    target = os.path.join(results_outputs, appname)
+    for dirpath, _, filenames in os.walk(source):
+        target_dir = os.path.join(target, os.path.relpath(dirpath, source))
+        os.makedirs(target_dir, exist_ok=True)
+        for f in filenames:
+            src, dest = os.path.join(dirpath, f), os.path.join(target_dir, f)
+            if f.endswith('.csv') and os.path.exists(dest):
+                with open(src, 'r', newline='') as shard_file, open(dest, 'a', newline='') as merged:
+                    rows = list(csv.reader(shard_file))[1:]
+                    csv.writer(merged).writerows(rows)
+            else:
+                shutil.move(src, dest)
+    shutil.rmtree(source, ignore_errors=True)
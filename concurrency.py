@@ -0,0 +1,237 @@
+'''
+Adaptive concurrency of the repackaging, Soot and exploration stages.
+
+Each stage takes a slot of its Limiter while it runs. A limiter is a semaphore
+whose size can change at run time within configured bounds; it lives in shared
+memory so device pool worker processes (forked after it is created) take slots
+of the same limiter. A controller thread in the main process samples host load,
+available memory (and memory pressure where /proc/pressure exists) and the
+number of jobs waiting for each stage, and shrinks or grows the limits one step
+at a time. Every change and its reason is printed and appended to
+results/concurrency.csv; the current settings are kept in results/concurrency.json.
+
+Bounds can be configured with XBOT_CONCURRENCY, e.g. "soot=1-4,repkg=1-8,explore=1-2".
+'''
+
+import csv
+import json
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STAGES = ('repkg', 'soot', 'explore')
+SHRINK_ORDER = ('soot', 'repkg', 'explore')  # Static stages give way to the emulators first
+STAGE_MEMORY_MB = {'soot': 4608, 'repkg': 1024, 'explore': 0}  # Memory a further job of the stage needs
+INTERVAL = 15  # seconds between controller samples
+MIN_FREE_MB = 2048  # Shrink below this much available memory
+HIGH_LOAD = 1.5  # Shrink the static stages above this 1-minute load per core
+LOW_LOAD = 0.7  # Grow a stage with waiting jobs below this load per core
+PSI_HIGH = 10.0  # Shrink above this share (%) of time stalled on memory (avg10)
+
+limiters = {}  # stage -> Limiter; stages without a limiter run unthrottled
+
+
+class Limiter(object):
+    """Semaphore with an adjustable size, shared with forked worker processes."""
+
+    def __init__(self, name, low, high, initial=None):
+        self.name = name
+        self.low = max(1, low)
+        self.high = max(self.low, high)
+        self._cond = multiprocessing.Condition()
+        self._limit = multiprocessing.Value('i', min(self.high, max(self.low, initial or self.high)), lock=False)
+        self._active = multiprocessing.Value('i', 0, lock=False)
+        self._waiting = multiprocessing.Value('i', 0, lock=False)
+
+    @property
+    def limit(self):
+        return self._limit.value
+
+    def state(self):
+        """Returns the current limit, bounds, running and waiting jobs."""
+        with self._cond:
+            return {'limit': self._limit.value, 'low': self.low, 'high': self.high,
+                    'active': self._active.value, 'waiting': self._waiting.value}
+
+    def acquire(self):
+        with self._cond:
+            self._waiting.value += 1
+            while self._active.value >= self._limit.value:
+                self._cond.wait()
+            self._waiting.value -= 1
+            self._active.value += 1
+
+    def release(self):
+        with self._cond:
+            self._active.value -= 1
+            self._cond.notify_all()
+
+    def set_limit(self, limit):
+        """Changes the size; running jobs above a lower limit finish, new ones wait."""
+        with self._cond:
+            self._limit.value = min(self.high, max(self.low, limit))
+            self._cond.notify_all()
+            return self._limit.value
+
+
+@contextmanager
+def slot(stage):
+    """Holds a slot of a stage for the duration of the block (no-op if the stage is not limited)."""
+    limiter = limiters.get(stage)
+    if limiter is None:
+        yield
+        return
+    limiter.acquire()
+    try:
+        yield
+    finally:
+        limiter.release()
+
+
+def parse_bounds(spec):
+    """
+    Parses "stage=low-high,..." (or "stage=n" for a fixed size).
+    Returns:
+        dict: stage -> (low, high).
+    """
+    bounds = {}
+    for item in filter(None, (s.strip() for s in (spec or '').split(','))):
+        try:
+            stage, value = item.split('=', 1)
+            low, _, high = value.partition('-')
+            bounds[stage.strip()] = (int(low), int(high or low))
+        except ValueError:
+            print(f"Ignoring concurrency bound '{item}' (expected stage=low-high)")
+    return bounds
+
+
+def setup(defaults, spec=None):
+    """
+    Creates the limiters of the stages (before device pool workers are forked).
+    Args:
+        defaults (dict): stage -> (low, high, initial).
+        spec (str): Bounds overriding the defaults, see parse_bounds.
+    """
+    overrides = parse_bounds(spec)
+    for stage, (low, high, initial) in defaults.items():
+        if stage in overrides:
+            low, high = overrides[stage]
+        limiters[stage] = Limiter(stage, low, high, initial)
+        print(f"Concurrency of {stage}: {limiters[stage].limit} (bounds {limiters[stage].low}-{limiters[stage].high})")
+
+
+def _memory_available_mb():
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _memory_pressure():
+    try:
+        with open('/proc/pressure/memory', 'r') as f:
+            for line in f:
+                if line.startswith('some'):
+                    return float(line.split('avg10=')[1].split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def sample():
+    """
+    Samples the host.
+    Returns:
+        dict: 'load' (1-minute load per core), 'memory_mb' (available, or None) and 'psi' (or None).
+    """
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        load = 0.0
+    return {'load': round(load, 2), 'memory_mb': _memory_available_mb(), 'psi': _memory_pressure()}
+
+
+def decide(host, states):
+    """
+    Picks at most one limit change for the current sample.
+    Args:
+        host (dict): Result of sample().
+        states (dict): stage -> Limiter.state().
+    Returns:
+        tuple: (stage, new_limit, reason), or None to keep the settings.
+    """
+    memory = host['memory_mb']
+    if (memory is not None and memory < MIN_FREE_MB) or (host['psi'] is not None and host['psi'] > PSI_HIGH):
+        reason = f"memory pressure ({memory} MB available, psi {host['psi']})"
+        for stage in SHRINK_ORDER:
+            if stage in states and states[stage]['limit'] > states[stage]['low']:
+                return stage, states[stage]['limit'] - 1, reason
+        return None
+    if host['load'] > HIGH_LOAD:
+        for stage in SHRINK_ORDER[:2]:
+            if stage in states and states[stage]['limit'] > states[stage]['low']:
+                return stage, states[stage]['limit'] - 1, f"load {host['load']} per core"
+        return None
+    if host['load'] < LOW_LOAD:
+        # Grow the stage with the deepest queue that is actually using its slots and fits into memory
+        candidates = [s for s in states if states[s]['waiting'] > 0 and states[s]['limit'] < states[s]['high']
+                      and states[s]['active'] >= states[s]['limit']
+                      and (memory is None or memory - MIN_FREE_MB > STAGE_MEMORY_MB.get(s, 0))]
+        if candidates:
+            stage = max(candidates, key=lambda s: states[s]['waiting'])
+            return stage, states[stage]['limit'] + 1, \
+                f"{states[stage]['waiting']} job(s) waiting, load {host['load']} per core, {memory} MB available"
+    return None
+
+
+def _save(results_folder, host, states):
+    path = os.path.join(results_folder, 'concurrency.json')
+    try:
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'updated': time.strftime('%Y-%m-%d %H:%M:%S'), 'host': host, 'stages': states}, f, indent=1)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"Error writing concurrency settings {path}: {e}")
+
+
+def save_change(results_folder, stage, old, new, reason):
+    """Appends a limit change to concurrency.csv."""
+    csv_file = os.path.join(results_folder, 'concurrency.csv')
+    with open(csv_file, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if os.stat(csv_file).st_size == 0:
+            writer.writerow(('time', 'stage', 'old_limit', 'new_limit', 'reason'))
+        writer.writerow((time.strftime('%Y-%m-%d %H:%M:%S'), stage, old, new, reason))
+
+
+def _control(results_folder, interval, stop):
+    while not stop.wait(interval):
+        host = sample()
+        states = {stage: limiter.state() for stage, limiter in limiters.items()}
+        change = decide(host, states)
+        if change:
+            stage, limit, reason = change
+            old = states[stage]['limit']
+            states[stage]['limit'] = limiters[stage].set_limit(limit)
+            print(f"Concurrency of {stage}: {old} -> {states[stage]['limit']} ({reason})")
+            save_change(results_folder, stage, old, states[stage]['limit'], reason)
+        _save(results_folder, host, states)
+
+
+def start_controller(results_folder, interval=INTERVAL):
+    """
+    Starts the controller thread (daemon) adjusting the limiters.
+    Returns:
+        threading.Event: Set it to stop the controller.
+    """
+    stop = threading.Event()
+    _save(results_folder, sample(), {stage: limiter.state() for stage, limiter in limiters.items()})
+    threading.Thread(target=_control, args=(results_folder, interval, stop), name='xbot-concurrency',
+                     daemon=True).start()
+    return stop
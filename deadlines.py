@@ -0,0 +1,195 @@
+'''
+Watchdog timeouts and deadline budgets for external commands.
+
+Every command is run in its own process group with a timeout picked by its class
+(shell, install, pull, JVM tools, Soot), shortened to whatever is left of the
+enclosing per-activity / per-APK budgets. Expired commands are killed together
+with their children and recorded in results/timeouts.csv; an expired budget
+raises BudgetExpired so the caller can move on to the next activity or APK.
+'''
+
+import csv
+import os
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-command timeouts in seconds, by command class
+TIMEOUTS = {
+    'shell': 30,  # adb shell, aapt, uiautomator dump, dumpsys, taps
+    'install': 300,  # adb install / uninstall
+    'pull': 120,  # adb pull / push
+    'jvm': 900,  # apktool decode / build
+    'soot': 1200,  # run_soot.run
+}
+
+ACTIVITY_BUDGET = 120  # seconds for all launches of one activity
+APK_BUDGET = 3 * 3600  # seconds for repackaging and exploring one APK
+
+log_folder = ''  # Folder of timeouts.csv, set by the caller; empty disables the log
+
+_state = threading.local()
+
+
+class BudgetExpired(Exception):
+    """Raised when the per-activity or per-APK budget is used up."""
+
+    def __init__(self, scope, label):
+        Exception.__init__(self, f"{scope} budget expired ({label})")
+        self.scope = scope
+        self.label = label
+
+
+class _Budget(object):
+    def __init__(self, scope, seconds, label):
+        self.scope = scope
+        self.label = label
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+
+def _budgets():
+    if not hasattr(_state, 'budgets'):
+        _state.budgets = []
+    return _state.budgets
+
+
+@contextmanager
+def budget(scope, seconds, label=''):
+    """
+    Bounds everything run inside the block (in this thread) to a number of seconds.
+    Args:
+        scope (str): 'activity', 'apk' or 'states', reported in BudgetExpired and the timeout log.
+        seconds (float): Budget.
+        label (str): Activity or APK name.
+    """
+    stack = _budgets()
+    stack.append(_Budget(scope, seconds, label))
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+@contextmanager
+def grace():
+    """Suspends all budgets inside the block, e.g. for uninstalling after an expired APK budget."""
+    saved = list(_budgets())
+    del _budgets()[:]
+    try:
+        yield
+    finally:
+        _budgets()[:] = saved
+
+
+def _tightest_budget():
+    stack = _budgets()
+    if not stack:
+        return None
+    return min(stack, key=lambda b: b.remaining())
+
+
+def remaining():
+    """Returns the seconds left in the tightest enclosing budget, or None if there is none."""
+    tightest = _tightest_budget()
+    return tightest.remaining() if tightest else None
+
+
+def check_budget():
+    """Raises BudgetExpired if an enclosing budget is used up."""
+    tightest = _tightest_budget()
+    if tightest and tightest.remaining() <= 0:
+        raise BudgetExpired(tightest.scope, tightest.label)
+
+
+def _labels():
+    return ' / '.join(f"{b.scope}:{b.label}" for b in _budgets() if b.label)
+
+
+def record_timeout(scope, what, seconds):
+    """
+    Appends a timeout outcome to timeouts.csv.
+    Args:
+        scope (str): Command class or budget scope that expired.
+        what (str): Command line or activity/APK name.
+        seconds (float): The timeout that was exceeded.
+    """
+    print(f"Timeout ({scope}, {round(seconds, 1)}s): {what}")
+    if not log_folder:
+        return
+    csv_file = os.path.join(log_folder, 'timeouts.csv')
+    try:
+        with open(csv_file, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if os.stat(csv_file).st_size == 0:
+                writer.writerow(('time', 'context', 'scope', 'what', 'timeout'))
+            writer.writerow((time.strftime('%Y-%m-%d %H:%M:%S'), _labels(), scope, what, round(seconds, 1)))
+    except OSError as e:
+        print(f"Error writing timeout log: {e}")
+
+
+def kill_group(proc):
+    """Kills a process started with start_new_session=True together with its children."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    try:
+        proc.communicate(timeout=5)
+    except (subprocess.TimeoutExpired, ValueError, OSError):
+        pass
+
+
+def run(cmd, timeout_class='shell', check=False, capture_output=False, text=True, input=None, shell=False,
+        timeout=None, **popen_kwargs):
+    """
+    subprocess.run with a class timeout bounded by the enclosing budgets.
+    Args:
+        cmd (list or str): Command, as for subprocess.run.
+        timeout_class (str): Key of TIMEOUTS.
+        check, capture_output, text, input, shell: As for subprocess.run.
+        timeout (float): Overrides the class timeout.
+        **popen_kwargs: Further subprocess.Popen arguments (cwd, env, ...).
+    Returns:
+        subprocess.CompletedProcess: The finished process.
+    Raises:
+        subprocess.TimeoutExpired: The command class timeout was hit (the process group is killed).
+        BudgetExpired: An enclosing budget is used up, before or while running the command.
+        subprocess.CalledProcessError: With check=True and a non-zero exit code.
+    """
+    if timeout is None:
+        timeout = TIMEOUTS[timeout_class]
+    tightest = _tightest_budget()
+    if tightest is not None:
+        check_budget()
+        timeout = min(timeout, tightest.remaining())
+
+    if capture_output:
+        popen_kwargs['stdout'] = subprocess.PIPE
+        popen_kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        popen_kwargs['stdin'] = subprocess.PIPE
+
+    proc = subprocess.Popen(cmd, shell=shell, text=text, start_new_session=True, **popen_kwargs)
+    try:
+        stdout, stderr = proc.communicate(input=input, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_group(proc)
+        what = cmd if isinstance(cmd, str) else ' '.join(cmd)
+        if tightest is not None and tightest.remaining() <= 0:
+            record_timeout(tightest.scope, what, timeout)
+            raise BudgetExpired(tightest.scope, tightest.label)
+        record_timeout(timeout_class, what, timeout)
+        raise
+    except BaseException:
+        kill_group(proc)
+        raise
+
+    completed = subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return completed
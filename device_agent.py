@@ -0,0 +1,270 @@
+'''
+Host client for the on-device helper agent.
+
+The helper (agent/, an instrumentation APK) listens on the abstract socket
+'xbot-agent', forwarded to a local TCP port with 'adb forward'. It receives
+batches of activity launch specs, launches each activity in-process, waits for
+the UI to go idle, serializes the view hierarchy and reports crashes, streaming
+one result per launch back. This replaces the am start / uiautomator dump /
+pull / dumpsys round trips of every launch.
+
+Protocol: one JSON object per line in both directions.
+    -> {"op": "hello"}
+    <- {"op": "hello", "version": 1}
+    -> {"op": "batch", "idle_timeout_ms": 5000, "launches": [spec, ...]}
+    <- {"op": "result", "id": ..., "status": ..., ...}   (one per spec, in order)
+    <- {"op": "done", "count": n}
+    -> {"op": "shutdown"}
+A spec is {"id", "component", "action", "category", "extras": [{"type", "key", "value"}], "stop"};
+"stop" force-stops the app before the launch (am start -S, a cold start).
+A result has "status" (one of STATUSES), "package" (of the foreground window),
+"hierarchy" (uiautomator style XML), "crash" (message, '' if none) and "launch_ms".
+
+LocalAgent is a stand-in implementing the same protocol on the host, so the
+client can be exercised without a device (python device_agent.py --stand-in PORT).
+'''
+
+import json
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import deadlines
+
+PROTOCOL_VERSION = 1
+SOCKET_NAME = 'xbot-agent'
+AGENT_PKG = 'com.xbot.agent'
+AGENT_RUNNER = 'com.xbot.agent/.AgentInstrumentation'
+IDLE_TIMEOUT_MS = 5000  # per launch, until the UI of the launched activity is idle
+CONNECT_TIMEOUT = 10  # seconds
+
+OK = 'ok'
+CRASHED = 'crashed'
+NOT_FOUND = 'not_found'
+TIMEOUT = 'timeout'
+ERROR = 'error'
+STATUSES = (OK, CRASHED, NOT_FOUND, TIMEOUT, ERROR)
+
+# 'am start' extra flags -> extra types understood by the agent
+_EXTRA_TYPES = {'--es': 'string', '--ei': 'int', '--el': 'long', '--ef': 'float', '--ez': 'boolean',
+                '--eu': 'uri', '--esa': 'string_array', '--eia': 'int_array'}
+
+
+class AgentError(Exception):
+    """Raised when the agent cannot be reached or breaks the protocol."""
+
+
+def extras_from_am_args(args):
+    """
+    Converts prebuilt 'am start' extras arguments (as in the Soot parameter index) to agent extras.
+    Args:
+        args (list): e.g. ['--es', 'url', 'abc', '--ez', 'flag', 'true'].
+    Returns:
+        list: [{'type', 'key', 'value'}, ...]; unknown flags are skipped.
+    """
+    extras = []
+    i = 0
+    while i < len(args):
+        flag = args[i]
+        if flag in _EXTRA_TYPES and i + 2 < len(args):
+            extras.append({'type': _EXTRA_TYPES[flag], 'key': args[i + 1], 'value': args[i + 2]})
+            i += 3
+        else:
+            i += 1
+    return extras
+
+
+def launch_spec(spec_id, component, action='', category='', am_extras=None, stop=False):
+    """Builds one launch spec of a batch; stop asks for a cold start."""
+    return {'id': spec_id, 'component': component, 'action': action or '', 'category': category or '',
+            'extras': extras_from_am_args(am_extras or []), 'stop': bool(stop)}
+
+
+class AgentClient(object):
+    """JSON-lines connection to an agent listening on a local TCP port."""
+
+    def __init__(self, port, host='127.0.0.1', timeout=CONNECT_TIMEOUT):
+        self.port = port
+        try:
+            self.sock = socket.create_connection((host, port), timeout=timeout)
+        except OSError as e:
+            raise AgentError(f"cannot connect to agent on port {port}: {e}")
+        self.reader = self.sock.makefile('r', encoding='utf-8')
+        self._send({'op': 'hello'})
+        reply = self._receive()
+        if reply.get('op') != 'hello' or reply.get('version') != PROTOCOL_VERSION:
+            self.close()
+            raise AgentError(f"unexpected agent handshake: {reply}")
+
+    def _send(self, message):
+        try:
+            self.sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        except OSError as e:
+            raise AgentError(f"agent connection lost: {e}")
+
+    def _receive(self):
+        try:
+            line = self.reader.readline()
+        except OSError as e:
+            raise AgentError(f"agent connection lost: {e}")
+        if not line:
+            raise AgentError("agent closed the connection")
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise AgentError(f"malformed agent message: {line[:200]}")
+
+    def launch_batch(self, specs, idle_timeout_ms=IDLE_TIMEOUT_MS):
+        """
+        Sends a batch of launch specs and yields the results as they are streamed back.
+        Args:
+            specs (list): Specs built with launch_spec.
+            idle_timeout_ms (int): Per-launch wait for an idle UI.
+        Yields:
+            dict: One result per spec.
+        """
+        # Each launch may take the idle timeout plus the launch itself before a result arrives
+        self.sock.settimeout(CONNECT_TIMEOUT + idle_timeout_ms / 1000.0 * 2)
+        self._send({'op': 'batch', 'idle_timeout_ms': idle_timeout_ms, 'launches': specs})
+        while True:
+            message = self._receive()
+            if message.get('op') == 'done':
+                return
+            if message.get('op') != 'result':
+                raise AgentError(f"unexpected agent message: {message}")
+            yield message
+
+    def launch(self, spec, idle_timeout_ms=IDLE_TIMEOUT_MS):
+        """Launches a single spec and returns its result."""
+        results = list(self.launch_batch([spec], idle_timeout_ms))
+        if not results:
+            raise AgentError("agent returned no result")
+        return results[0]
+
+    def close(self, shutdown=False):
+        try:
+            if shutdown:
+                self._send({'op': 'shutdown'})
+        except AgentError:
+            pass
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def start_agent(serial, port):
+    """
+    Starts the helper instrumentation on a device and forwards its socket to a local port.
+    Args:
+        serial (str): Device serial.
+        port (int): Local TCP port.
+    Returns:
+        subprocess.Popen: The 'am instrument' process (kill it to stop the agent), or None on failure.
+    """
+    try:
+        deadlines.run(["adb", "-s", serial, "forward", f"tcp:{port}", f"localabstract:{SOCKET_NAME}"],
+                      'shell', check=True, capture_output=True)
+        # -w keeps the instrumentation (and the agent) alive until the process is killed
+        return subprocess.Popen(["adb", "-s", serial, "shell", "am", "instrument", "-w", "-e", "socket",
+                                 SOCKET_NAME, AGENT_RUNNER], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, start_new_session=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Could not start the helper agent on {serial}: {e}")
+        return None
+
+
+def stop_agent(serial, port, proc):
+    """Stops an agent started with start_agent and removes the port forward."""
+    if proc is not None:
+        deadlines.kill_group(proc)
+    try:
+        deadlines.run(["adb", "-s", serial, "forward", "--remove", f"tcp:{port}"], 'shell', capture_output=True)
+    except (OSError, subprocess.SubprocessError):
+        pass
+
+
+def connect(port, attempts=10, delay=1.0):
+    """Connects to an agent that may still be starting. Returns an AgentClient or None."""
+    for _ in range(attempts):
+        try:
+            return AgentClient(port)
+        except AgentError as e:
+            error = e
+        time.sleep(delay)
+    print(f"Helper agent not reachable: {error}")
+    return None
+
+
+def stand_in_launch(spec):
+    """
+    Default launch handler of LocalAgent: pretends every activity renders a single empty view.
+    Replace it with a function returning canned results to script other outcomes.
+    """
+    pkg, activity = spec['component'].split('/', 1)
+    if activity.startswith('.'):
+        activity = pkg + activity
+    hierarchy = ('<?xml version=\'1.0\' encoding=\'UTF-8\' standalone=\'yes\' ?><hierarchy rotation="0">'
+                 f'<node index="0" text="" resource-id="" class="android.widget.FrameLayout" package="{pkg}" '
+                 'content-desc="" enabled="true" bounds="[0,0][1080,1920]" /></hierarchy>')
+    return {'status': OK, 'activity': activity, 'package': pkg, 'hierarchy': hierarchy, 'crash': '',
+            'launch_ms': 0}
+
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line.decode('utf-8'))
+            except ValueError:
+                return
+            op = message.get('op')
+            if op == 'hello':
+                self._send({'op': 'hello', 'version': PROTOCOL_VERSION})
+            elif op == 'batch':
+                launches = message.get('launches', [])
+                for spec in launches:
+                    result = {'op': 'result', 'id': spec.get('id')}
+                    try:
+                        result.update(self.server.launch_handler(spec))
+                    except Exception as e:
+                        result.update({'status': ERROR, 'package': '', 'hierarchy': '', 'crash': str(e),
+                                       'launch_ms': 0})
+                    self._send(result)
+                self._send({'op': 'done', 'count': len(launches)})
+            elif op == 'shutdown':
+                return
+
+    def _send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+
+class LocalAgent(socketserver.ThreadingTCPServer):
+    """Host-side stand-in for the helper agent, speaking the same protocol."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, launch_handler=stand_in_launch):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', port), _StandInHandler)
+        self.launch_handler = launch_handler
+        self.port = self.server_address[1]
+
+    def start(self):
+        """Serves in a background thread and returns the bound port."""
+        threading.Thread(target=self.serve_forever, name='xbot-agent-stand-in', daemon=True).start()
+        return self.port
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--stand-in':
+        server = LocalAgent(int(sys.argv[2]))
+        print(f"Stand-in agent listening on 127.0.0.1:{server.port}")
+        server.serve_forever()
+    else:
+        print("Usage: python device_agent.py --stand-in PORT")
@@ -0,0 +1,238 @@
+'''
+Per-device health monitoring and recovery.
+
+A background monitor probes each emulator periodically (adb state, boot
+completion, root, system-wide ANR dialogs). Commands that fail with
+"device offline"/"unauthorized" also report the device as unhealthy. The main
+loop checks the monitor after every APK, runs the recovery ladder (reconnect,
+adb root, snapshot reload, reboot) and requeues the interrupted APK.
+'''
+
+import re
+import subprocess
+import threading
+import time
+
+import deadlines
+
+PROBE_INTERVAL = 60  # seconds between background probes
+BOOT_TIMEOUT = 300  # seconds to wait for a device to boot after a reboot/snapshot load
+MAX_REQUEUES = 2  # times one APK is requeued after the device failed under it
+
+# Device problems visible in adb's stderr
+DEVICE_ERRORS = re.compile(r"device offline|unauthorized|device '[^']*' not found|no devices/emulators found")
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+def _adb(serial, args, timeout=None):
+    """Runs an adb command for the device, returning (returncode, stdout + stderr)."""
+    try:
+        result = deadlines.run(["adb", "-s", serial] + args, 'shell', capture_output=True, timeout=timeout)
+        return result.returncode, (result.stdout or '') + (result.stderr or '')
+    except subprocess.TimeoutExpired:
+        return None, 'timeout'
+    except FileNotFoundError:
+        raise # adb itself is missing, nothing to recover
+    except OSError as e:
+        return None, str(e)
+
+
+def probe(serial, expect_root=True):
+    """
+    Checks whether a device is usable.
+    Args:
+        serial (str): Device serial.
+        expect_root (bool): Treat a non-root adbd as a problem (e.g. after adbd restarted).
+    Returns:
+        dict: 'healthy' (bool) and 'problem' (str, empty if healthy).
+    """
+    code, state = _adb(serial, ["get-state"])
+    state = state.strip()
+    if code != 0 or state != 'device':
+        if 'unauthorized' in state:
+            return {'healthy': False, 'problem': 'unauthorized'}
+        if 'offline' in state:
+            return {'healthy': False, 'problem': 'offline'}
+        return {'healthy': False, 'problem': f"not available ({state or 'no state'})"}
+
+    _, boot = _adb(serial, ["shell", "getprop", "sys.boot_completed"])
+    if boot.strip() != '1':
+        return {'healthy': False, 'problem': 'boot not completed'}
+
+    _, uid = _adb(serial, ["shell", "id", "-u"])
+    if expect_root and uid.strip() != '0':
+        return {'healthy': False, 'problem': 'not root'}
+
+    _, focus = _adb(serial, ["shell", "dumpsys", "window", "windows"])
+    for line in focus.split('\n'):
+        if 'mCurrentFocus' in line and 'Application Not Responding: system' in line:
+            return {'healthy': False, 'problem': 'system ANR'}
+
+    return {'healthy': True, 'problem': ''}
+
+
+def ensure_root(serial):
+    """Restarts adbd as root and waits for the device to come back."""
+    code, output = _adb(serial, ["root"])
+    print(f"ADB Root Output:\n{output.strip()}")
+    _adb(serial, ["wait-for-device"], timeout=BOOT_TIMEOUT)
+    return code == 0 or 'already running as root' in output
+
+
+def wait_for_boot(serial, timeout=BOOT_TIMEOUT):
+    """Waits until sys.boot_completed is 1. Returns True on success."""
+    end = time.monotonic() + timeout
+    _adb(serial, ["wait-for-device"], timeout=timeout)
+    while time.monotonic() < end:
+        _, boot = _adb(serial, ["shell", "getprop", "sys.boot_completed"])
+        if boot.strip() == '1':
+            return True
+        time.sleep(5)
+    return False
+
+
+def recover(serial, snapshot=None, expect_root=True):
+    """
+    Tries increasingly expensive recovery steps until the device probes healthy.
+    Args:
+        serial (str): Device serial.
+        snapshot (str): Emulator snapshot to reload before falling back to a reboot.
+        expect_root (bool): Whether the device is expected to run adbd as root.
+    Returns:
+        bool: True if the device is healthy again.
+    """
+    status = probe(serial, expect_root)
+    if status['healthy']:
+        return True
+    print(f"Recovering {serial}: {status['problem']}")
+
+    def dismiss_anr():
+        _adb(serial, ["shell", "input", "keyevent", "KEYCODE_ENTER"])
+
+    def reconnect():
+        deadlines.run(["adb", "reconnect", "offline"], 'shell', capture_output=True)
+        _adb(serial, ["reconnect"])
+        wait_for_boot(serial, 60)
+
+    def root():
+        ensure_root(serial)
+
+    def load_snapshot():
+        _adb(serial, ["emu", "avd", "snapshot", "load", snapshot])
+        wait_for_boot(serial)
+        ensure_root(serial)
+
+    def reboot():
+        _adb(serial, ["reboot"])
+        wait_for_boot(serial)
+        ensure_root(serial)
+
+    steps = [dismiss_anr, reconnect, root]
+    if snapshot:
+        steps.append(load_snapshot)
+    steps.append(reboot)
+
+    for step in steps:
+        print(f"Recovery step for {serial}: {step.__name__}")
+        try:
+            step()
+        except (subprocess.SubprocessError, OSError) as e:
+            print(f"Recovery step {step.__name__} failed: {e}")
+        status = probe(serial, expect_root)
+        if status['healthy']:
+            print(f"{serial} recovered after {step.__name__}.")
+            return True
+    print(f"Could not recover {serial}: {status['problem']}")
+    return False
+
+
+class DeviceFailed(Exception):
+    """Raised when a job stops because its device failed; the job is requeued once the device is recovered."""
+
+
+class HealthMonitor(threading.Thread):
+    """Probes a device in the background and remembers when it last became unhealthy."""
+
+    def __init__(self, serial, interval=PROBE_INTERVAL, expect_root=True):
+        threading.Thread.__init__(self, name=f"health-{serial}", daemon=True)
+        self.serial = serial
+        self.interval = interval
+        self.expect_root = expect_root
+        self.problem = ''
+        self.failed_at = None  # time.monotonic() of the last failure, None while healthy
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            status = probe(self.serial, self.expect_root)
+            if not status['healthy']:
+                self.report(status['problem'])
+            elif self.failed_at is not None:
+                print(f"Device {self.serial} is healthy again (was: {self.problem})")
+                self.reset()
+
+    def report(self, problem):
+        if self.failed_at is None:
+            print(f"Device {self.serial} unhealthy: {problem}")
+            self.problem = problem
+            self.failed_at = time.monotonic()
+
+    def failed(self):
+        """True if the device is unhealthy, whenever it became so."""
+        return self.failed_at is not None
+
+    def reset(self):
+        self.problem = ''
+        self.failed_at = None
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_monitor(serial, interval=PROBE_INTERVAL, expect_root=True):
+    """Starts (once) and returns the background monitor of a device."""
+    with _monitors_lock:
+        if serial not in _monitors:
+            monitor = HealthMonitor(serial, interval, expect_root)
+            monitor.start()
+            _monitors[serial] = monitor
+        return _monitors[serial]
+
+
+def report(serial, output):
+    """
+    Lets command helpers report adb errors; marks the device unhealthy if they show a device problem.
+    Args:
+        serial (str): Device serial.
+        output (str): stderr/stdout of the failed command.
+    """
+    monitor = _monitors.get(serial)
+    if monitor is None or not output:
+        return
+    m = DEVICE_ERRORS.search(output)
+    if m:
+        monitor.report(m.group(0))
+
+
+def check(serial):
+    """
+    Probes a device right away and marks it unhealthy through its monitor if the probe fails. Forked
+    workers have a copy of the monitor but not its probe thread, so they check on their own.
+    Args:
+        serial (str): Device serial.
+    Returns:
+        bool: True if the device is healthy.
+    """
+    monitor = _monitors.get(serial)
+    status = probe(serial, monitor.expect_root if monitor is not None else True)
+    if not status['healthy'] and monitor is not None:
+        monitor.report(status['problem'])
+    return status['healthy']
+
+
+def is_unhealthy(serial):
+    """True if the monitor of the device currently reports a problem."""
+    monitor = _monitors.get(serial)
+    return monitor is not None and monitor.failed_at is not None
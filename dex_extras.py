@@ -0,0 +1,401 @@
+'''
+In-process inference of the intent extras of activities, from the dex code of an APK.
+
+A lightweight alternative to the Soot analysis (run_soot.run): the classes*.dex
+files of the APK are parsed directly and the bytecode of every activity (and of
+its superclasses and inner classes inside the app) is scanned for calls to
+Intent.get*Extra and Bundle.get* whose key is a constant string. The result is
+written in the activity_paras.txt format of Soot ('activity:api__key;...'), so
+explore_activity consumes it unchanged.
+
+Dex files are read from memory-mapped buffers (stored zip entries are mapped in
+place, compressed ones are inflated once) and the dex files of a multidex APK are
+scanned in parallel worker processes. Register tracking is linear: const-string
+values are followed through object moves into the key register, and any other
+instruction writing a register clears it. This covers the common
+getIntent().getStringExtra("key") pattern.
+'''
+
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import soot_runner
+
+# Framework classes whose subclasses are activities (the chain of an app class ends in one of these)
+FRAMEWORK_ACTIVITIES = frozenset((
+    'Landroid/app/Activity;', 'Landroid/app/ListActivity;', 'Landroid/app/TabActivity;',
+    'Landroid/app/ExpandableListActivity;', 'Landroid/app/AliasActivity;', 'Landroid/app/LauncherActivity;',
+    'Landroid/app/NativeActivity;', 'Landroid/app/ActivityGroup;', 'Landroid/preference/PreferenceActivity;',
+    'Landroid/accounts/AccountAuthenticatorActivity;',
+))
+# Classes whose get* methods read extras, and the suffix stripped to get the Soot API name
+EXTRA_READERS = {
+    'Landroid/content/Intent;': 'Extra',  # getStringExtra -> getString
+    'Landroid/os/Bundle;': '',  # getString -> getString
+    'Landroid/os/BaseBundle;': '',
+}
+
+_DEX_ENTRY = re.compile(r'^classes\d*\.dex$')
+_HEADER = struct.Struct('<8x4x20x6I12I')  # Sizes and offsets following magic, checksum and signature
+
+# Code units of each opcode (payload pseudo-instructions are sized separately)
+_SIZES = bytearray(256)
+for _first, _last, _units in (
+        (0x00, 0x01, 1), (0x02, 0x02, 2), (0x03, 0x03, 3), (0x04, 0x04, 1), (0x05, 0x05, 2), (0x06, 0x06, 3),
+        (0x07, 0x07, 1), (0x08, 0x08, 2), (0x09, 0x09, 3), (0x0a, 0x12, 1), (0x13, 0x13, 2), (0x14, 0x14, 3),
+        (0x15, 0x16, 2), (0x17, 0x17, 3), (0x18, 0x18, 5), (0x19, 0x1a, 2), (0x1b, 0x1b, 3), (0x1c, 0x1c, 2),
+        (0x1d, 0x1e, 1), (0x1f, 0x20, 2), (0x21, 0x21, 1), (0x22, 0x23, 2), (0x24, 0x26, 3), (0x27, 0x28, 1),
+        (0x29, 0x29, 2), (0x2a, 0x2c, 3), (0x2d, 0x3d, 2), (0x3e, 0x43, 1), (0x44, 0x6d, 2), (0x6e, 0x72, 3),
+        (0x73, 0x73, 1), (0x74, 0x78, 3), (0x79, 0x8f, 1), (0x90, 0xaf, 2), (0xb0, 0xcf, 1), (0xd0, 0xe2, 2),
+        (0xe3, 0xf9, 1), (0xfa, 0xfb, 4), (0xfc, 0xfd, 3), (0xfe, 0xff, 2)):
+    for _op in range(_first, _last + 1):
+        _SIZES[_op] = _units
+
+# Where each opcode writes its destination register: 0 nothing, 1 vA (low nibble of the high byte),
+# 2 vAA (high byte), 3 vAAAA (second code unit); +4 if it writes a register pair (wide)
+_DEST = bytearray(256)
+for _first, _last, _kind in (
+        (0x01, 0x01, 1), (0x02, 0x02, 2), (0x03, 0x03, 3), (0x04, 0x04, 5), (0x05, 0x05, 6), (0x06, 0x06, 7),
+        (0x07, 0x07, 1), (0x08, 0x08, 2), (0x09, 0x09, 3), (0x0a, 0x0a, 2), (0x0b, 0x0b, 6), (0x0c, 0x0d, 2),
+        (0x12, 0x12, 1), (0x13, 0x15, 2), (0x16, 0x19, 6), (0x1a, 0x1c, 2), (0x1f, 0x1f, 2), (0x20, 0x21, 1),
+        (0x22, 0x22, 2), (0x23, 0x23, 1), (0x2d, 0x31, 2), (0x44, 0x4a, 2), (0x45, 0x45, 6), (0x52, 0x58, 1),
+        (0x53, 0x53, 5), (0x60, 0x66, 2), (0x61, 0x61, 6), (0x7b, 0x8f, 1), (0x7d, 0x7e, 5), (0x80, 0x81, 5),
+        (0x83, 0x83, 5), (0x86, 0x86, 5), (0x88, 0x89, 5), (0x8b, 0x8b, 5), (0x90, 0xaf, 2), (0x9b, 0xa5, 6),
+        (0xab, 0xaf, 6), (0xb0, 0xcf, 1), (0xbb, 0xc5, 5), (0xcb, 0xcf, 5), (0xd0, 0xd7, 1), (0xd8, 0xe2, 2),
+        (0xfe, 0xff, 2)):
+    for _op in range(_first, _last + 1):
+        _DEST[_op] = _kind
+
+
+class DexFile(object):
+    """Read-only view of the tables of one dex file held in a buffer (bytes or mmap)."""
+
+    def __init__(self, buf):
+        if bytes(buf[:3]) != b'dex':
+            raise ValueError('not a dex file')
+        self.buf = buf
+        (self.string_ids_size, self.string_ids_off, self.type_ids_size, self.type_ids_off, _, _, _, _,
+         self.method_ids_size, self.method_ids_off, self.class_defs_size,
+         self.class_defs_off) = _HEADER.unpack_from(buf, 0)[6:]
+        self._strings = {}
+
+    def string(self, idx):
+        """Returns string idx (MUTF-8, decoded leniently)."""
+        s = self._strings.get(idx)
+        if s is None:
+            off = struct.unpack_from('<I', self.buf, self.string_ids_off + idx * 4)[0]
+            _, off = _uleb128(self.buf, off) # utf16 length
+            end = off
+            while self.buf[end]:
+                end += 1
+            s = self._strings[idx] = bytes(self.buf[off:end]).decode('utf-8', errors='replace')
+        return s
+
+    def type_name(self, idx):
+        """Returns the descriptor of type idx (e.g. 'Landroid/content/Intent;')."""
+        return self.string(struct.unpack_from('<I', self.buf, self.type_ids_off + idx * 4)[0])
+
+    def method(self, idx):
+        """Returns (class descriptor, method name) of method idx."""
+        class_idx, _, name_idx = struct.unpack_from('<HHI', self.buf, self.method_ids_off + idx * 8)
+        return self.type_name(class_idx), self.string(name_idx)
+
+    def classes(self):
+        """Yields (descriptor, superclass descriptor or None, class_data_off) of every class defined here."""
+        for i in range(self.class_defs_size):
+            class_idx, _, super_idx, _, _, _, data_off, _ = struct.unpack_from(
+                '<8I', self.buf, self.class_defs_off + i * 32)
+            yield self.type_name(class_idx), (self.type_name(super_idx) if super_idx != 0xffffffff else None), \
+                data_off
+
+    def code_offsets(self, data_off):
+        """Returns the code_item offsets of the methods of a class_data_item."""
+        if not data_off:
+            return []
+        sizes = []
+        off = data_off
+        for _ in range(4):
+            n, off = _uleb128(self.buf, off)
+            sizes.append(n)
+        for _ in range(sizes[0] + sizes[1]): # Fields: index diff and access flags
+            _, off = _uleb128(self.buf, off)
+            _, off = _uleb128(self.buf, off)
+        offsets = []
+        for _ in range(sizes[2] + sizes[3]): # Methods: index diff, access flags and code offset
+            _, off = _uleb128(self.buf, off)
+            _, off = _uleb128(self.buf, off)
+            code_off, off = _uleb128(self.buf, off)
+            if code_off:
+                offsets.append(code_off)
+        return offsets
+
+
+def _uleb128(buf, off):
+    result = shift = 0
+    while True:
+        b = buf[off]
+        off += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, off
+        shift += 7
+
+
+def _extra_readers(dex):
+    """Maps the method ids of the extras getters referenced by a dex file to their Soot API names."""
+    readers = {}
+    for idx in range(dex.method_ids_size):
+        class_idx = struct.unpack_from('<H', dex.buf, dex.method_ids_off + idx * 8)[0]
+        descriptor = dex.type_name(class_idx)
+        if descriptor not in EXTRA_READERS:
+            continue
+        name = dex.method(idx)[1]
+        suffix = EXTRA_READERS[descriptor]
+        if name.startswith('get') and name.endswith(suffix) and len(name) > 3 + len(suffix):
+            readers[idx] = name[:len(name) - len(suffix)] if suffix else name
+    return readers
+
+
+def scan_code(dex, code_off, readers):
+    """
+    Scans one method for extras reads with a constant key.
+    Args:
+        dex (DexFile): Dex file of the method.
+        code_off (int): Offset of its code_item.
+        readers (dict): Method id -> API name, from _extra_readers.
+    Returns:
+        set: 'api__key' strings.
+    """
+    buf = dex.buf
+    insns_size = struct.unpack_from('<I', buf, code_off + 12)[0]
+    pc = code_off + 16
+    end = pc + insns_size * 2
+    consts = {} # register -> string id of its last const-string
+    found = set()
+    while pc < end:
+        op = buf[pc]
+        high = buf[pc + 1]
+        if op == 0x00 and high: # Payload of a switch or fill-array-data: skip it whole
+            if high == 0x01:
+                units = struct.unpack_from('<H', buf, pc + 2)[0] * 2 + 4
+            elif high == 0x02:
+                units = struct.unpack_from('<H', buf, pc + 2)[0] * 4 + 2
+            elif high == 0x03:
+                width, count = struct.unpack_from('<HI', buf, pc + 2)
+                units = (width * count + 1) // 2 + 4
+            else:
+                units = 1
+            pc += units * 2
+            continue
+        kind = _DEST[op]
+        if kind:
+            # Every write ends what the register held; const-string and move-object then set it again
+            if kind & 3 == 1:
+                dest = high & 0xf
+            elif kind & 3 == 2:
+                dest = high
+            else:
+                dest = struct.unpack_from('<H', buf, pc + 2)[0]
+            source = None
+            if op == 0x07: # move-object vA, vB
+                source = consts.get(high >> 4)
+            elif op == 0x08: # move-object/from16 vAA, vBBBB
+                source = consts.get(struct.unpack_from('<H', buf, pc + 2)[0])
+            elif op == 0x09: # move-object/16 vAAAA, vBBBB
+                source = consts.get(struct.unpack_from('<H', buf, pc + 4)[0])
+            consts.pop(dest, None)
+            if kind & 4:
+                consts.pop(dest + 1, None)
+            if op == 0x1a: # const-string vAA, string@BBBB
+                consts[dest] = struct.unpack_from('<H', buf, pc + 2)[0]
+            elif op == 0x1b: # const-string/jumbo vAA, string@BBBBBBBB
+                consts[dest] = struct.unpack_from('<I', buf, pc + 2)[0]
+            elif source is not None:
+                consts[dest] = source
+        elif 0x6e <= op <= 0x72: # invoke-kind {vC, vD, vE, vF, vG}, meth@BBBB
+            method_idx, regs = struct.unpack_from('<HH', buf, pc + 2)
+            if method_idx in readers and high >> 4 >= 2:
+                key_reg = (regs >> 4) & 0xf # The key is the first argument after the receiver
+                if key_reg in consts:
+                    found.add(f"{readers[method_idx]}__{dex.string(consts[key_reg])}")
+        elif 0x74 <= op <= 0x78: # invoke-kind/range {vCCCC .. vNNNN}, meth@BBBB
+            method_idx, first = struct.unpack_from('<HH', buf, pc + 2)
+            if method_idx in readers and high >= 2 and first + 1 in consts:
+                found.add(f"{readers[method_idx]}__{dex.string(consts[first + 1])}")
+        pc += _SIZES[op] * 2
+    return found
+
+
+def _open_entry(apk_path, entry):
+    """
+    Returns a buffer holding one dex entry of an APK: a memory map of the APK sliced to the entry if it
+    is stored, else the inflated bytes.
+    """
+    with zipfile.ZipFile(apk_path) as z:
+        info = z.getinfo(entry)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return z.read(entry)
+    with open(apk_path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    name_len, extra_len = struct.unpack_from('<HH', mapped, info.header_offset + 26)
+    start = info.header_offset + 30 + name_len + extra_len
+    return memoryview(mapped)[start:start + info.file_size]
+
+
+def scan_dex(apk_path, entry, wanted=None):
+    """
+    Reads one dex file of an APK.
+    Args:
+        apk_path (str): APK path (or the path of a plain .dex file, with entry None).
+        entry (str): Name of the dex entry in the APK.
+        wanted (set): Class descriptors to scan for extras; None only lists the class hierarchy.
+    Returns:
+        tuple: (class descriptor -> superclass descriptor, class descriptor -> set of 'api__key').
+    """
+    if entry is None:
+        with open(apk_path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        buf = _open_entry(apk_path, entry)
+    dex = DexFile(buf)
+    supers = {}
+    reads = {}
+    readers = _extra_readers(dex) if wanted else {}
+    for descriptor, superclass, data_off in dex.classes():
+        supers[descriptor] = superclass
+        if readers and descriptor in wanted:
+            found = set()
+            for code_off in dex.code_offsets(data_off):
+                found |= scan_code(dex, code_off, readers)
+            if found:
+                reads[descriptor] = found
+    return supers, reads
+
+
+def dex_entries(apk_path):
+    """Lists the classes*.dex entries of an APK, classes.dex first."""
+    with zipfile.ZipFile(apk_path) as z:
+        names = [n for n in z.namelist() if _DEX_ENTRY.match(n)]
+    return sorted(names, key=lambda n: (len(n), n))
+
+
+def _outer(descriptor):
+    """Descriptor of the outermost class of a nested class ('Lcom/x/Main$1;' -> 'Lcom/x/Main;')."""
+    return descriptor.split('$', 1)[0] + ';' if '$' in descriptor else descriptor
+
+
+def activity_classes(supers):
+    """
+    Finds the activities among the classes of an app.
+    Args:
+        supers (dict): Class descriptor -> superclass descriptor, over all dex files.
+    Returns:
+        dict: Activity descriptor -> list of its app superclasses (itself first).
+    """
+    activities = {}
+    for descriptor in supers:
+        chain = []
+        current = descriptor
+        while current in supers and current not in chain:
+            chain.append(current)
+            current = supers[current]
+        if current in FRAMEWORK_ACTIVITIES:
+            activities[descriptor] = chain
+    return activities
+
+
+def infer_extras(apk_path, workers=None):
+    """
+    Infers the extras read by each activity of an APK.
+    Args:
+        apk_path (str): Path to the APK.
+        workers (int): Processes for multidex APKs, defaults to one per dex file (at most the CPU count).
+    Returns:
+        dict: Activity class name (dotted) -> sorted list of 'api__key'.
+    """
+    entries = dex_entries(apk_path)
+    if not entries:
+        return {}
+    workers = min(len(entries), workers or os.cpu_count() or 1)
+
+    def scan_all(wanted):
+        if workers == 1:
+            return [scan_dex(apk_path, entry, wanted) for entry in entries]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            return list(pool.map(scan_dex, [apk_path] * len(entries), entries, [wanted] * len(entries)))
+
+    supers = {}
+    for dex_supers, _ in scan_all(None):
+        supers.update(dex_supers)
+    activities = activity_classes(supers)
+
+    # Extras read by an activity, its app superclasses and their inner classes (listeners, lambdas)
+    members = set(d for chain in activities.values() for d in chain)
+    wanted = frozenset(d for d in supers if _outer(d) in members)
+    reads = {}
+    for _, dex_reads in scan_all(wanted):
+        for descriptor, found in dex_reads.items():
+            reads.setdefault(_outer(descriptor), set()).update(found)
+
+    extras = {}
+    for descriptor, chain in activities.items():
+        found = set()
+        for member in chain:
+            found |= reads.get(member, set())
+        extras[descriptor[1:-1].replace('/', '.')] = sorted(found)
+    return extras
+
+
+def write_paras(extras, path):
+    """Writes inferred extras in the activity_paras.txt format ('activity:api__key;api__key')."""
+    with open(path, 'w') as f:
+        for activity in sorted(extras):
+            f.write(f"{activity}:{';'.join(extras[activity])}\n")
+
+
+def run_dex_scan(apk_path, apk_name, pkg, storydroid_folder, workers=None):
+    """
+    Infers the extras of an APK and writes its parameters file where Soot would.
+    Args:
+        apk_path (str): Full path to the APK.
+        apk_name (str): APK name, used for the output directory.
+        pkg (str): Package name of the APK.
+        storydroid_folder (str): Root folder of the Soot output directories.
+        workers (int): Processes for multidex APKs.
+    Returns:
+        dict: Same fields as soot_runner.run_soot (status 'success' or 'error').
+    """
+    output_dir = soot_runner.soot_output_dir(storydroid_folder, apk_name)
+    os.makedirs(output_dir, exist_ok=True)
+    result = {'apk_name': apk_name, 'pkg': pkg, 'status': 'error', 'returncode': None, 'duration': 0.0,
+              'paras_path': os.path.join(output_dir, soot_runner.PARAS_FILE)}
+    start = time.time()
+    try:
+        extras = infer_extras(apk_path, workers)
+        write_paras(extras, result['paras_path'])
+        result['status'] = 'success'
+        print(f"Dex scan of {apk_name}: {len(extras)} activities, "
+              f"{sum(1 for keys in extras.values() if keys)} reading extras.")
+    except (zipfile.BadZipFile, ValueError, struct.error, IndexError, OSError) as e:
+        print(f"Error scanning the dex files of {apk_name}: {e}")
+    result['duration'] = round(time.time() - start, 2)
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python dex_extras.py <apk> [activity_paras.txt]")
+        sys.exit(1)
+    inferred = infer_extras(sys.argv[1])
+    if len(sys.argv) > 2:
+        write_paras(inferred, sys.argv[2])
+    else:
+        for name in sorted(inferred):
+            print(f"{name}:{';'.join(inferred[name])}")
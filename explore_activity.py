@@ -4,47 +4,55 @@ Authors: Sen Chen and Lingling Fan
 
 import os
 import shutil
+import threading
 import time
 import csv
+import pickle
 import subprocess # Import the subprocess module
 
-# Global variables, initialized in exploreActivity
-adb = ''
-tmp_dir = ''
-act_paras_file = ''
-defined_pkg_name = ''
-used_pkg_name = ''
-
-def _run_adb_command(command_args, check_output=False, input_data=None):
-    """
-    Helper function to run adb commands using subprocess.
-    Automatically handles the global 'adb' variable which contains emulator details.
-    """
-    global adb
-    # Split the adb string (e.g., "adb -s emulator_id") into components
-    adb_parts = adb.split()
-    full_command = adb_parts + command_args
-
-    try:
-        if check_output:
-            # For commands where output is needed
-            result = subprocess.run(full_command, capture_output=True, text=True, check=True, input=input_data)
-            return result.stdout.strip()
-        else:
-            # For commands where only execution is needed
-            subprocess.run(full_command, check=True, input=input_data)
-            return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error running ADB command: {' '.join(full_command)}")
-        print(f"Stdout: {e.stdout}")
-        print(f"Stderr: {e.stderr}")
-        return False
-    except FileNotFoundError:
-        print(f"Error: ADB command not found. Please ensure '{adb_parts[0]}' is in your PATH.")
-        return False
-    except Exception as e:
-        print(f"An unexpected error occurred with ADB: {e}")
-        return False
+import adb_session
+import am_start
+import app_shards
+import deadlines
+import device_agent
+import device_health
+import install_manager
+import launch_history
+import screen_states
+import settle
+import ui_targets
+import version_delta
+
+# Run options, copied into every ExplorationSession when it is created
+# Warm launch mode: reuse the running app process between activities (am start -W without -S)
+warm_launch = False
+LAUNCH_SETTLE = 0.5 # seconds for asynchronous content after 'am start -W' reported the launch complete
+
+# On-device helper agent (optional): launches, idle waits and hierarchy dumps in one round trip
+agent_port = None # Local port forwarded to the agent, None disables it
+agent_apk = '' # Helper APK, installed if the agent is missing on the device
+
+# In-activity exploration (optional): tap through the screens of each activity and scan the new ones
+deep_explore = False
+STATE_DUMP_PATH = '/sdcard/xbot_state.xml'
+
+# Lazy extras (optional): activities that fail without extras are retried once the app was analysed for them
+RETRY_WITH_EXTRAS = ('abnormal', am_start.CRASHED) # Crashed or finished at once, typical of missing extras
+
+# Intra-app sharding (optional): further devices exploring the activities of the same app
+shard_devices = [] # Serials besides the main device; apps with app_shards.MIN_ACTIVITIES or more are sharded
+
+# Helper agents outlive the sessions of a device: serial -> (AgentClient or None, 'am instrument' process, port)
+_agents = {}
+_agents_lock = threading.Lock()
+
+def _adb_timeout_class(command_args):
+    """Picks the deadlines timeout class of an adb command."""
+    if command_args and command_args[0] in ('install', 'uninstall'):
+        return 'install'
+    if command_args and command_args[0] in ('pull', 'push'):
+        return 'pull'
+    return 'shell'
 
 def _run_shell_command(cmd, check_output=False, capture_stderr=False):
     """
@@ -53,13 +61,20 @@ def _run_shell_command(cmd, check_output=False, capture_stderr=False):
     """
     try:
         if check_output:
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, check=True)
+            result = adb_session.run(cmd, lambda: deadlines.run(
+                cmd, 'shell', shell=True, capture_output=True, check=True))
             return result.stdout.strip()
         else:
-            result = subprocess.run(cmd, shell=True, capture_output=capture_stderr, text=True, check=True)
+            result = adb_session.run(cmd, lambda: deadlines.run(
+                cmd, 'shell', shell=True, capture_output=capture_stderr, check=True))
             if capture_stderr and result.stderr:
                 print(f"Stderr: {result.stderr.strip()}")
             return True
+    except deadlines.BudgetExpired:
+        raise
+    except subprocess.TimeoutExpired:
+        print(f"Shell command timed out and was killed: {cmd}")
+        return False
     except subprocess.CalledProcessError as e:
         print(f"Error running shell command: {cmd}")
         print(f"Stdout: {e.stdout}")
@@ -72,68 +87,6 @@ def _run_shell_command(cmd, check_output=False, capture_stderr=False):
         print(f"An unexpected error occurred with shell command: {e}")
         return False
 
-def installAPP(new_apkpath, apk_name, results_folder):
-    """
-    Installs an APK on the connected device/emulator.
-    Args:
-        new_apkpath (str): Path to the APK file.
-        apk_name (str): Name of the APK (for logging).
-        results_folder (str): Folder to save install error logs.
-    Returns:
-        str: 'Success' or 'Failure'.
-    """
-    appPath = new_apkpath
-    get_pkgname(appPath)
-
-    print(f"Installing {apk_name}...")
-    result_output = _run_adb_command(["install", "-r", appPath], check_output=True)
-
-    if result_output is False: # Command execution failed entirely
-        print(f"Install command failed for {apk_name}.")
-        with open(os.path.join(results_folder, 'installError.csv'), 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow((apk_name, "Command execution error"))
-        return 'Failure'
-
-    for o in result_output.split('\n'):
-        if 'Failure' in o or 'Error' in o:
-            print(f'Install failure: {apk_name}')
-            print(result_output)
-            with open(os.path.join(results_folder, 'installError.csv'), 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow((apk_name, result_output.replace('\n', ', ')))
-            return 'Failure'
-    print('Install Success')
-    return 'Success'
-
-def uninstallApp(package):
-    """
-    Uninstalls an application from the device/emulator.
-    Args:
-        package (str): Package name of the app to uninstall.
-    """
-    print(f"Uninstalling {package}...")
-    _run_adb_command(["uninstall", package])
-
-# def take_screenshot(act, appname):
-#     # This function was commented out, so no changes needed for now.
-#     pass
-
-def scan_and_return():
-    """
-    Simulates taps on the device screen for scanning and returning.
-    """
-    print("Performing scan and return taps...")
-    time.sleep(1)
-    _run_adb_command(["shell", "input", "tap", "945", "1650"]) # Scan
-    time.sleep(5)
-    _run_adb_command(["shell", "input", "tap", "910", "128"]) # Share
-    time.sleep(1)
-    _run_adb_command(["shell", "input", "tap", "654", "1078"]) # Cancel
-    time.sleep(1)
-    _run_adb_command(["shell", "input", "tap", "540", "1855"]) # Back (Home or Back button depending on context)
-    time.sleep(1)
-
 def clean_tmp_folder(folder):
     """
     Cleans up a temporary folder.
@@ -190,170 +143,6 @@ def unzip(zipfile, activity):
     else:
         print(f"Warning: Issue folder not found after unzip: {issue_folder}")
 
-def collect_results(activity, appname, accessibility_folder, results_outputs):
-    """
-    Collects scan results (issues and screenshots) from the device.
-    Args:
-        activity (str): Current activity name.
-        appname (str): Application name.
-        accessibility_folder (str): Base folder for accessibility results.
-        results_outputs (str): Folder to store final results.
-    """
-    scanner_pkg = 'com.google.android.apps.accessibility.auditor'
-    print('Collecting scan results from device...')
-
-    tmp_folder = os.path.join(accessibility_folder, tmp_dir)
-    os.makedirs(tmp_folder, exist_ok=True) # Ensure tmp_folder exists
-
-    # Pull issues and rename
-    issue_path = os.path.join(results_outputs, appname, 'issues')
-    os.makedirs(issue_path, exist_ok=True)
-
-    _run_adb_command(["pull", f"/data/data/{scanner_pkg}/cache/export/", tmp_folder])
-
-    zip_folder = os.path.join(tmp_folder, "export")
-    if os.path.exists(zip_folder):
-        for zip_file in os.listdir(zip_folder):
-            if zip_file.endswith('.zip'):
-                src_zip_path = os.path.join(zip_folder, zip_file)
-                dest_zip_path = os.path.join(issue_path, f"{activity}.zip")
-                _run_shell_command(f'mv "{src_zip_path}" "{dest_zip_path}"')
-
-    clean_tmp_folder(tmp_folder)
-
-    if os.path.exists(os.path.join(issue_path, f"{activity}.zip")):
-        unzip(os.path.join(issue_path, f"{activity}.zip"), activity)
-
-    # Pull screenshot and rename
-    screenshot_path = os.path.join(results_outputs, appname, 'screenshot')
-    os.makedirs(screenshot_path, exist_ok=True)
-
-    _run_adb_command(["pull", f"/data/data/{scanner_pkg}/files/screenshots/", tmp_folder])
-
-    for png_file in os.listdir(tmp_folder):
-        if png_file.endswith('.png') and not png_file.endswith('thumbnail.png'):
-            src_png_path = os.path.join(tmp_folder, png_file)
-            dest_png_path = os.path.join(screenshot_path, f"{activity}.png")
-            _run_shell_command(f'mv "{src_png_path}" "{dest_png_path}"')
-    clean_tmp_folder(tmp_folder)
-
-    # Clean up device results
-    _run_adb_command(["shell", "rm", "-rf", f"/data/data/{scanner_pkg}/cache/export/"])
-    _run_adb_command(["shell", "rm", "-rf", f"/data/data/{scanner_pkg}/files/screenshots"])
-
-def check_current_screen():
-    """
-    Checks the current resumed activity and logcat for errors/exceptions.
-    Returns:
-        bool: True if screen is normal, False otherwise.
-    """
-    resumed_activity_output = _run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mResumedActivity"], check_output=True)
-    error_log_output = _run_adb_command(["logcat", "-t", "100", "|", "grep", "Error"], check_output=True)
-    exception_log_output = _run_adb_command(["logcat", "-t", "100", "|", "grep", "Exception"], check_output=True)
-
-    if (error_log_output and 'Error:' in error_log_output) or \
-       (exception_log_output and 'Exception:' in exception_log_output) or \
-       (resumed_activity_output and 'com.android.launcher3' in resumed_activity_output):
-        return False
-    return True
-
-def check_current_screen_new(activity, appname, results_outputs):
-    """
-    Dumps UI XML to check for crash keywords or permission dialogs.
-    Args:
-        activity (str): Current activity name.
-        appname (str): Application name.
-        results_outputs (str): Folder to store layout XMLs.
-    Returns:
-        str: 'normal' if screen is normal, 'abnormal' if crash or permission dialog handled.
-    """
-    keywords = ['has stopped', 'isn\'t responding', 'keeps stopping']
-
-    layout_path_dir = os.path.join(results_outputs, appname, 'layouts')
-    os.makedirs(layout_path_dir, exist_ok=True)
-    xml_filename = f"{activity}.xml"
-    device_xml_path = f"/sdcard/{xml_filename}"
-    local_xml_path = os.path.join(layout_path_dir, xml_filename)
-
-    print(f"Dumping UI automator XML to {local_xml_path}...")
-    _run_adb_command(["shell", "uiautomator", "dump", device_xml_path])
-    _run_adb_command(["pull", device_xml_path, layout_path_dir])
-    _run_adb_command(["shell", "rm", device_xml_path])
-
-    # Check whether it crashes
-    if not os.path.exists(local_xml_path):
-        print(f"Warning: XML file not found at {local_xml_path}. Assuming abnormal state.")
-        return 'abnormal'
-
-    with open(local_xml_path, 'r') as f:
-        xml_content = f.read()
-
-    for word in keywords:
-        if word in xml_content:
-            print(f"Crash keyword '{word}' found in XML. Removing {local_xml_path}.")
-            try:
-                os.remove(local_xml_path)
-            except OSError as e:
-                print(f"Error removing XML file {local_xml_path}: {e}")
-            return 'abnormal'
-
-    # Check whether it is a permission dialog
-    if 'ALLOW' in xml_content.upper() and 'DENY' in xml_content.upper():
-        print("Permission dialog detected. Tapping ALLOW.")
-        _run_adb_command(["shell", "input", "tap", "780", "1080"]) # Tap ALLOW
-        time.sleep(1)
-        resumed_activity_output = _run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mResumedActivity"], check_output=True)
-        focused_activity_output = _run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mFocusedActivity"], check_output=True)
-        if 'com.android.launcher3' not in resumed_activity_output and 'com.android.launcher3' not in focused_activity_output:
-            return 'normal'
-        else:
-            print("After tapping ALLOW, still on launcher or an abnormal state. Removing {local_xml_path}.")
-            try:
-                os.remove(local_xml_path)
-            except OSError as e:
-                print(f"Error removing XML file {local_xml_path}: {e}")
-            return 'abnormal'
-
-    resumed_activity_output = _run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mResumedActivity"], check_output=True)
-    focused_activity_output = _run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mFocusedActivity"], check_output=True)
-    if 'com.android.launcher3' not in resumed_activity_output and 'com.android.launcher3' not in focused_activity_output:
-        return 'normal'
-    else:
-        print(f"Currently on launcher or an abnormal state. Removing {local_xml_path}.")
-        try:
-            os.remove(local_xml_path)
-        except OSError as e:
-            print(f"Error removing XML file {local_xml_path}: {e}")
-        return 'abnormal'
-
-def explore(activity, appname, results_folder, results_outputs):
-    """
-    Explores a given activity, performs scans, and collects results if the screen is normal.
-    Args:
-        activity (str): Activity to explore.
-        appname (str): Application name.
-        results_folder (str): Base results folder.
-        results_outputs (str): Folder for specific outputs.
-    """
-    current = check_current_screen_new(activity, appname, results_outputs)
-    if current == 'abnormal':
-        print(f"Activity {activity} is abnormal. Attempting to recover by tapping home.")
-        _run_adb_command(["shell", "input", "tap", "540", "1855"]) # Tap Home/Back
-        time.sleep(1)
-        return
-
-    if current == 'normal':
-        print(f"Activity {activity} is normal. Performing scan and collecting results.")
-        scan_and_return()
-        collect_results(activity, appname, results_folder, results_outputs)
-
-def clean_logcat():
-    """
-    Clears the device logcat.
-    """
-    print("Cleaning logcat...")
-    _run_adb_command(["logcat", "-c"])
-
 def init_d(activity, d):
     """
     Initializes a dictionary entry for an activity. (This function is not currently used in the main logic)
@@ -363,65 +152,6 @@ def init_d(activity, d):
     d[activity]['category'] = ''
     return d
 
-def extract_activity_action(path):
-    """
-    Extracts activities, actions, and categories from AndroidManifest.xml.
-    Args:
-        path (str): Path to AndroidManifest.xml.
-    Returns:
-        dict: A dictionary mapping activity names to a list of [action, category] pairs.
-    """
-    d = {}
-    flag = 0 # 0: outside activity, 1: inside activity, 2: inside intent-filter
-    current_activity = None
-    action_category_pair = None
-
-    try:
-        with open(path, 'r', encoding='utf-8', errors='ignore') as f: # Use utf-8 and ignore errors for manifest files
-            for line in f:
-                line = line.strip()
-                if line.startswith('<activity'):
-                    activity_name = ''
-                    if 'android:name="' in line:
-                        activity_name = line.split('android:name="')[1].split('"')[0]
-
-                    if activity_name.startswith('.'):
-                        activity_name = used_pkg_name + activity_name
-
-                    if activity_name and used_pkg_name in activity_name:
-                        current_activity = activity_name
-                        if current_activity not in d:
-                            d[current_activity] = []
-                        flag = 1
-                    if line.endswith('/>'):
-                        flag = 0
-                        current_activity = None # Reset current activity if it's a self-closing tag
-                        continue
-
-                elif line.startswith('<intent-filter') and flag == 1:
-                    flag = 2
-                    action_category_pair = ['', '']
-                elif line.startswith('<action') and flag == 2:
-                    if 'android:name="' in line:
-                        action_category_pair[0] = line.split('android:name="')[1].split('"')[0]
-                elif line.startswith('<category') and flag == 2:
-                    if 'android:name="' in line:
-                        action_category_pair[1] = line.split('android:name="')[1].split('"')[0]
-                elif line.startswith('</intent-filter>') and flag == 2:
-                    flag = 1
-                    if current_activity and (action_category_pair[0] or action_category_pair[1]):
-                        d[current_activity].append(action_category_pair)
-                    action_category_pair = None # Reset for next intent-filter
-                elif line.startswith('</activity>'):
-                    flag = 0
-                    current_activity = None # Reset current activity
-    except FileNotFoundError:
-        print(f"AndroidManifest.xml not found at {path}")
-    except Exception as e:
-        print(f"Error parsing AndroidManifest.xml at {path}: {e}")
-
-    return d
-
 def get_full_activity(component):
     """
     Gets the full activity name from a component string.
@@ -437,6 +167,18 @@ def get_full_activity(component):
         activity = act
     return activity
 
+# Soot API -> 'am start' extra flag and the dummy value passed for it
+
+EXTRA_ARGS = {
+    'getString': ('--es', 'test'), 'getStringArray': ('--es', 'test'),
+    'getInt': ('--ei', '1'), 'getIntArray': ('--ei', '1'),
+    'getBoolean': ('--ez', 'False'), 'getBooleanArray': ('--ez', 'False'),
+    'getFloat': ('--ef', '0.1'), 'getFloatArray': ('--ef', '0.1'),
+    'getLong': ('--el', '1'), 'getLongArray': ('--el', '1'),
+}
+
+PARAS_PICKLE_MIN_SIZE = 1024 * 1024 # Parameter files above this size get a pickled index next to them
+
 def convert(api, key, extras):
     """
     Converts API and key to ADB extra parameters.
@@ -447,229 +189,90 @@ def convert(api, key, extras):
     Returns:
         str: Updated extras string.
     """
-    if api == 'getString' or api == 'getStringArray':
-        extras = extras + ' --es ' + key + ' test'
-    elif api == 'getInt' or api == 'getIntArray':
-        extras = extras + ' --ei ' + key + ' 1'
-    elif api == 'getBoolean' or api == 'getBooleanArray':
-        extras = extras + ' --ez ' + key + ' False'
-    elif api == 'getFloat' or api == 'getFloatArray':
-        extras = extras + ' --ef ' + key + ' 0.1'
-    elif api == 'getLong' or api == 'getLongArray':
-        extras = extras + ' --el ' + key + ' 1'
+    if api in EXTRA_ARGS:
+        flag, value = EXTRA_ARGS[api]
+        extras = extras + ' ' + flag + ' ' + key + ' ' + value
     return extras
 
-def get_act_extra_paras(activity):
+def parse_act_extra_paras(path):
     """
-    Gets extra parameters for an activity from a predefined file.
+    Parses a Soot activity parameters file into prebuilt 'am start' arguments.
     Args:
-        activity (str): Activity name.
+        path (str): Path to activity_paras.txt ('activity:api__key;api__key' per line).
     Returns:
-        str: Extra parameters string or None if not found/empty.
+        dict: Activity name -> list of extras arguments (empty list if the activity takes none).
     """
-    if not os.path.exists(act_paras_file):
-        print(f"Warning: Activity parameters file not found at {act_paras_file}")
-        return None
-
-    try:
-        with open(act_paras_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                parts = line.split(":", 1)
-                if len(parts) == 2 and parts[0] == activity:
-                    paras = parts[1].strip()
-                    if not paras:
-                        return ''
-                    extras = ''
-                    for each_para in paras.split(';'):
-                        if '__' in each_para:
-                            api, key = each_para.split('__', 1)
-                            extras = convert(api, key, extras)
-                    return extras
-    except Exception as e:
-        print(f"Error reading activity parameters file {act_paras_file}: {e}")
-    return None
-
-def startAct(component, action, cate, appname, results_folder, results_outputs):
+    index = {}
+    with open(path, 'r', errors='ignore') as f:
+        for line in f:
+            parts = line.strip().split(":", 1)
+            if len(parts) != 2 or parts[0] in index:
+                continue # Like the former linear scan, the first line of an activity wins
+            args = []
+            for each_para in parts[1].strip().split(';'):
+                if '__' in each_para:
+                    api, key = each_para.split('__', 1)
+                    if api in EXTRA_ARGS:
+                        flag, value = EXTRA_ARGS[api]
+                        args.extend([flag, key, value])
+            index[parts[0]] = args
+    return index
+
+def load_act_extra_paras(path):
     """
-    Starts an activity on the device/emulator.
+    Loads the activity parameters index once per APK, using a pickled copy for large files.
     Args:
-        component (str): Component name (package/activity).
-        action (str): Action to start with.
-        cate (str): Category to start with.
-        appname (str): Application name.
-        results_folder (str): Base results folder.
-        results_outputs (str): Folder for specific outputs.
+        path (str): Path to the activity parameters file.
     Returns:
-        str: Status from explore function ('normal' or 'abnormal').
+        dict: Activity name -> list of extras arguments.
     """
-    clean_logcat()
-    cmd_args = ["shell", "am", "start", "-S", "-n", component]
-
-    if action:
-        cmd_args.extend(["-a", action])
-    if cate:
-        cmd_args.extend(["-c", cate])
-
-    activity = get_full_activity(component)
-    extras = get_act_extra_paras(activity)
-
-    if extras is not None and extras: # Check if extras is not None and not empty string
-        cmd_args.extend(extras.split()) # Split extras string into individual arguments
+    if not path or not os.path.exists(path):
+        print(f"Warning: Activity parameters file not found at {path}")
+        return {}
+
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    pickle_path = path + '.pickle'
+    if st.st_size >= PARAS_PICKLE_MIN_SIZE and os.path.exists(pickle_path):
+        try:
+            with open(pickle_path, 'rb') as f:
+                cached_stamp, index = pickle.load(f)
+            if cached_stamp == stamp:
+                return index
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError) as e:
+            print(f"Ignoring unreadable parameters index {pickle_path}: {e}")
 
-    print(f"Starting activity: {' '.join(cmd_args)}")
-    _run_adb_command(cmd_args)
-    time.sleep(3)
+    try:
+        index = parse_act_extra_paras(path)
+    except Exception as e:
+        print(f"Error reading activity parameters file {path}: {e}")
+        return {}
 
-    return explore(activity, appname, results_folder, results_outputs)
+    if st.st_size >= PARAS_PICKLE_MIN_SIZE:
+        try:
+            with open(pickle_path, 'wb') as f:
+                pickle.dump((stamp, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            print(f"Error writing parameters index {pickle_path}: {e}")
+    print(f"Loaded extras for {len(index)} activities from {path}")
+    return index
 
-def save_activity_to_csv(results_folder, apk_name, all_act_num, launched_act_num, act_not_launched, act_num_with_issue):
+def save_extras_retry(results_folder, apk_name, failed, retried, launched):
     """
-    Saves activity exploration statistics to a CSV file.
+    Appends the lazy extras outcome of an app to extras_retry.csv.
     Args:
         results_folder (str): Base results folder.
         apk_name (str): APK name.
-        all_act_num (int): Total number of activities.
-        launched_act_num (int): Number of launched activities.
-        act_not_launched (int): Number of activities not launched.
-        act_num_with_issue (int): Number of activities with accessibility issues.
+        failed (int): Activities that failed without extras.
+        retried (int): Activities the analysis found extras for, launched again.
+        launched (int): Retried activities that launched.
     """
-    csv_file = os.path.join(results_folder, 'log.csv')
-    # Use 'a' for append mode, newline='' to prevent blank rows on Windows
+    csv_file = os.path.join(results_folder, 'extras_retry.csv')
     with open(csv_file, 'a', newline='') as f:
         writer = csv.writer(f)
-        # Write header if file is empty
         if os.stat(csv_file).st_size == 0:
-            writer.writerow(('apk_name', 'pkg_name', 'all_act_num', 'launched_act_num', 'act_not_launched', 'act_num_with_issue'))
-        writer.writerow((apk_name, used_pkg_name, all_act_num, launched_act_num, act_not_launched, act_num_with_issue))
-    print(f"Saved activity stats to {csv_file}")
-
-def parseManifest(new_apkpath, apk_name, results_folder, decompilePath, results_outputs):
-    """
-    Parses AndroidManifest.xml to extract activities and explore them.
-    Args:
-        new_apkpath (str): Path to the repackaged APK.
-        apk_name (str): APK name.
-        results_folder (str): Base results folder.
-        decompilePath (str): Path to the decompiled app.
-        results_outputs (str): Folder for specific outputs.
-    """
-    print(f"Parsing {apk_name}...")
-
-    if not os.path.exists(new_apkpath):
-        print(f"Cannot find the decompiled app: {apk_name}. Skipping manifest parsing.")
-        return
-
-    manifestPath = os.path.join(decompilePath, apk_name, "AndroidManifest.xml")
-
-    if not os.path.exists(manifestPath):
-        print(f"There is no AndroidManifest file for: {apk_name}. Skipping manifest parsing.")
-        return
-
-    pairs = extract_activity_action(manifestPath)
-    all_activity_num = len(pairs.keys())
-    print(f"Found {all_activity_num} activities in {apk_name}.")
-
-    launched_activities = set() # To track successfully launched unique activities
-
-    for activity, intent_filters in pairs.items():
-        component = f"{defined_pkg_name}/{activity}"
-        
-        # Try launching with specific actions/categories first
-        launched_with_intent_filter = False
-        if intent_filters:
-            for s in intent_filters:
-                action = s[0]
-                category = s[1]
-                status = startAct(component, action, category, apk_name, results_folder, results_outputs)
-                if status == 'normal':
-                    launched_activities.add(activity)
-                    launched_with_intent_filter = True
-                    break # Break after first successful launch with intent filter
-
-        # If not launched with specific intent filters, or no intent filters, try without
-        if not launched_with_intent_filter:
-            status = startAct(component, '', '', apk_name, results_folder, results_outputs)
-            if status == 'normal':
-                launched_activities.add(activity)
-
-    # Get statistics
-    launched_act_num = len(launched_activities)
-    act_not_launched = all_activity_num - launched_act_num
-
-    # Count activities with issues by checking issue folder
-    issues_folder_for_app = os.path.join(results_outputs, apk_name, 'issues')
-    act_num_with_issue = 0
-    if os.path.exists(issues_folder_for_app):
-        # Count only non-empty folders inside 'issues' which indicates an issue for an activity
-        # Assuming each issue dump creates a subfolder or zip file for an activity
-        # The unzip function already places files like activity.txt/png directly, so we can count these.
-        for item in os.listdir(issues_folder_for_app):
-            if item.endswith('.txt') or item.endswith('.png'):
-                # This simple check might overcount if both .txt and .png exist for same activity
-                # A more robust check would be to get unique base names (e.g., 'activity_name')
-                activity_base_name = item.rsplit('.', 1)[0]
-                if os.path.exists(os.path.join(issues_folder_for_app, f"{activity_base_name}.txt")) or \
-                   os.path.exists(os.path.join(issues_folder_for_app, f"{activity_base_name}.png")):
-                    act_num_with_issue += 1
-        # To get unique activities with issues:
-        unique_issue_activities = set()
-        for item in os.listdir(issues_folder_for_app):
-            if item.endswith('.txt') or item.endswith('.png') or item.endswith('.zip'):
-                 unique_issue_activities.add(item.rsplit('.', 1)[0])
-        act_num_with_issue = len(unique_issue_activities)
-
-
-    save_activity_to_csv(results_folder, apk_name, all_activity_num, launched_act_num, act_not_launched,
-                         act_num_with_issue)
-    print(f"Parsing of {apk_name} finished!")
-
-
-def get_pkgname(apk_path):
-    """
-    Extracts package names (defined and used) from an APK.
-    Args:
-        apk_path (str): Path to the APK file.
-    """
-    global defined_pkg_name
-    global used_pkg_name
-
-    # Use aapt to get the package name
-    defined_pkg_name = _run_shell_command(
-        f"aapt dump badging '{apk_path}' | grep 'package' | awk -F\"'\" '/package: name=/{{print $2}}'",
-        check_output=True
-    )
-
-    # Use aapt to get the launchable activity and derive used_pkg_name
-    launcher_output = _run_shell_command(
-        f"aapt dump badging \"{apk_path}\" | grep launchable-activity | awk '{{print $2}}'",
-        check_output=True
-    )
-
-    if launcher_output:
-        launcher = launcher_output.strip().strip("'") # Remove potential quotes from awk output
-        if launcher.startswith(".") or defined_pkg_name in launcher:
-            used_pkg_name = defined_pkg_name
-        else:
-            # Handle cases like "com.example.app/com.example.app.MainActivity" or just "com.example.app.MainActivity"
-            # Extract the package part from the activity name
-            parts = launcher.split('.')
-            if len(parts) > 1:
-                # Find the longest prefix that matches a package structure
-                # A common pattern is that the last part is the activity class name
-                # So, we try to reconstruct the package name by removing the last part
-                potential_pkg = '.'.join(parts[:-1])
-                # This is a heuristic, it might need refinement for complex cases
-                used_pkg_name = potential_pkg if defined_pkg_name.startswith(potential_pkg) else defined_pkg_name
-            else:
-                used_pkg_name = defined_pkg_name # Fallback if parsing fails
-    else:
-        used_pkg_name = defined_pkg_name # If no launchable activity, default to defined package name
-
-    print(f"Defined Package Name: {defined_pkg_name}")
-    print(f"Used Package Name: {used_pkg_name}")
+            writer.writerow(('apk_name', 'failed_without_extras', 'retried', 'launched'))
+        writer.writerow((apk_name, failed, retried, launched))
 
 def remove_folder(apkname, decompilePath):
     """
@@ -688,65 +291,1101 @@ def remove_folder(apkname, decompilePath):
     except OSError as e:
         print(f"Error removing folder {folder}: {e}")
 
-def exploreActivity(new_apkpath, apk_name, results_folder, emulator, tmp_file, storydroid_file):
+class ExplorationSession(object):
     """
-    Main function to explore activities of a given APK.
-    Args:
-        new_apkpath (str): Path to the repackaged APK to explore.
-        apk_name (str): Name of the APK.
-        results_folder (str): Base results folder for the entire process.
-        emulator (str): Emulator ID (e.g., "emulator-5554").
-        tmp_file (str): Temporary directory name within accessibility_folder.
-        storydroid_file (str): Path to the activity parameters file (act_paras_file).
+    Exploration of one APK on one device.
+
+    A session owns everything that belongs to a single run: the device serial and
+    its adb transport, the tmp folder, the package names of the app and its extras
+    index. Sessions share no mutable state, so several of them can run at once in
+    threads or processes (each on its own device). The run options start from the
+    module-level defaults and may be changed on the instance before exploreActivity.
+    Note that adb_session recording and replay stay process-wide.
     """
-    global adb
-    adb = f"adb -s {emulator}" # Set global adb string with emulator ID
 
-    global tmp_dir
-    tmp_dir = tmp_file
+    def __init__(self, emulator, tmp_file='', storydroid_file=''):
+        """
+        Args:
+            emulator (str): Emulator ID (e.g., "emulator-5554").
+            tmp_file (str): Temporary directory name within accessibility_folder.
+            storydroid_file (str): Path to the activity parameters file.
+        """
+        self.adb = f"adb -s {emulator}" # adb prefix of every command of this session
+        self.device_serial = emulator
+        self.device_sdk = None
+        self.ui_device = None # ui_targets.device_key of the device, tap targets are cached under it
+        self.tmp_dir = tmp_file
+        self.act_paras_file = storydroid_file
+        self.act_paras_index = {} # activity -> prebuilt 'am start' extras args, loaded once per APK
+        self.defined_pkg_name = ''
+        self.used_pkg_name = ''
+        self.launcher_activity = ''
+        self.cold_start_next = True # Force-stop before the next launch (first launch of an app, after a crash)
+        self.last_launch = None # 'am start' arguments of the current activity, used to get back to its first screen
+        self.agent = None # device_agent.AgentClient while connected
+        self.extras_provider = None # Lazy extras: callable returning a parameters file path (or None), run on demand
+
+        self.warm_launch = warm_launch
+        self.deep_explore = deep_explore
+        self.agent_port = agent_port
+        self.agent_apk = agent_apk
+        self.shard_devices = list(shard_devices)
+
+    def _run_adb_command(self, command_args, check_output=False, input_data=None):
+        """
+        Helper function to run adb commands using subprocess.
+        Prefixes the command with the adb string of the session, which selects its device.
+        Every command has a watchdog timeout (see deadlines); an expired budget is re-raised.
+        """
+        # Split the adb string (e.g., "adb -s emulator_id") into components
+        adb_parts = self.adb.split()
+        full_command = adb_parts + command_args
+        timeout_class = _adb_timeout_class(command_args)
+        # Files pulled into this host folder are captured when recording a session
+        pull_dest = command_args[-1] if command_args and command_args[0] == 'pull' else None
 
-    global act_paras_file
-    act_paras_file = storydroid_file # Set global activity parameters file path
+        try:
+            if check_output:
+                # For commands where output is needed
+                result = adb_session.run(full_command, lambda: deadlines.run(
+                    full_command, timeout_class, capture_output=True, check=True, input=input_data), pull_dest)
+                return result.stdout.strip()
+            else:
+                # For commands where only execution is needed
+                adb_session.run(full_command, lambda: deadlines.run(
+                    full_command, timeout_class, check=True, input=input_data), pull_dest)
+                return True
+        except deadlines.BudgetExpired:
+            raise
+        except subprocess.TimeoutExpired:
+            print(f"ADB command timed out and was killed: {' '.join(full_command)}")
+            return False
+        except subprocess.CalledProcessError as e:
+            print(f"Error running ADB command: {' '.join(full_command)}")
+            print(f"Stdout: {e.stdout}")
+            print(f"Stderr: {e.stderr}")
+            device_health.report(self.device_serial, e.stderr) # 'device offline' etc. mark the device unhealthy
+            return False
+        except FileNotFoundError:
+            print(f"Error: ADB command not found. Please ensure '{adb_parts[0]}' is in your PATH.")
+            return False
+        except Exception as e:
+            print(f"An unexpected error occurred with ADB: {e}")
+            return False
+
+    def _run_launch_command(self, command_args):
+        """
+        Runs an 'am start' (or 'install') command and returns its output whatever its exit code, since
+        both report failures on stdout/stderr.
+        Returns:
+            str: Combined stdout and stderr, or None if the command timed out.
+        """
+        full_command = self.adb.split() + command_args
+        try:
+            result = adb_session.run(full_command, lambda: deadlines.run(
+                full_command, _adb_timeout_class(command_args), capture_output=True))
+        except deadlines.BudgetExpired:
+            raise
+        except subprocess.TimeoutExpired:
+            print(f"ADB command timed out and was killed: {' '.join(full_command)}")
+            return None
+        except (subprocess.CalledProcessError, OSError) as e:
+            print(f"Error running ADB command: {' '.join(full_command)}: {e}")
+            return ''
+        if result.returncode != 0:
+            device_health.report(self.device_serial, result.stderr) # 'device offline' etc. mark the device unhealthy
+        return ((result.stdout or '') + '\n' + (result.stderr or '')).strip()
+
+    def installAPP(self, new_apkpath, apk_name, results_folder):
+        """
+        Installs an APK on the connected device/emulator.
+        Args:
+            new_apkpath (str): Path to the APK file.
+            apk_name (str): Name of the APK (for logging).
+            results_folder (str): Folder to save install error logs.
+        Returns:
+            str: 'Success' or 'Failure'.
+        """
+        appPath = new_apkpath
+        self.get_pkgname(appPath)
+
+        # Skip the push if exactly this APK is still installed from a previous run
+        digest = install_manager.apk_digest(appPath)
+        if install_manager.is_installed(results_folder, self.device_serial, self.defined_pkg_name, digest, self._run_adb_command):
+            print(f"{apk_name} is already installed with the same digest. Skipping install.")
+            return 'Success'
+
+        print(f"Installing {apk_name}...")
+        install_args = install_manager.install_args(appPath, self.device_sdk)
+        if "--streaming" in install_args:
+            # The output tells streaming errors apart from real install failures, which are not retried
+            result_output = self._run_launch_command(install_args) or False
+            if install_manager.streaming_failed(result_output):
+                print("Streamed install is not supported, retrying with a plain install.")
+                install_args.remove("--streaming")
+                result_output = self._run_adb_command(install_args, check_output=True)
+        else:
+            result_output = self._run_adb_command(install_args, check_output=True)
 
-    decompilePath = os.path.join(results_folder, "apktool")  # Decompiled app path (apktool handled)
-    results_outputs = os.path.join(results_folder, "outputs") # Where screenshots and issues are stored
-    installErrorAppPath = os.path.join(results_folder, "install-error-apks")
+        if result_output is False: # Command execution failed entirely
+            print(f"Install command failed for {apk_name}.")
+            with open(os.path.join(results_folder, 'installError.csv'), 'a', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow((apk_name, "Command execution error"))
+            return 'Failure'
 
-    # Ensure all necessary directories exist
-    os.makedirs(decompilePath, exist_ok=True)
-    os.makedirs(results_outputs, exist_ok=True)
-    os.makedirs(installErrorAppPath, exist_ok=True)
+        for o in result_output.split('\n'):
+            if 'Failure' in o or 'Error' in o or 'failed to install' in o:
+                print(f'Install failure: {apk_name}')
+                print(result_output)
+                with open(os.path.join(results_folder, 'installError.csv'), 'a', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow((apk_name, result_output.replace('\n', ', ')))
+                return 'Failure'
+        install_manager.record_install(results_folder, self.device_serial, self.defined_pkg_name, digest, self._run_adb_command)
+        print('Install Success')
+        return 'Success'
+
+    def uninstallApp(self, package, results_folder):
+        """
+        Uninstalls an application from the device/emulator.
+        Args:
+            package (str): Package name of the app to uninstall.
+            results_folder (str): Base results folder holding the install cache.
+        """
+        print(f"Uninstalling {package}...")
+        self._run_adb_command(["uninstall", package])
+        install_manager.forget_install(results_folder, self.device_serial, package)
+
+    # def take_screenshot(act, appname):
+    #     # This function was commented out, so no changes needed for now.
+    #     pass
+
+    def wait_settled(self, seconds, label, require_change=False):
+        """
+        Waits until the screen is visually stable, at most the given fixed wait (see settle).
+        A plain sleep if the detector is off or a session is recorded or replayed.
+        Args:
+            seconds (float): Fixed wait this replaces.
+            label (str): What is being waited for.
+            require_change (bool): Only count stability after the screen changed once.
+        """
+        if settle.ENABLED and adb_session.mode is None:
+            settle.wait_for_stable(self.device_serial, seconds, label, require_change)
+        else:
+            time.sleep(adb_session.scaled(seconds))
+
+    def scan_and_return(self, results_folder):
+        """
+        Simulates taps on the device screen for scanning and returning.
+        Args:
+            results_folder (str): Base results folder holding the tap target cache.
+        """
+        print("Performing scan and return taps...")
+        time.sleep(adb_session.scaled(1))
+        ui_targets.tap(results_folder, self.ui_device, 'scan', self._run_adb_command)
+        self.wait_settled(5, 'scan', require_change=True) # The scanner needs a moment before its results show
+        ui_targets.tap(results_folder, self.ui_device, 'share', self._run_adb_command)
+        time.sleep(adb_session.scaled(1))
+        ui_targets.tap(results_folder, self.ui_device, 'cancel', self._run_adb_command)
+        time.sleep(adb_session.scaled(1))
+        self._run_adb_command(["shell", "input", "keyevent", "KEYCODE_HOME"]) # Home
+        time.sleep(adb_session.scaled(1))
+
+    def collect_results(self, activity, appname, accessibility_folder, results_outputs):
+        """
+        Collects scan results (issues and screenshots) from the device.
+        Args:
+            activity (str): Current activity name.
+            appname (str): Application name.
+            accessibility_folder (str): Base folder for accessibility results.
+            results_outputs (str): Folder to store final results.
+        """
+        scanner_pkg = 'com.google.android.apps.accessibility.auditor'
+        print('Collecting scan results from device...')
+
+        tmp_folder = os.path.join(accessibility_folder, self.tmp_dir)
+        os.makedirs(tmp_folder, exist_ok=True) # Ensure tmp_folder exists
+
+        # Pull issues and rename
+        issue_path = os.path.join(results_outputs, appname, 'issues')
+        os.makedirs(issue_path, exist_ok=True)
+
+        self._run_adb_command(["pull", f"/data/data/{scanner_pkg}/cache/export/", tmp_folder])
+
+        zip_folder = os.path.join(tmp_folder, "export")
+        if os.path.exists(zip_folder):
+            for zip_file in os.listdir(zip_folder):
+                if zip_file.endswith('.zip'):
+                    src_zip_path = os.path.join(zip_folder, zip_file)
+                    dest_zip_path = os.path.join(issue_path, f"{activity}.zip")
+                    _run_shell_command(f'mv "{src_zip_path}" "{dest_zip_path}"')
+
+        clean_tmp_folder(tmp_folder)
+
+        if os.path.exists(os.path.join(issue_path, f"{activity}.zip")):
+            unzip(os.path.join(issue_path, f"{activity}.zip"), activity)
+
+        # Pull screenshot and rename
+        screenshot_path = os.path.join(results_outputs, appname, 'screenshot')
+        os.makedirs(screenshot_path, exist_ok=True)
+
+        self._run_adb_command(["pull", f"/data/data/{scanner_pkg}/files/screenshots/", tmp_folder])
+
+        for png_file in os.listdir(tmp_folder):
+            if png_file.endswith('.png') and not png_file.endswith('thumbnail.png'):
+                src_png_path = os.path.join(tmp_folder, png_file)
+                dest_png_path = os.path.join(screenshot_path, f"{activity}.png")
+                _run_shell_command(f'mv "{src_png_path}" "{dest_png_path}"')
+        clean_tmp_folder(tmp_folder)
+
+        # Clean up device results
+        self._run_adb_command(["shell", "rm", "-rf", f"/data/data/{scanner_pkg}/cache/export/"])
+        self._run_adb_command(["shell", "rm", "-rf", f"/data/data/{scanner_pkg}/files/screenshots"])
+
+    def check_current_screen(self):
+        """
+        Checks the current resumed activity and logcat for errors/exceptions.
+        Returns:
+            bool: True if screen is normal, False otherwise.
+        """
+        resumed_activity_output = self._run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mResumedActivity"], check_output=True)
+        error_log_output = self._run_adb_command(["logcat", "-t", "100", "|", "grep", "Error"], check_output=True)
+        exception_log_output = self._run_adb_command(["logcat", "-t", "100", "|", "grep", "Exception"], check_output=True)
+
+        if (error_log_output and 'Error:' in error_log_output) or \
+           (exception_log_output and 'Exception:' in exception_log_output) or \
+           (resumed_activity_output and 'com.android.launcher3' in resumed_activity_output):
+            return False
+        return True
+
+    def check_current_screen_new(self, activity, appname, results_outputs, screen=None):
+        """
+        Dumps UI XML to check for crash keywords or permission dialogs.
+        Args:
+            activity (str): Current activity name.
+            appname (str): Application name.
+            results_outputs (str): Folder to store layout XMLs.
+            screen (dict): Launch result of the helper agent, whose hierarchy replaces the dump.
+        Returns:
+            str: 'normal' if screen is normal, 'abnormal' if crash or permission dialog handled.
+        """
+        keywords = ['has stopped', 'isn\'t responding', 'keeps stopping']
+
+        layout_path_dir = os.path.join(results_outputs, appname, 'layouts')
+        os.makedirs(layout_path_dir, exist_ok=True)
+        xml_filename = f"{activity}.xml"
+        device_xml_path = f"/sdcard/{xml_filename}"
+        local_xml_path = os.path.join(layout_path_dir, xml_filename)
+
+        if screen is None:
+            print(f"Dumping UI automator XML to {local_xml_path}...")
+            self._run_adb_command(["shell", "uiautomator", "dump", device_xml_path])
+            self._run_adb_command(["pull", device_xml_path, layout_path_dir])
+            self._run_adb_command(["shell", "rm", device_xml_path])
+        else:
+            # A UI that never went idle (animations) still has a usable hierarchy
+            if screen['status'] not in (device_agent.OK, device_agent.TIMEOUT) or not screen.get('hierarchy'):
+                print(f"Agent reported {screen['status']} for {activity}. {screen.get('crash', '')}")
+                return 'abnormal'
+            print(f"Writing agent hierarchy to {local_xml_path}...")
+            with open(local_xml_path, 'w') as f:
+                f.write(screen['hierarchy'])
+
+        # Check whether it crashes
+        if not os.path.exists(local_xml_path):
+            print(f"Warning: XML file not found at {local_xml_path}. Assuming abnormal state.")
+            return 'abnormal'
 
-    print(f"Starting activity exploration for {apk_name} at {new_apkpath} on {emulator}")
+        with open(local_xml_path, 'r') as f:
+            xml_content = f.read()
+
+        for word in keywords:
+            if word in xml_content:
+                print(f"Crash keyword '{word}' found in XML. Removing {local_xml_path}.")
+                try:
+                    os.remove(local_xml_path)
+                except OSError as e:
+                    print(f"Error removing XML file {local_xml_path}: {e}")
+                return 'abnormal'
+
+        # Check whether it is a permission dialog
+        if 'ALLOW' in xml_content.upper() and 'DENY' in xml_content.upper():
+            print("Permission dialog detected. Tapping ALLOW.")
+            allow = ui_targets.find_target(xml_content, 'allow') or ui_targets.scaled_fallback('allow', self.ui_device['size'])
+            self._run_adb_command(["shell", "input", "tap", str(allow[0]), str(allow[1])]) # Tap ALLOW
+            time.sleep(adb_session.scaled(1))
+            resumed_activity_output = self._run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mResumedActivity"], check_output=True)
+            focused_activity_output = self._run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mFocusedActivity"], check_output=True)
+            if 'com.android.launcher3' not in resumed_activity_output and 'com.android.launcher3' not in focused_activity_output:
+                return 'normal'
+            else:
+                print("After tapping ALLOW, still on launcher or an abnormal state. Removing {local_xml_path}.")
+                try:
+                    os.remove(local_xml_path)
+                except OSError as e:
+                    print(f"Error removing XML file {local_xml_path}: {e}")
+                return 'abnormal'
+
+        if screen is not None and screen.get('package'):
+            # The agent reports the package of the foreground window
+            resumed_activity_output = focused_activity_output = screen['package']
+        else:
+            resumed_activity_output = self._run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mResumedActivity"], check_output=True)
+            focused_activity_output = self._run_adb_command(["shell", "dumpsys", "activity", "activities", "|", "grep", "mFocusedActivity"], check_output=True)
+        if 'com.android.launcher3' not in resumed_activity_output and 'com.android.launcher3' not in focused_activity_output:
+            return 'normal'
+        else:
+            print(f"Currently on launcher or an abnormal state. Removing {local_xml_path}.")
+            try:
+                os.remove(local_xml_path)
+            except OSError as e:
+                print(f"Error removing XML file {local_xml_path}: {e}")
+            return 'abnormal'
 
-    # Install the app
-    result = installAPP(new_apkpath, apk_name, results_folder)
+    def explore(self, activity, appname, results_folder, results_outputs, screen=None):
+        """
+        Explores a given activity, performs scans, and collects results if the screen is normal.
+        Args:
+            activity (str): Activity to explore.
+            appname (str): Application name.
+            results_folder (str): Base results folder.
+            results_outputs (str): Folder for specific outputs.
+            screen (dict): Launch result of the helper agent, if the activity was launched through it.
+        Returns:
+            str: 'normal' or 'abnormal'.
+        """
+        current = self.check_current_screen_new(activity, appname, results_outputs, screen)
+        if current == 'abnormal':
+            print(f"Activity {activity} is abnormal. Attempting to recover by pressing home.")
+            self._run_adb_command(["shell", "input", "keyevent", "KEYCODE_HOME"]) # Home
+            time.sleep(adb_session.scaled(1))
+            return current
+
+        if current == 'normal':
+            print(f"Activity {activity} is normal. Performing scan and collecting results.")
+            self.scan_and_return(results_folder)
+            self.collect_results(activity, appname, results_folder, results_outputs)
+            if self.deep_explore:
+                self.explore_screens(activity, appname, results_folder, results_outputs)
+        return current
+
+    def _dump_screen(self):
+        """Returns the uiautomator hierarchy of the current screen ('' if it cannot be dumped)."""
+        self._run_adb_command(["shell", "uiautomator", "dump", STATE_DUMP_PATH])
+        return self._run_adb_command(["shell", "cat", STATE_DUMP_PATH], check_output=True) or ''
+
+    def explore_screens(self, activity, appname, results_folder, results_outputs):
+        """
+        Explores and scans the further screens of a launched activity (see screen_states).
+        Args:
+            activity (str): Activity whose first screen was just scanned.
+            appname (str): Application name.
+            results_folder (str): Base results folder.
+            results_outputs (str): Folder for specific outputs.
+        """
+        layout_dir = os.path.join(results_outputs, appname, 'layouts')
+        root_xml_path = os.path.join(layout_dir, f"{activity}.xml")
+        if self.last_launch is None or not os.path.exists(root_xml_path):
+            return
+        with open(root_xml_path, 'r') as f:
+            root_xml = f.read()
+
+        def tap(x, y):
+            self._run_adb_command(["shell", "input", "tap", str(x), str(y)])
+            self.wait_settled(screen_states.SETTLE, f"tap in {activity}")
+
+        def back():
+            self._run_adb_command(["shell", "input", "keyevent", "KEYCODE_BACK"])
+            time.sleep(adb_session.scaled(screen_states.SETTLE))
+
+        def relaunch():
+            output = self._run_launch_command(self.last_launch)
+            if self.warm_launch:
+                time.sleep(adb_session.scaled(LAUNCH_SETTLE))
+            else:
+                self.wait_settled(3, f"relaunch of {activity}")
+            return output is not None and am_start.classify(output) == am_start.LAUNCHED
+
+        def scan(state_name, xml_content):
+            with open(os.path.join(layout_dir, f"{state_name}.xml"), 'w') as f:
+                f.write(xml_content)
+            self.scan_and_return(results_folder)
+            self.collect_results(state_name, appname, results_folder, results_outputs)
+
+        ops = {'dump': self._dump_screen, 'tap': tap, 'back': back, 'relaunch': relaunch, 'scan': scan}
+        seconds = screen_states.MAX_SECONDS
+        if deadlines.remaining() is not None:
+            seconds = min(seconds, deadlines.remaining() - 10) # Leave time to get out of the activity
+        stats = {'states': 0, 'actions': 0, 'replays': 0}
+        try:
+            with deadlines.budget('states', seconds, activity):
+                stats = screen_states.explore_states(activity, root_xml, self.defined_pkg_name, ops)
+        except deadlines.BudgetExpired as e:
+            if e.scope != 'states':
+                raise
+            print(f"Stopping the screen exploration of {activity}: {e}")
+        self._run_adb_command(["shell", "input", "keyevent", "KEYCODE_HOME"])
+        print(f"Explored {activity}: {stats['states']} new state(s), {stats['actions']} action(s), "
+              f"{stats['replays']} relaunch(es).")
+
+        csv_file = os.path.join(results_outputs, appname, 'states.csv')
+        with open(csv_file, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if os.stat(csv_file).st_size == 0:
+                writer.writerow(('activity', 'new_states', 'actions', 'relaunches'))
+            writer.writerow((activity, stats['states'], stats['actions'], stats['replays']))
+
+    def clean_logcat(self):
+        """
+        Clears the device logcat.
+        """
+        print("Cleaning logcat...")
+        self._run_adb_command(["logcat", "-c"])
+
+    def extract_activity_action(self, path):
+        """
+        Extracts activities, actions, and categories from AndroidManifest.xml.
+        Args:
+            path (str): Path to AndroidManifest.xml.
+        Returns:
+            dict: A dictionary mapping activity names to a list of [action, category] pairs.
+        """
+        d = {}
+        flag = 0 # 0: outside activity, 1: inside activity, 2: inside intent-filter
+        current_activity = None
+        action_category_pair = None
 
-    if result == 'Failure':
-        print(f"Installation failed for {apk_name}. Moving APK to install error folder.")
-        dest_path = os.path.join(installErrorAppPath, os.path.basename(new_apkpath))
         try:
-            shutil.move(new_apkpath, dest_path)
-            print(f"Moved {os.path.basename(new_apkpath)} to {installErrorAppPath}")
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f: # Use utf-8 and ignore errors for manifest files
+                for line in f:
+                    line = line.strip()
+                    if line.startswith('<activity'):
+                        activity_name = ''
+                        if 'android:name="' in line:
+                            activity_name = line.split('android:name="')[1].split('"')[0]
+
+                        if activity_name.startswith('.'):
+                            activity_name = self.used_pkg_name + activity_name
+
+                        if activity_name and self.used_pkg_name in activity_name:
+                            current_activity = activity_name
+                            if current_activity not in d:
+                                d[current_activity] = []
+                            flag = 1
+                        if line.endswith('/>'):
+                            flag = 0
+                            current_activity = None # Reset current activity if it's a self-closing tag
+                            continue
+
+                    elif line.startswith('<intent-filter') and flag == 1:
+                        flag = 2
+                        action_category_pair = ['', '']
+                    elif line.startswith('<action') and flag == 2:
+                        if 'android:name="' in line:
+                            action_category_pair[0] = line.split('android:name="')[1].split('"')[0]
+                    elif line.startswith('<category') and flag == 2:
+                        if 'android:name="' in line:
+                            action_category_pair[1] = line.split('android:name="')[1].split('"')[0]
+                    elif line.startswith('</intent-filter>') and flag == 2:
+                        flag = 1
+                        if current_activity and (action_category_pair[0] or action_category_pair[1]):
+                            d[current_activity].append(action_category_pair)
+                        action_category_pair = None # Reset for next intent-filter
+                    elif line.startswith('</activity>'):
+                        flag = 0
+                        current_activity = None # Reset current activity
         except FileNotFoundError:
-            print(f"Original APK not found at {new_apkpath} for moving.")
-        except shutil.Error as e:
-            print(f"Error moving APK to install error folder: {e}")
-        return # Exit if installation fails
+            print(f"AndroidManifest.xml not found at {path}")
+        except Exception as e:
+            print(f"Error parsing AndroidManifest.xml at {path}: {e}")
+
+        return d
+
+    def get_act_extra_paras(self, activity):
+        """
+        Gets extra parameters for an activity from the index loaded for the current APK.
+        Args:
+            activity (str): Activity name.
+        Returns:
+            list: Extras arguments for 'am start' (possibly empty) or None if the activity is unknown.
+        """
+        return self.act_paras_index.get(activity)
+
+    def startAct(self, component, action, cate, appname, results_folder, results_outputs):
+        """
+        Starts an activity on the device/emulator.
+        Args:
+            component (str): Component name (package/activity).
+            action (str): Action to start with.
+            cate (str): Category to start with.
+            appname (str): Application name.
+            results_folder (str): Base results folder.
+            results_outputs (str): Folder for specific outputs.
+        Returns:
+            str: Status from explore function ('normal' or 'abnormal'), or the am_start outcome of a failed launch.
+        """
+        self.clean_logcat()
+        warm = self.warm_launch and not self.cold_start_next
+        # -W blocks until the launch is complete and reports its status and how long it took
+        cmd_args = ["shell", "am", "start", "-W", "-n", component]
+        if not warm:
+            cmd_args.insert(4, "-S")
+
+        if action:
+            cmd_args.extend(["-a", action])
+        if cate:
+            cmd_args.extend(["-c", cate])
+
+        activity = get_full_activity(component)
+        extras = self.get_act_extra_paras(activity)
+
+        if extras: # Prebuilt argument list, None if the activity is unknown
+            cmd_args.extend(extras)
+
+        self.last_launch = cmd_args
+        if self.agent is not None:
+            screen = self.launch_with_agent(component, action, cate, extras, not warm)
+            if screen is not None:
+                print(f"Agent launched {component}: {screen['status']} in {screen.get('launch_ms')} ms.")
+                outcome = am_start.LAUNCHED
+                if screen['status'] == device_agent.CRASHED:
+                    outcome = am_start.CRASHED
+                elif screen['status'] in (device_agent.NOT_FOUND, device_agent.ERROR):
+                    outcome = am_start.classify(screen.get('crash', ''))
+                    outcome = outcome if outcome != am_start.LAUNCHED else am_start.FAILED
+                launch = {'status': screen['status'], 'activity': screen.get('activity', ''), 'this_time': None,
+                          'total_time': screen.get('launch_ms'), 'wait_time': None}
+                am_start.save_launch_time(results_outputs, appname, activity, 'warm' if warm else 'cold', launch, outcome)
+                if outcome != am_start.LAUNCHED:
+                    return self.launch_failed(component, outcome)
+                status = self.explore(activity, appname, results_folder, results_outputs, screen)
+                self.cold_start_next = status != 'normal'
+                return status
+
+        print(f"Starting activity: {' '.join(cmd_args)}")
+        output = self._run_launch_command(cmd_args)
+        outcome = am_start.TIMEOUT if output is None else am_start.classify(output)
+        if outcome == am_start.LAUNCHED and \
+                am_start.crashed(self._run_adb_command(["logcat", "-b", "crash", "-d"], check_output=True), self.defined_pkg_name):
+            outcome = am_start.CRASHED
+        launch = am_start.parse_wait_output(output)
+        am_start.save_launch_time(results_outputs, appname, activity, 'warm' if warm else 'cold', launch, outcome)
+        if outcome != am_start.LAUNCHED:
+            return self.launch_failed(component, outcome)
+
+        if self.warm_launch and launch['status'] == 'ok':
+            print(f"Launched in {launch['total_time']} ms (waited {launch['wait_time']} ms).")
+            time.sleep(adb_session.scaled(LAUNCH_SETTLE))
+        else:
+            self.wait_settled(3, f"launch of {activity}")
+
+        status = self.explore(activity, appname, results_folder, results_outputs)
+        self.cold_start_next = status != 'normal' # Only a crash or bounce costs a cold start
+        return status
+
+    def launch_failed(self, component, outcome):
+        """
+        Handles a launch that failed before any screen could be checked (no UI dump is taken).
+        Args:
+            component (str): Component name (package/activity).
+            outcome (str): One of am_start.FAILURES.
+        Returns:
+            str: The outcome.
+        """
+        print(f"Launch of {component} failed: {outcome}. Skipping the screen check.")
+        if outcome in (am_start.CRASHED, am_start.TIMEOUT):
+            # Leave the crash dialog or the half-started app
+            self._run_adb_command(["shell", "input", "keyevent", "KEYCODE_HOME"])
+        self.cold_start_next = True
+        return outcome
+
+    def start_helper_agent(self):
+        """
+        Installs (if needed) and starts the on-device helper agent, then connects to it.
+        Leaves agent as None if the agent is not available; launches then go through adb.
+        """
+        if self.agent is not None or not self.agent_port:
+            return
+        with _agents_lock:
+            running = _agents.get(self.device_serial)
+        if running is not None and running[0] is not None:
+            self.agent = running[0] # Started by an earlier session on this device
+            return
+        if not self._run_adb_command(["shell", "pm", "path", device_agent.AGENT_PKG], check_output=True):
+            if not self.agent_apk or not os.path.exists(self.agent_apk):
+                print(f"Helper agent not installed and no APK at '{self.agent_apk}'. Using adb launches.")
+                return
+            self._run_adb_command(["install", "-r", "-g", self.agent_apk])
+        proc = device_agent.start_agent(self.device_serial, self.agent_port)
+        client = device_agent.connect(self.agent_port) if proc is not None else None
+        with _agents_lock:
+            _agents[self.device_serial] = (client, proc, self.agent_port)
+        if client is None:
+            stop_helper_agent(self.device_serial)
+        self.agent = client
+
+    def launch_with_agent(self, component, action, cate, extras, stop=False):
+        """
+        Launches an activity through the helper agent.
+        Args:
+            component (str): Component name (package/activity).
+            action (str): Action to start with.
+            cate (str): Category to start with.
+            extras (list): Extras arguments in 'am start' form, or None.
+            stop (bool): Force-stop the app first (cold start).
+        Returns:
+            dict: Agent launch result, or None if the agent failed (it is stopped, later launches use adb).
+        """
+        spec = device_agent.launch_spec(0, component, action, cate, extras, stop)
+        try:
+            return self.agent.launch(spec)
+        except (device_agent.AgentError, OSError) as e:
+            print(f"Helper agent failed: {e}. Falling back to adb launches.")
+            stop_helper_agent(self.device_serial)
+            self.agent = None
+            return None
+
+    def save_activity_to_csv(self, results_folder, apk_name, all_act_num, launched_act_num, act_not_launched, act_num_with_issue):
+        """
+        Saves activity exploration statistics to a CSV file.
+        Args:
+            results_folder (str): Base results folder.
+            apk_name (str): APK name.
+            all_act_num (int): Total number of activities.
+            launched_act_num (int): Number of launched activities.
+            act_not_launched (int): Number of activities not launched.
+            act_num_with_issue (int): Number of activities with accessibility issues.
+        """
+        csv_file = os.path.join(results_folder, 'log.csv')
+        # Use 'a' for append mode, newline='' to prevent blank rows on Windows
+        with open(csv_file, 'a', newline='') as f:
+            writer = csv.writer(f)
+            # Write header if file is empty
+            if os.stat(csv_file).st_size == 0:
+                writer.writerow(('apk_name', 'pkg_name', 'all_act_num', 'launched_act_num', 'act_not_launched', 'act_num_with_issue'))
+            writer.writerow((apk_name, self.used_pkg_name, all_act_num, launched_act_num, act_not_launched, act_num_with_issue))
+        print(f"Saved activity stats to {csv_file}")
+
+    def launch_activity(self, activity, intent_filters, apk_name, results_folder, results_outputs):
+        """
+        Launches an activity with each of its intent filters, then without any.
+        Args:
+            activity (str): Full activity name.
+            intent_filters (list): [action, category] pairs from the manifest.
+            apk_name (str): APK name.
+            results_folder (str): Base results folder.
+            results_outputs (str): Folder for specific outputs.
+        Returns:
+            str: 'normal' if the activity reached a normal screen, else the outcome of the last launch
+                 ('abnormal' or one of am_start.FAILURES).
+        """
+        component = f"{self.defined_pkg_name}/{activity}"
 
-    # Parse manifest and explore activities
-    parseManifest(new_apkpath, apk_name, results_folder, decompilePath, results_outputs)
+        # Try launching with specific actions/categories first
+        for action, category in intent_filters:
+            status = self.startAct(component, action, category, apk_name, results_folder, results_outputs)
+            if status == 'normal':
+                return status # Stop after first successful launch with intent filter
+            if status in (am_start.NOT_FOUND, am_start.PERMISSION_DENIED):
+                return status # Other intents cannot start a missing or protected activity either
 
-    # Uninstall the app after exploration
-    if defined_pkg_name:
-        uninstallApp(defined_pkg_name)
-    else:
-        print(f"Warning: Could not determine package name for {apk_name}. Skipping uninstall.")
+        # If not launched with specific intent filters, or no intent filters, try without
+        return self.startAct(component, '', '', apk_name, results_folder, results_outputs)
+
+    def explore_activity_once(self, activity, pairs, apk_name, results_folder, results_outputs):
+        """
+        Launches and explores one activity within its activity budget.
+        Args:
+            activity (str): Full activity name.
+            pairs (dict): Activity -> intent filters, from extract_activity_action.
+            apk_name (str): APK name.
+            results_folder (str): Base results folder.
+            results_outputs (str): Folder for specific outputs.
+        Returns:
+            str: Outcome of launch_activity; am_start.TIMEOUT if the activity budget expired.
+        Raises:
+            deadlines.BudgetExpired: A budget wider than the activity (e.g. the APK budget) expired.
+        """
+        try:
+            with deadlines.budget('activity', deadlines.ACTIVITY_BUDGET, activity):
+                return self.launch_activity(activity, pairs[activity], apk_name, results_folder, results_outputs)
+        except deadlines.BudgetExpired as e:
+            if e.scope != 'activity':
+                raise
+            print(f"Moving on from {activity}: {e}")
+            return am_start.TIMEOUT
+
+    def explore_sharded(self, ordered, pairs, new_apkpath, apk_name, results_folder, results_outputs, record):
+        """
+        Explores the activities of one app on this device and the shard devices at once (see app_shards).
+        Args:
+            ordered (list): Activities to explore, most promising first.
+            pairs (dict): Activity -> intent filters.
+            new_apkpath (str): APK installed on the shard devices.
+            apk_name (str): APK name.
+            results_folder (str): Base results folder.
+            results_outputs (str): Folder the shard outputs are merged into.
+            record (callable): record(activity, outcome, device) for every explored activity.
+        """
+        devices = [self.device_serial] + self.shard_devices
+        shard_root = os.path.join(self.tmp_dir, 'shards')
+        print(f"Sharding {len(ordered)} activities of {apk_name} across {len(devices)} devices.")
+
+        def shard_outputs(device):
+            return os.path.join(shard_root, device, 'outputs')
+
+        def setup(device):
+            if device_health.is_unhealthy(device):
+                print(f"Device {device} is unhealthy. Leaving it out of {apk_name}.")
+                return False
+            self.agent = self.agent_port = None # The helper agent stays with the parent's device
+            if adb_session.mode == adb_session.RECORD:
+                adb_session.mode = None # One archive cannot be written from several processes
+            main_device = device == self.device_serial
+            self.adb = f"adb -s {device}"
+            self.device_serial = device
+            sdk = self._run_adb_command(["shell", "getprop", "ro.build.version.sdk"], check_output=True)
+            self.device_sdk = int(sdk) if sdk and sdk.isdigit() else None
+            self.ui_device = ui_targets.device_key(device, self._run_adb_command)
+            self.tmp_dir = os.path.join(shard_root, device, 'tmp')
+            os.makedirs(self.tmp_dir, exist_ok=True)
+            self.cold_start_next = True
+            return main_device or self.installAPP(new_apkpath, apk_name, results_folder) == 'Success'
+
+        def work(device, activity):
+            try:
+                outcome = self.explore_activity_once(activity, pairs, apk_name, results_folder, shard_outputs(device))
+            except deadlines.BudgetExpired as e:
+                print(f"Stopping exploration of {apk_name} on {device}: {e}")
+                return app_shards.STOPPED, None
+            # adb errors in this process mark the device; a failed launch may also mean the device went away
+            if device_health.is_unhealthy(device) or (outcome != 'normal' and not device_health.check(device)):
+                print(f"Device {device} is unhealthy. Its activity goes to another device.")
+                return app_shards.LOST, None
+            return app_shards.DONE, outcome
+
+        def finish(device):
+            if device != devices[0] and self.defined_pkg_name:
+                with deadlines.grace():
+                    self.uninstallApp(self.defined_pkg_name, results_folder)
+
+        left = app_shards.run(devices, ordered, setup, work, finish, record)
+        for device in devices:
+            app_shards.merge_outputs(shard_outputs(device), results_outputs, apk_name)
+        shutil.rmtree(shard_root, ignore_errors=True)
+        if left:
+            print(f"{len(left)} activities of {apk_name} were not explored.")
+
+    def parseManifest(self, new_apkpath, apk_name, results_folder, decompilePath, results_outputs):
+        """
+        Parses AndroidManifest.xml to extract activities and explore them.
+        Args:
+            new_apkpath (str): Path to the repackaged APK.
+            apk_name (str): APK name.
+            results_folder (str): Base results folder.
+            decompilePath (str): Path to the decompiled app.
+            results_outputs (str): Folder for specific outputs.
+        """
+        print(f"Parsing {apk_name}...")
+
+        if not os.path.exists(new_apkpath):
+            print(f"Cannot find the decompiled app: {apk_name}. Skipping manifest parsing.")
+            return
+
+        manifestPath = os.path.join(decompilePath, apk_name, "AndroidManifest.xml")
+
+        if not os.path.exists(manifestPath):
+            print(f"There is no AndroidManifest file for: {apk_name}. Skipping manifest parsing.")
+            return
+
+        pairs = self.extract_activity_action(manifestPath)
+        all_activity_num = len(pairs.keys())
+        print(f"Found {all_activity_num} activities in {apk_name}.")
+
+        launched_activities = set() # To track successfully launched unique activities
+        not_launched = {} # Launch outcome -> number of activities that did not launch with it
+
+        # Only explore activities that changed since the last scanned version of the app
+        decoded_dir = os.path.join(decompilePath, apk_name)
+        current = version_delta.fingerprints(decoded_dir, list(pairs.keys()), self.used_pkg_name)
+        previous = version_delta.load_record(results_folder, self.defined_pkg_name)
+        to_explore, carried = version_delta.split_activities(previous, current)
+        explored = {}
+        if carried:
+            print(f"{len(carried)} activities unchanged since {previous['apk_name']}. Carrying their results forward.")
+            version_delta.carry_forward(results_outputs, previous['apk_name'], apk_name, carried)
+            for activity in carried:
+                explored[activity] = previous['activities'][activity]
+                if explored[activity]['launched']:
+                    launched_activities.add(activity)
+                else:
+                    outcome = explored[activity].get('outcome', 'abnormal')
+                    not_launched[outcome] = not_launched.get(outcome, 0) + 1
+
+        # Most promising activities first, activities that never launched before are deferred
+        history = launch_history.load_history(results_folder)
+        ordered, deferred = launch_history.schedule(self.defined_pkg_name, to_explore, history,
+                                                    self.act_paras_index, self.launcher_activity)
+        if launch_history.RETRY_DEFERRED:
+            ordered += deferred
+
+        failed_without_extras = [] # Candidates for a retry with extras (lazy extras)
+
+        def record(activity, outcome, device=None):
+            if activity in explored and not explored[activity]['launched']:
+                # Retried activity: its new outcome replaces the first one
+                previous_outcome = explored[activity].get('outcome', 'abnormal')
+                not_launched[previous_outcome] -= 1
+                if not not_launched[previous_outcome]:
+                    del not_launched[previous_outcome]
+            launched = outcome == 'normal'
+            if launched:
+                launched_activities.add(activity)
+            else:
+                not_launched[outcome] = not_launched.get(outcome, 0) + 1
+                if outcome in RETRY_WITH_EXTRAS and self.get_act_extra_paras(activity) is None:
+                    failed_without_extras.append(activity)
+            launch_history.record_outcome(history, self.defined_pkg_name, activity, launched)
+            explored[activity] = {'fingerprint': current[activity], 'launched': launched, 'outcome': outcome}
 
-    # Remove the decompiled and modified resources (optional, currently commented out in original)
-    # remove_folder(apk_name, decompilePath)
+        try:
+            if self.shard_devices and len(ordered) >= app_shards.MIN_ACTIVITIES:
+                self.explore_sharded(ordered, pairs, new_apkpath, apk_name, results_folder, results_outputs, record)
+            else:
+                for activity in ordered:
+                    try:
+                        outcome = self.explore_activity_once(activity, pairs, apk_name, results_folder, results_outputs)
+                    except deadlines.BudgetExpired as e:
+                        print(f"Stopping exploration of {apk_name}: {e}")
+                        break
+                    if device_health.is_unhealthy(self.device_serial):
+                        # Outcomes on a failing device mean nothing; the APK is requeued after recovery
+                        raise device_health.DeviceFailed(f"{self.device_serial} failed while exploring {apk_name}")
+                    record(activity, outcome)
+            if self.extras_provider is not None and failed_without_extras:
+                self.retry_with_extras(failed_without_extras, pairs, apk_name, results_folder, results_outputs, record)
+        finally:
+            launch_history.save_history(results_folder, history, [self.defined_pkg_name])
+            # Activities left unexplored (expired budget, failing device) are not recorded and run next time
+            version_delta.save_record(results_folder, self.defined_pkg_name,
+                                      {'apk_name': apk_name, 'version_code': version_delta.version_code(decoded_dir),
+                                       'activities': explored})
+
+        # Get statistics
+        launched_act_num = len(launched_activities)
+        act_not_launched = all_activity_num - launched_act_num
+        if not_launched:
+            print(f"Not launched: {', '.join(f'{n} {o}' for o, n in sorted(not_launched.items()))}.")
+        am_start.save_outcomes(results_folder, apk_name, launched_act_num, not_launched)
+
+        # Count activities with issues by checking issue folder
+        issues_folder_for_app = os.path.join(results_outputs, apk_name, 'issues')
+        act_num_with_issue = 0
+        if os.path.exists(issues_folder_for_app):
+            # Count only non-empty folders inside 'issues' which indicates an issue for an activity
+            # Assuming each issue dump creates a subfolder or zip file for an activity
+            # The unzip function already places files like activity.txt/png directly, so we can count these.
+            for item in os.listdir(issues_folder_for_app):
+                if item.endswith('.txt') or item.endswith('.png'):
+                    # This simple check might overcount if both .txt and .png exist for same activity
+                    # A more robust check would be to get unique base names (e.g., 'activity_name')
+                    activity_base_name = item.rsplit('.', 1)[0]
+                    if os.path.exists(os.path.join(issues_folder_for_app, f"{activity_base_name}.txt")) or \
+                       os.path.exists(os.path.join(issues_folder_for_app, f"{activity_base_name}.png")):
+                        act_num_with_issue += 1
+            # To get unique activities with issues:
+            unique_issue_activities = set()
+            for item in os.listdir(issues_folder_for_app):
+                if item.endswith('.txt') or item.endswith('.png') or item.endswith('.zip'):
+                     unique_issue_activities.add(item.rsplit('.', 1)[0])
+            act_num_with_issue = len(unique_issue_activities)
+
+
+        self.save_activity_to_csv(results_folder, apk_name, all_activity_num, launched_act_num, act_not_launched,
+                             act_num_with_issue)
+        print(f"Parsing of {apk_name} finished!")
+
+    def retry_with_extras(self, activities, pairs, apk_name, results_folder, results_outputs, record):
+        """
+        Lazy extras: runs the extras analysis of the app (self.extras_provider) and launches the activities
+        that failed without extras again, if the analysis found extras for them.
+        Args:
+            activities (list): Activities that crashed or finished at once without extras.
+            pairs (dict): Activity -> intent filters.
+            apk_name (str): APK name.
+            results_folder (str): Base results folder.
+            results_outputs (str): Folder for specific outputs.
+            record (callable): record(activity, outcome) for every retried activity.
+        """
+        print(f"{len(activities)} activities of {apk_name} failed without extras. Analysing the app for extras...")
+        provider, self.extras_provider = self.extras_provider, None # One analysis per app
+        try:
+            paras_path = provider()
+        except deadlines.BudgetExpired as e:
+            print(f"No time left to analyse {apk_name} for extras: {e}")
+            return
+        if paras_path:
+            self.act_paras_file = paras_path
+            self.act_paras_index = load_act_extra_paras(paras_path)
+        retry = [activity for activity in activities if self.get_act_extra_paras(activity)]
+        launched = 0
+        for activity in retry:
+            try:
+                outcome = self.explore_activity_once(activity, pairs, apk_name, results_folder, results_outputs)
+            except deadlines.BudgetExpired as e:
+                print(f"Stopping the retries of {apk_name}: {e}")
+                break
+            if device_health.is_unhealthy(self.device_serial):
+                raise device_health.DeviceFailed(f"{self.device_serial} failed while retrying {apk_name}")
+            record(activity, outcome)
+            launched += outcome == 'normal'
+        print(f"Retried {len(retry)} of them with extras: {launched} launched.")
+        save_extras_retry(results_folder, apk_name, len(activities), len(retry), launched)
+
+    def get_pkgname(self, apk_path):
+        """
+        Extracts package names (defined and used) from an APK.
+        Args:
+            apk_path (str): Path to the APK file.
+        """
+
+        # Use aapt to get the package name
+        self.defined_pkg_name = _run_shell_command(
+            f"aapt dump badging '{apk_path}' | grep 'package' | awk -F\"'\" '/package: name=/{{print $2}}'",
+            check_output=True
+        )
+
+        # Use aapt to get the launchable activity and derive used_pkg_name
+        launcher_output = _run_shell_command(
+            f"aapt dump badging \"{apk_path}\" | grep launchable-activity | awk '{{print $2}}'",
+            check_output=True
+        )
+
+        self.launcher_activity = ''
+        if launcher_output:
+            launcher = launcher_output.strip().strip("'") # Remove potential quotes from awk output
+            launcher_name = launcher.split("name=", 1)[-1].strip("'") # awk prints "name='<activity>'"
+            self.launcher_activity = self.defined_pkg_name + launcher_name if launcher_name.startswith('.') else launcher_name
+            if launcher.startswith(".") or self.defined_pkg_name in launcher:
+                self.used_pkg_name = self.defined_pkg_name
+            else:
+                # Handle cases like "com.example.app/com.example.app.MainActivity" or just "com.example.app.MainActivity"
+                # Extract the package part from the activity name
+                parts = launcher.split('.')
+                if len(parts) > 1:
+                    # Find the longest prefix that matches a package structure
+                    # A common pattern is that the last part is the activity class name
+                    # So, we try to reconstruct the package name by removing the last part
+                    potential_pkg = '.'.join(parts[:-1])
+                    # This is a heuristic, it might need refinement for complex cases
+                    self.used_pkg_name = potential_pkg if self.defined_pkg_name.startswith(potential_pkg) else self.defined_pkg_name
+                else:
+                    self.used_pkg_name = self.defined_pkg_name # Fallback if parsing fails
+        else:
+            self.used_pkg_name = self.defined_pkg_name # If no launchable activity, default to defined package name
+
+        print(f"Defined Package Name: {self.defined_pkg_name}")
+        print(f"Used Package Name: {self.used_pkg_name}")
+
+    def exploreActivity(self, new_apkpath, apk_name, results_folder, uninstall=True, decompile_root=None):
+        """
+        Main function to explore activities of a given APK.
+        Args:
+            new_apkpath (str): Path to the repackaged APK to explore.
+            apk_name (str): Name of the APK.
+            results_folder (str): Base results folder for the entire process.
+            uninstall (bool): Uninstall the app afterwards; False keeps it for a following job of the same app.
+            decompile_root (str): Folder holding the decoded tree (e.g. a workspace); defaults to results/apktool.
+        Raises:
+            device_health.DeviceFailed: The device failed during the exploration (outcomes so far are saved).
+        """
+        # No-op unless a session is being recorded (adb_session.mode)
+        adb_session.begin(apk_name, {'apk': os.path.basename(new_apkpath), 'emulator': self.device_serial,
+                                     'uninstall': uninstall},
+                          {'AndroidManifest.xml': os.path.join(decompile_root or os.path.join(results_folder, "apktool"),
+                                                               apk_name, "AndroidManifest.xml"),
+                           'activity_paras.txt': self.act_paras_file})
+
+        sdk = self._run_adb_command(["shell", "getprop", "ro.build.version.sdk"], check_output=True)
+        self.device_sdk = int(sdk) if sdk and sdk.isdigit() else None
+
+        self.ui_device = ui_targets.device_key(self.device_serial, self._run_adb_command) # Scanner taps are resolved once per key
+
+        self.act_paras_index = load_act_extra_paras(self.act_paras_file) # Parsed once, looked up per launch
+
+        self.cold_start_next = True # The first launch of every app is a cold start
+
+        self.start_helper_agent() # Only if agent_port is set
+
+        decompilePath = decompile_root or os.path.join(results_folder, "apktool")  # Decompiled app path (apktool handled)
+        results_outputs = os.path.join(results_folder, "outputs") # Where screenshots and issues are stored
+        installErrorAppPath = os.path.join(results_folder, "install-error-apks")
+
+        # Ensure all necessary directories exist
+        os.makedirs(decompilePath, exist_ok=True)
+        os.makedirs(results_outputs, exist_ok=True)
+        os.makedirs(installErrorAppPath, exist_ok=True)
+
+        print(f"Starting activity exploration for {apk_name} at {new_apkpath} on {self.device_serial}")
+
+        # Install the app
+        result = self.installAPP(new_apkpath, apk_name, results_folder)
+
+        if result == 'Failure':
+            print(f"Installation failed for {apk_name}. Moving APK to install error folder.")
+            dest_path = os.path.join(installErrorAppPath, os.path.basename(new_apkpath))
+            try:
+                shutil.move(new_apkpath, dest_path)
+                print(f"Moved {os.path.basename(new_apkpath)} to {installErrorAppPath}")
+            except FileNotFoundError:
+                print(f"Original APK not found at {new_apkpath} for moving.")
+            except shutil.Error as e:
+                print(f"Error moving APK to install error folder: {e}")
+            adb_session.finish()
+            return # Exit if installation fails
+
+        # Parse manifest and explore activities
+        self.parseManifest(new_apkpath, apk_name, results_folder, decompilePath, results_outputs)
+
+        # Uninstall the app after exploration, even if the APK budget is used up
+        if not uninstall:
+            print(f"Keeping {self.defined_pkg_name} installed for the next job.")
+        elif self.defined_pkg_name:
+            with deadlines.grace():
+                self.uninstallApp(self.defined_pkg_name, results_folder)
+        else:
+            print(f"Warning: Could not determine package name for {apk_name}. Skipping uninstall.")
+
+        # Remove the decompiled and modified resources (optional, currently commented out in original)
+        # remove_folder(apk_name, decompilePath)
 
-    print(f"Activity exploration for {apk_name} completed.")
+        adb_session.finish()
+        print(f"Activity exploration for {apk_name} completed.")
+
+def stop_helper_agent(serial=None):
+    """
+    Disconnects from and stops the helper agent of a device.
+    Args:
+        serial (str): Device serial; None stops the agents of all devices of this process.
+    """
+    with _agents_lock:
+        stopped = [(s, _agents.pop(s)) for s in ([serial] if serial else list(_agents)) if s in _agents]
+    for s, (client, proc, port) in stopped:
+        if client is not None:
+            client.close(shutdown=True)
+        device_agent.stop_agent(s, port, proc)
+
+def exploreActivity(new_apkpath, apk_name, results_folder, emulator, tmp_file, storydroid_file, uninstall=True,
+                    decompile_root=None, extras_provider=None):
+    """
+    Explores the activities of a given APK in a new ExplorationSession (see ExplorationSession.exploreActivity).
+    extras_provider enables lazy extras (see ExplorationSession.retry_with_extras).
+    """
+    session = ExplorationSession(emulator, tmp_file, storydroid_file)
+    session.extras_provider = extras_provider
+    session.exploreActivity(new_apkpath, apk_name, results_folder, uninstall, decompile_root)
+    return session
 
 
 # Example usage (uncomment and modify paths/emulator details to test)
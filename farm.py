@@ -0,0 +1,415 @@
+'''
+Coordinator/worker mode for an emulator farm spanning several hosts.
+
+The coordinator owns the APK queue (longest estimated job first, see
+scheduler) and the results index. Workers register their local emulators and
+lease one APK per free device over HTTP/JSON, download it, run it with
+run_xbot.py on that device and upload the outputs and the log.csv row, which the
+coordinator merges into its own results folder. Workers heartbeat their leases;
+leases that are not renewed in time are reassigned.
+
+    python farm.py serve [apk_folder] [port]
+    python farm.py work http://<coordinator>:<port> emulator-5554[,emulator-5556,...]
+
+Both can run on one box (coordinator and workers on localhost) for testing.
+'''
+
+import csv
+import http.client
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import apk_triage
+import device_health
+import scheduler
+
+DEFAULT_PORT = 8765
+LEASE_SECONDS = 600  # A lease expires unless renewed within this time
+HEARTBEAT_INTERVAL = 60  # seconds between worker heartbeats
+POLL_INTERVAL = 30  # seconds a worker waits when the queue is empty but leases are still out
+MAX_REQUEUES = 2  # Times an APK is leased again after an expired or failed lease
+
+accessbility_folder = os.path.join(os.getcwd(), 'main-folder')
+results_folder = os.path.join(accessbility_folder, "results")
+
+
+class Coordinator(object):
+    """APK queue, leases and results index of the farm."""
+
+    def __init__(self, apk_folder, results_folder, lease_seconds=LEASE_SECONDS):
+        self.apk_folder = apk_folder
+        self.results_folder = results_folder
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.model = scheduler.load_model(results_folder)
+        self.pending = []  # triage records
+        self.leases = {}  # lease_id -> {'record', 'worker', 'device', 'expires', 'started'}
+        self.workers = {}  # worker_id -> {'host', 'devices', 'seen'}
+        self.requeues = {}
+
+    def scan(self):
+        """Triages the APK folder and queues the APKs worth running."""
+        apk_files = [f for f in os.listdir(self.apk_folder)
+                     if f.lower().endswith('.apk') and os.path.isfile(os.path.join(self.apk_folder, f))]
+        for apk_file, record in zip(apk_files, scheduler.prescan([os.path.join(self.apk_folder, f)
+                                                                  for f in apk_files], None)):
+            apk_triage.save_triage_to_csv(self.results_folder, record)
+            if record['verdict'] == apk_triage.SKIP:
+                print(f"Skipping {apk_file}: {record['reason']}")
+                continue
+            record['apk_file'] = apk_file
+            self.pending.append(record)
+        print(f"Coordinator queued {len(self.pending)} APK(s).")
+
+    def register(self, host, devices):
+        worker_id = uuid.uuid4().hex[:12]
+        with self.lock:
+            self.workers[worker_id] = {'host': host, 'devices': devices, 'seen': time.monotonic()}
+        print(f"Worker {worker_id} registered from {host} with {devices}")
+        return {'worker_id': worker_id, 'lease_seconds': self.lease_seconds,
+                'heartbeat_interval': HEARTBEAT_INTERVAL}
+
+    def lease(self, worker_id, device):
+        """Leases the most expensive pending APK. Returns {} if none is pending, {'done': True} when finished."""
+        with self.lock:
+            self._expire()
+            if worker_id not in self.workers:
+                return {'error': 'unknown worker'}
+            self.workers[worker_id]['seen'] = time.monotonic()
+            if not self.pending:
+                return {} if self.leases else {'done': True}
+            self.pending.sort(key=lambda r: -scheduler.estimate(self.model, r))
+            record = self.pending.pop(0)
+            lease_id = uuid.uuid4().hex[:12]
+            self.leases[lease_id] = {'record': record, 'worker': worker_id, 'device': device,
+                                     'expires': time.monotonic() + self.lease_seconds, 'started': time.monotonic()}
+        print(f"Leased {record['apk_name']} to {worker_id}/{device} ({lease_id})")
+        return {'lease_id': lease_id, 'apk_name': record['apk_name'], 'apk_file': record['apk_file'],
+                'size': os.path.getsize(os.path.join(self.apk_folder, record['apk_file']))}
+
+    def heartbeat(self, worker_id, lease_ids):
+        with self.lock:
+            if worker_id in self.workers:
+                self.workers[worker_id]['seen'] = time.monotonic()
+            renewed = []
+            for lease_id in lease_ids:
+                lease = self.leases.get(lease_id)
+                if lease and lease['worker'] == worker_id:
+                    lease['expires'] = time.monotonic() + self.lease_seconds
+                    renewed.append(lease_id)
+        return {'renewed': renewed}
+
+    def apk_path(self, lease_id):
+        with self.lock:
+            lease = self.leases.get(lease_id)
+        return os.path.join(self.apk_folder, lease['record']['apk_file']) if lease else None
+
+    def complete(self, lease_id, outcome, payload):
+        """
+        Merges the results of a lease.
+        Args:
+            lease_id (str): Lease.
+            outcome (str): scheduler.FINISHED, REQUEUE or DEVICE_LOST.
+            payload (bytes): Zip with outputs/<apk_name>/... and log.csv (rows of the APK).
+        """
+        with self.lock:
+            lease = self.leases.pop(lease_id, None)
+        if lease is None:
+            return {'error': 'unknown or expired lease'}
+        record = lease['record']
+        seconds = time.monotonic() - lease['started']
+        if outcome != scheduler.FINISHED:
+            self._requeue(record, outcome)
+        else:
+            self._merge(payload)
+            with self.lock:
+                scheduler.observe(self.model, record, seconds)
+                scheduler.save_model(self.results_folder, self.model, [record['package']])
+            apk_path = os.path.join(self.apk_folder, record['apk_file'])
+            if os.path.exists(apk_path):
+                os.remove(apk_path)
+        self._index(record, lease, outcome, seconds)
+        print(f"{record['apk_name']} {outcome} on {lease['worker']}/{lease['device']} in {round(seconds)}s")
+        return {'ok': True}
+
+    def _merge(self, payload):
+        if not payload:
+            return
+        with zipfile.ZipFile(io.BytesIO(payload)) as z:
+            for name in z.namelist():
+                if name == 'log.csv':
+                    rows = list(csv.reader(io.StringIO(z.read(name).decode('utf-8'))))
+                    with self.lock, open(os.path.join(self.results_folder, 'log.csv'), 'a', newline='') as f:
+                        csv.writer(f).writerows(rows)
+                elif name.startswith('outputs/') and not name.endswith('/') and '..' not in name.split('/'):
+                    target = os.path.join(self.results_folder, *name.split('/'))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with z.open(name) as src, open(target, 'wb') as dest:
+                        shutil.copyfileobj(src, dest)
+
+    def _index(self, record, lease, outcome, seconds):
+        csv_file = os.path.join(self.results_folder, 'farm_index.csv')
+        with self.lock, open(csv_file, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if os.stat(csv_file).st_size == 0:
+                writer.writerow(('apk_name', 'worker', 'host', 'device', 'outcome', 'seconds'))
+            host = self.workers.get(lease['worker'], {}).get('host', '')
+            writer.writerow((record['apk_name'], lease['worker'], host, lease['device'], outcome, round(seconds, 1)))
+
+    def _requeue(self, record, reason):
+        with self.lock:
+            self.requeues[record['apk_name']] = self.requeues.get(record['apk_name'], 0) + 1
+            if self.requeues[record['apk_name']] <= MAX_REQUEUES:
+                print(f"Requeueing {record['apk_name']} ({reason}).")
+                self.pending.append(record)
+            else:
+                print(f"{record['apk_name']} failed {self.requeues[record['apk_name']]} times. Dropping it.")
+
+    def _expire(self):
+        """Reassigns expired leases. Called with the lock held."""
+        now = time.monotonic()
+        for lease_id, lease in list(self.leases.items()):
+            if lease['expires'] < now:
+                del self.leases[lease_id]
+                self.requeues[lease['record']['apk_name']] = self.requeues.get(lease['record']['apk_name'], 0) + 1
+                if self.requeues[lease['record']['apk_name']] <= MAX_REQUEUES:
+                    print(f"Lease {lease_id} of {lease['record']['apk_name']} expired. Reassigning it.")
+                    self.pending.append(lease['record'])
+
+    def finished(self):
+        with self.lock:
+            self._expire()
+            return not self.pending and not self.leases
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _json(self, body, status=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'apk':
+            path = self.server.coordinator.apk_path(parts[1])
+            if not path or not os.path.exists(path):
+                return self._json({'error': 'unknown lease'}, 404)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.android.package-archive')
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+            self.end_headers()
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile)
+            return
+        self._json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        coordinator = self.server.coordinator
+        parts = self.path.strip('/').split('/')
+        try:
+            if parts == ['register']:
+                body = json.loads(self._body())
+                return self._json(coordinator.register(body['host'], body['devices']))
+            if parts == ['lease']:
+                body = json.loads(self._body())
+                return self._json(coordinator.lease(body['worker_id'], body['device']))
+            if parts == ['heartbeat']:
+                body = json.loads(self._body())
+                return self._json(coordinator.heartbeat(body['worker_id'], body['leases']))
+            if len(parts) == 3 and parts[0] == 'complete':
+                return self._json(coordinator.complete(parts[1], urllib.parse.unquote(parts[2]), self._body()))
+        except (ValueError, KeyError) as e:
+            return self._json({'error': f"bad request: {e}"}, 400)
+        self._json({'error': 'not found'}, 404)
+
+    def log_message(self, format, *args):
+        pass # Leases and results are printed by the coordinator
+
+
+def serve(apk_folder, port=DEFAULT_PORT, results=results_folder, lease_seconds=LEASE_SECONDS, block=True):
+    """
+    Runs the coordinator HTTP server.
+    Args:
+        apk_folder (str): APK queue folder.
+        port (int): Port to listen on (0 picks a free one).
+        results (str): Results folder the worker results are merged into.
+        lease_seconds (float): Lease lifetime without heartbeat.
+        block (bool): Serve until every APK is done; False returns the server running in a thread.
+    Returns:
+        ThreadingHTTPServer: The server (its .coordinator holds the state).
+    """
+    os.makedirs(results, exist_ok=True)
+    out_csv = os.path.join(results, 'log.csv')
+    if not os.path.exists(out_csv):
+        with open(out_csv, 'w', newline='') as f:
+            csv.writer(f).writerow(('apk_name', 'pkg_name', 'all_act_num', 'launched_act_num',
+                                    'act_not_launched','act_num_with_issue'))
+    coordinator = Coordinator(apk_folder, results, lease_seconds)
+    coordinator.scan()
+    server = ThreadingHTTPServer(('0.0.0.0', port), _Handler)
+    server.coordinator = coordinator
+    threading.Thread(target=server.serve_forever, name='farm-coordinator', daemon=True).start()
+    print(f"Coordinator listening on port {server.server_address[1]}")
+    if block:
+        while not coordinator.finished():
+            time.sleep(5)
+        print("All APKs processed. Coordinator finished.")
+        server.shutdown()
+    return server
+
+
+def _post(url, body=None, data=None, timeout=60):
+    if data is None:
+        data = json.dumps(body or {}).encode('utf-8')
+    request = urllib.request.Request(url, data=data, method='POST')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def run_job(device, apk_path, results):
+    """
+    Default job runner of a worker: runs run_xbot.py for one APK on one device.
+    Args:
+        device (str): Emulator serial.
+        apk_path (str): APK, alone in its job folder.
+        results (str): Results folder of the worker, passed to run_xbot as XBOT_RESULTS.
+    Returns:
+        str: scheduler.FINISHED if run_xbot consumed the APK, otherwise REQUEUE or DEVICE_LOST.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_xbot.py')
+    subprocess.run([sys.executable, script, device, os.path.dirname(apk_path)], env=dict(os.environ, XBOT_RESULTS=results))
+    # run_xbot removes the APK once it has been processed (or moved it to an error folder)
+    if not os.path.exists(apk_path):
+        return scheduler.FINISHED
+    health = device_health.probe(device, expect_root=False)
+    if not health['healthy']:
+        print(f"Device {device} is {health['problem']}. Giving its lease back.")
+        return scheduler.DEVICE_LOST
+    return scheduler.REQUEUE
+
+
+def pack_results(apk_name, results=results_folder):
+    """Zips outputs/<apk_name> and the log.csv rows of the APK for the coordinator."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        app_outputs = os.path.join(results, 'outputs', apk_name)
+        for dirpath, _, filenames in os.walk(app_outputs):
+            for f in filenames:
+                path = os.path.join(dirpath, f)
+                z.write(path, 'outputs/' + os.path.relpath(path, os.path.join(results, 'outputs')).replace(os.sep, '/'))
+        log_csv = os.path.join(results, 'log.csv')
+        if os.path.exists(log_csv):
+            with open(log_csv, 'r', newline='') as f:
+                rows = [row for row in csv.reader(f) if row and row[0] == apk_name]
+            out = io.StringIO()
+            csv.writer(out).writerows(rows[-1:])
+            z.writestr('log.csv', out.getvalue())
+    return buffer.getvalue()
+
+
+class Worker(object):
+    """Leases APKs for the local emulators of one host and reports the results."""
+
+    def __init__(self, url, devices, job_root, runner=run_job, results=None):
+        self.url = url.rstrip('/')
+        self.devices = devices
+        self.job_root = job_root
+        self.runner = runner
+        self.active = set()  # lease ids being worked on
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        info = _post(f"{self.url}/register", {'host': os.uname().nodename, 'devices': devices})
+        self.worker_id = info['worker_id']
+        self.heartbeat_interval = info['heartbeat_interval']
+        # Never the coordinator's folder (same host): the merge would append the log.csv rows a second time
+        self.results = results or os.path.join(results_folder, f"farm-worker-{self.worker_id}")
+        os.makedirs(self.results, exist_ok=True)
+
+    def _heartbeat(self):
+        while not self.stop.wait(self.heartbeat_interval):
+            with self.lock:
+                leases = list(self.active)
+            try:
+                _post(f"{self.url}/heartbeat", {'worker_id': self.worker_id, 'leases': leases})
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                print(f"Heartbeat failed: {e}")
+
+    def _device_loop(self, device):
+        while not self.stop.is_set():
+            try:
+                lease = _post(f"{self.url}/lease", {'worker_id': self.worker_id, 'device': device})
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                print(f"Lease request failed: {e}")
+                time.sleep(POLL_INTERVAL)
+                continue
+            if lease.get('done') or lease.get('error'):
+                return
+            if not lease:
+                time.sleep(POLL_INTERVAL) # Others still hold leases that may come back
+                continue
+
+            lease_id = lease['lease_id']
+            with self.lock:
+                self.active.add(lease_id)
+            job_folder = os.path.join(self.job_root, lease_id)
+            os.makedirs(job_folder, exist_ok=True)
+            apk_path = os.path.join(job_folder, lease['apk_file'])
+            outcome = scheduler.REQUEUE
+            payload = b''
+            try:
+                urllib.request.urlretrieve(f"{self.url}/apk/{lease_id}", apk_path)
+                outcome = self.runner(device, apk_path, self.results)
+                if outcome == scheduler.FINISHED:
+                    payload = pack_results(lease['apk_name'], self.results)
+            except (OSError, urllib.error.URLError, http.client.HTTPException) as e:
+                print(f"Job {lease['apk_name']} failed on {device}: {e}")
+            finally:
+                with self.lock:
+                    self.active.discard(lease_id)
+                shutil.rmtree(job_folder, ignore_errors=True)
+            try:
+                # Outcomes such as 'device lost' contain spaces
+                _post(f"{self.url}/complete/{lease_id}/{urllib.parse.quote(outcome)}", data=payload, timeout=600)
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                print(f"Could not report {lease['apk_name']}: {e}")
+            if outcome == scheduler.DEVICE_LOST:
+                return
+
+    def run(self):
+        """Works until the coordinator has nothing left."""
+        threading.Thread(target=self._heartbeat, name='farm-heartbeat', daemon=True).start()
+        threads = [threading.Thread(target=self._device_loop, args=(d,), name=f"farm-{d}") for d in self.devices]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.stop.set()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'serve':
+        serve(sys.argv[2] if len(sys.argv) > 2 else os.path.join(accessbility_folder, "apks"),
+              int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_PORT)
+    elif len(sys.argv) == 4 and sys.argv[1] == 'work':
+        Worker(sys.argv[2], sys.argv[3].split(','), os.path.join(results_folder, 'farm-jobs')).run()
+    else:
+        print("Usage: python farm.py serve [apk_folder] [port]\n"
+              "       python farm.py work http://<coordinator>:<port> <emulator>[,<emulator>...]")
@@ -0,0 +1,113 @@
+'''
+Install manager: skips re-installing an APK that is already on the device.
+
+The digest of every APK installed by Xbot is cached per device serial together
+with the package's lastUpdateTime on the device. If both still match, the push
+is skipped. Installs pre-grant runtime permissions (-g) and use streamed
+install where the device supports it.
+'''
+
+import hashlib
+import os
+import re
+
+import json_store
+
+CACHE_FILE = 'install_cache.json'
+STREAMING_MIN_SDK = 29  # adb streams the APK into the package manager from Android 10 on
+INSTALL_FLAGS = ["-r", "-g"]  # reinstall, grant all runtime permissions
+
+_LAST_UPDATE = re.compile(r'lastUpdateTime=(.+)')
+# Output of an install that failed because of streaming itself (old adb, package service without streaming)
+_STREAMING_FAILED = re.compile(r"unknown option:? '?--streaming|streaming (?:install )?(?:is )?not supported|"
+                               r"incremental install|can't find service: package|failure calling service package",
+                               re.IGNORECASE)
+
+
+def apk_digest(apk_path):
+    """SHA-256 of an APK file, read in 1 MB chunks."""
+    digest = hashlib.sha256()
+    with open(apk_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_cache(results_folder):
+    return json_store.load(os.path.join(results_folder, CACHE_FILE), 'install cache')
+
+
+def _update_cache(results_folder, change):
+    json_store.update(os.path.join(results_folder, CACHE_FILE), change, 'install cache')
+
+
+def last_update_time(run_adb, pkg):
+    """
+    Reads when a package was last installed/updated on the device.
+    Args:
+        run_adb (callable): Function running an adb command list, returning stdout or False.
+        pkg (str): Package name.
+    Returns:
+        str: lastUpdateTime as printed by dumpsys, or None if the package is not installed.
+    """
+    output = run_adb(["shell", "dumpsys", "package", pkg], check_output=True)
+    if not output:
+        return None
+    m = _LAST_UPDATE.search(output)
+    return m.group(1).strip() if m else None
+
+
+def is_installed(results_folder, serial, pkg, digest, run_adb):
+    """
+    Checks whether exactly this APK is already installed on the device.
+    Args:
+        results_folder (str): Base results folder holding the cache.
+        serial (str): Device serial.
+        pkg (str): Package name.
+        digest (str): apk_digest of the APK.
+        run_adb (callable): Function running an adb command list.
+    Returns:
+        bool: True if the install can be skipped.
+    """
+    entry = _load_cache(results_folder).get(serial, {}).get(pkg)
+    if not entry or entry.get('digest') != digest:
+        return False
+    return last_update_time(run_adb, pkg) == entry.get('last_update')
+
+
+def install_args(apk_path, device_sdk):
+    """
+    Builds the adb install arguments for the device.
+    Args:
+        apk_path (str): APK to install.
+        device_sdk (int): Device SDK level, or None if unknown.
+    Returns:
+        list: Arguments following 'adb -s <serial>'.
+    """
+    args = ["install"] + INSTALL_FLAGS
+    # --incremental would need a v4 (.idsig) signature, streaming works with v2 signed APKs
+    if device_sdk and device_sdk >= STREAMING_MIN_SDK:
+        args.append("--streaming")
+    return args + [apk_path]
+
+
+def streaming_failed(output):
+    """
+    Tells whether a streamed install failed because of streaming, so a plain install may work.
+    Args:
+        output (str): Combined output of 'adb install --streaming'.
+    Returns:
+        bool: True for streaming errors; INSTALL_FAILED_* and other real failures give False.
+    """
+    return bool(_STREAMING_FAILED.search(output or ''))
+
+
+def record_install(results_folder, serial, pkg, digest, run_adb):
+    """Remembers that the APK with this digest is installed on the device."""
+    entry = {'digest': digest, 'last_update': last_update_time(run_adb, pkg)}
+    _update_cache(results_folder, lambda cache: cache.setdefault(serial, {}).update({pkg: entry}))
+
+
+def forget_install(results_folder, serial, pkg):
+    """Drops the cache entry of an uninstalled package."""
+    _update_cache(results_folder, lambda cache: cache.get(serial, {}).pop(pkg, None) is not None)
@@ -0,0 +1,77 @@
+'''
+Small JSON files in the results folder shared by device pool workers, shard and
+farm runs and concurrent sessions (install and UI target caches, launch history,
+version records, cost model).
+
+update() re-reads the file under an exclusive lock, applies the change and
+replaces the file atomically, so concurrent writers neither tear the file nor
+drop each other's entries. Where fcntl is not available (Windows) the lock is
+skipped and only torn writes are prevented.
+'''
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_thread_lock = threading.Lock()  # flock does not exclude threads sharing a file description
+
+
+def load(path, what):
+    """
+    Reads a JSON file.
+    Args:
+        path (str): File path.
+        what (str): Description used in error messages.
+    Returns:
+        dict: Content, {} if the file is missing or unreadable.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error reading {what} {path}: {e}")
+        return {}
+
+
+@contextmanager
+def _locked(path):
+    with _thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(f"{path}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def update(path, change, what):
+    """
+    Applies a change to the current content of a JSON file and writes it back atomically.
+    Args:
+        path (str): File path.
+        change (callable): Called with the current content (dict) to modify it in place;
+                           returning False leaves the file untouched.
+        what (str): Description used in error messages.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with _locked(path):
+            content = load(path, what)
+            if change(content) is False:
+                return
+            with open(tmp_path, 'w') as f:
+                json.dump(content, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing {what} {path}: {e}")
@@ -0,0 +1,102 @@
+'''
+Cross-run launch history and activity scheduling.
+
+Outcomes of every launch attempt are kept per package/activity in
+results/launch_history.json. Activities are then explored in order of predicted
+success and value, and activities that never launched in previous runs are
+deferred to an (optional) retry pass at the end.
+'''
+
+import os
+
+import json_store
+
+HISTORY_FILE = 'launch_history.json'
+DEFER_AFTER_FAILURES = 2  # Activities that failed this often and never launched are deferred
+RETRY_DEFERRED = True  # Run the deferred activities after all others
+
+LAUNCHER_BONUS = 1.0  # The launcher activity almost always works and is the app's main screen
+EXTRAS_BONUS = 0.2  # Known extras make a launch more likely to render real content
+
+
+def load_history(results_folder):
+    """
+    Loads the launch history.
+    Args:
+        results_folder (str): Base results folder.
+    Returns:
+        dict: {pkg: {activity: {'launched': int, 'failed': int}}}.
+    """
+    return json_store.load(os.path.join(results_folder, HISTORY_FILE), 'launch history')
+
+
+def save_history(results_folder, history, pkgs=None):
+    """
+    Writes the launch history atomically (see json_store.update).
+    Args:
+        results_folder (str): Base results folder.
+        history (dict): History returned by load_history and updated by record_outcome.
+        pkgs (list): Only write these packages over the current file, keeping what other
+                     processes saved for other packages in the meantime. None writes everything.
+    """
+    def change(current):
+        if pkgs is None:
+            current.clear()
+        current.update((pkg, history[pkg]) for pkg in (history if pkgs is None else pkgs) if pkg in history)
+
+    json_store.update(os.path.join(results_folder, HISTORY_FILE), change, 'launch history')
+
+
+def record_outcome(history, pkg, activity, launched):
+    """
+    Records one activity outcome of this run.
+    Args:
+        history (dict): Launch history.
+        pkg (str): Package name.
+        activity (str): Full activity name.
+        launched (bool): Whether the activity reached a normal screen.
+    """
+    entry = history.setdefault(pkg, {}).setdefault(activity, {'launched': 0, 'failed': 0})
+    entry['launched' if launched else 'failed'] += 1
+
+
+def score(entry, has_extras, is_launcher):
+    """Predicted value of exploring an activity: smoothed success rate plus bonuses."""
+    launched = entry.get('launched', 0) if entry else 0
+    failed = entry.get('failed', 0) if entry else 0
+    value = (launched + 1.0) / (launched + failed + 2.0)
+    if has_extras:
+        value += EXTRAS_BONUS
+    if is_launcher:
+        value += LAUNCHER_BONUS
+    return value
+
+
+def schedule(pkg, activities, history, extras_index=None, launcher=''):
+    """
+    Orders the activities of an app for exploration.
+    Args:
+        pkg (str): Package name.
+        activities (list): Activity names in manifest order.
+        history (dict): Launch history.
+        extras_index (dict): Activity -> extras arguments, as loaded from the Soot output.
+        launcher (str): Full name of the launcher activity, if any.
+    Returns:
+        tuple: (ordered, deferred) activity lists. Ties keep the manifest order.
+    """
+    app_history = history.get(pkg, {})
+    extras_index = extras_index or {}
+    ranked = []
+    deferred = []
+    for position, activity in enumerate(activities):
+        entry = app_history.get(activity)
+        if entry and entry.get('launched', 0) == 0 and entry.get('failed', 0) >= DEFER_AFTER_FAILURES \
+                and activity != launcher:
+            deferred.append(activity)
+            continue
+        ranked.append((-score(entry, bool(extras_index.get(activity)), activity == launcher), position, activity))
+    ranked.sort()
+    ordered = [activity for _, _, activity in ranked]
+    if deferred:
+        print(f"Deferring {len(deferred)} activities that failed in previous runs.")
+    return ordered, deferred
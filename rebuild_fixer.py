@@ -0,0 +1,179 @@
+'''
+Collects every recognizable error from an `apktool b` run and fixes them together.
+
+Instead of patching the first "Resource is not public" line and rebuilding once,
+the whole build log is analyzed in one pass, all fixes are applied file by file
+and the caller rebuilds at most a bounded number of times.
+'''
+
+import csv
+import os
+import re
+import shutil
+
+MAX_REBUILDS = 3  # Rebuilds after the first build, each preceded by one round of fixes
+
+NOT_PUBLIC = 'not_public'
+UNKNOWN_ATTRIBUTE = 'unknown_attribute'
+INVALID_RESOURCE_NAME = 'invalid_resource_name'
+FIX_TYPES = (NOT_PUBLIC, UNKNOWN_ATTRIBUTE, INVALID_RESOURCE_NAME)
+
+# "<file>.xml:<line>[:<col>]: error: <message>" as printed by aapt and aapt2 through apktool
+_LOCATED_ERROR = re.compile(r'(?P<file>[^\s:]+\.xml):(?P<line>\d+)(?::\d+)?: error: (?P<msg>.*)')
+_NOT_PUBLIC = re.compile(r'Resource is not public|resource android:\S+ is private')
+_UNKNOWN_ATTR = [
+    re.compile(r"No resource identifier found for attribute '(?P<attr>[\w.]+)' in package '(?P<pkg>[\w.]+)'"),
+    re.compile(r"attribute (?P<pkg>[\w.]+):(?P<attr>[\w.]+) not found"),
+    re.compile(r"style attribute '(?P<pkg>[\w.]+):attr/(?P<attr>[\w.]+)' not found"),
+]
+_INVALID_SYMBOL = re.compile(r"invalid symbol '(?P<symbol>[^']*)'")
+_COMPLETE_ELEMENT = re.compile(r'^\s*<(?P<tag>[\w:-]+)\b[^<>]*(?:/>|>[^<>]*</(?P=tag)>)\s*$')
+_INVALID_FILE = [
+    re.compile(r'(?P<path>\S+): Invalid file name: must contain only'),
+    re.compile(r"invalid file path '(?P<path>[^']+)'"),
+]
+_INVALID_DIR = re.compile(r'invalid resource directory name: (?P<path>\S+) (?P<name>\S+)')
+
+
+def _resolve(path, decompileAPKPath):
+    """Maps a path printed by apktool onto the decompiled tree, or None if it lies outside of it."""
+    root = os.path.realpath(decompileAPKPath)
+    candidate = path if os.path.isabs(path) else os.path.join(decompileAPKPath, path)
+    candidate = os.path.realpath(candidate)
+    if candidate == root or candidate.startswith(root + os.sep):
+        return candidate
+    return None
+
+
+def analyze(build_output, decompileAPKPath):
+    """
+    Extracts all fixable errors from apktool build output.
+    Args:
+        build_output (str): Combined stdout/stderr of `apktool b`.
+        decompileAPKPath (str): Path to the decompiled APK directory.
+    Returns:
+        list: Fix dicts with keys 'type', 'path', 'line' (1-based or None) and 'attr' (attribute or invalid symbol).
+    """
+    fixes = []
+    seen = set()
+
+    def add(fix_type, path, line=None, attr=None):
+        path = _resolve(path, decompileAPKPath)
+        key = (fix_type, path, line, attr)
+        if path and key not in seen:
+            seen.add(key)
+            fixes.append({'type': fix_type, 'path': path, 'line': line, 'attr': attr})
+
+    for raw in build_output.split('\n'):
+        located = _LOCATED_ERROR.search(raw)
+        if located:
+            path, line, msg = located.group('file'), int(located.group('line')), located.group('msg')
+            if _NOT_PUBLIC.search(msg):
+                add(NOT_PUBLIC, path, line)
+                continue
+            for pattern in _UNKNOWN_ATTR:
+                m = pattern.search(msg)
+                if m:
+                    add(UNKNOWN_ATTRIBUTE, path, line, m.group('attr'))
+                    break
+            else:
+                m = _INVALID_SYMBOL.search(msg)
+                if m:
+                    add(INVALID_RESOURCE_NAME, path, line, m.group('symbol'))
+            continue
+
+        for pattern in _INVALID_FILE:
+            m = pattern.search(raw)
+            if m:
+                add(INVALID_RESOURCE_NAME, m.group('path'))
+                break
+        else:
+            m = _INVALID_DIR.search(raw)
+            if m:
+                add(INVALID_RESOURCE_NAME, os.path.join(m.group('path'), m.group('name')))
+
+    return fixes
+
+
+def _fix_line(line, fix):
+    if fix['type'] == NOT_PUBLIC:
+        # '@android:' -> '@*android:' lets aapt reference private framework resources
+        return line.replace('@android:', '@*android:')
+    if fix['type'] == UNKNOWN_ATTRIBUTE:
+        # Drop the attribute (with any namespace prefix) from the offending line
+        return re.sub(r'\s+(?:[\w]+:)?' + re.escape(fix['attr']) + r'="[^"]*"', '', line)
+    if fix['type'] == INVALID_RESOURCE_NAME:
+        # An invalid symbol in a values file: drop its declaration, but only if the line holds the
+        # whole element; a line inside a multi-line element is left alone so the XML stays well-formed
+        if _COMPLETE_ELEMENT.match(line) and (not fix['attr'] or f'"{fix["attr"]}"' in line):
+            return ''
+        print(f"Not removing line {fix['line']} of {fix['path']}: not a complete declaration of the invalid symbol.")
+        return line
+    return line
+
+
+def apply_fixes(fixes):
+    """
+    Applies fixes, reading and writing each affected file once.
+    Args:
+        fixes (list): Fix dicts returned by analyze.
+    Returns:
+        dict: Number of applied fixes per fix type.
+    """
+    applied = dict((t, 0) for t in FIX_TYPES)
+    by_file = {}
+    for fix in fixes:
+        if fix['line'] is None:
+            # Whole file or directory with an invalid resource name: remove it
+            try:
+                if os.path.isdir(fix['path']):
+                    shutil.rmtree(fix['path'])
+                elif os.path.exists(fix['path']):
+                    os.remove(fix['path'])
+                else:
+                    continue
+                print(f"Removed invalid resource: {fix['path']}")
+                applied[fix['type']] += 1
+            except OSError as e:
+                print(f"Error removing invalid resource {fix['path']}: {e}")
+        else:
+            by_file.setdefault(fix['path'], []).append(fix)
+
+    for path, file_fixes in by_file.items():
+        try:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                lines = f.readlines()
+            for fix in file_fixes:
+                index = fix['line'] - 1
+                if not 0 <= index < len(lines):
+                    print(f"Line number {fix['line']} is out of bounds for {path}.")
+                    continue
+                fixed = _fix_line(lines[index], fix)
+                if fixed != lines[index]:
+                    lines[index] = fixed
+                    applied[fix['type']] += 1
+            with open(path, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+        except OSError as e:
+            print(f"Error fixing {path}: {e}")
+
+    print(f"Applied rebuild fixes: {applied}")
+    return applied
+
+
+def save_fix_stats(results_folder, apk_name, rebuilds, applied, result):
+    """
+    Appends the per-APK fix statistics to rebuildFixes.csv.
+    Args:
+        results_folder (str): Base results folder.
+        apk_name (str): APK name.
+        rebuilds (int): Number of rebuilds after the initial build.
+        applied (dict): Number of applied fixes per fix type (summed over all rounds).
+        result (str): 'success' or 'build error'.
+    """
+    csv_file = os.path.join(results_folder, 'rebuildFixes.csv')
+    with open(csv_file, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if os.stat(csv_file).st_size == 0:
+            writer.writerow(('apk_name', 'rebuilds') + FIX_TYPES + ('result',))
+        writer.writerow((apk_name, rebuilds) + tuple(applied[t] for t in FIX_TYPES) + (result,))
@@ -2,8 +2,14 @@ import os
 import shutil
 import subprocess # Import the subprocess module
 
+import apk_signer
+import deadlines
+import rebuild_fixer
+
 # keyPath = os.path.join(os.path.split(os.path.realpath(__file__))[0], "coolapk.keystore")  # pwd: 123456, private key path
 keyPath = ''
+keyAlias = apk_signer.DEFAULT_KEY_ALIAS
+keyPassword = apk_signer.DEFAULT_KEY_PASSWORD
 def decompile(eachappPath, decompileAPKPath):
     """
     Decompiles an APK file using apktool.
@@ -15,10 +21,11 @@ def decompile(eachappPath, decompileAPKPath):
     cmd = ["apktool", "d", eachappPath, "-f", "-o", decompileAPKPath]
     print(f"Command to run: {' '.join(cmd)}")
     try:
-        # Using subprocess.run for simple command execution.
         # check=True will raise CalledProcessError if the command returns a non-zero exit code.
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        deadlines.run(cmd, 'jvm', check=True, capture_output=True)
         print(f"Successfully decompiled {eachappPath} to {decompileAPKPath}")
+    except subprocess.TimeoutExpired:
+        print(f"Decompilation of {eachappPath} timed out and was killed.")
     except subprocess.CalledProcessError as e:
         print(f"Error during decompilation: {e}")
         print(f"Stdout: {e.stdout}")
@@ -27,61 +34,33 @@ def decompile(eachappPath, decompileAPKPath):
         print("Error: apktool command not found. Please ensure apktool is installed and in your PATH.")
 
 
-def modifyManifestAgain(line_num, decompileAPKPath):
-    """
-    Modifies the AndroidManifest.xml to fix a specific error related to resource visibility.
-    Args:
-        line_num (int): The 1-based line number in the Manifest file to modify.
-        decompileAPKPath (str): Path to the decompiled APK directory.
-    """
-    ManifestPath = os.path.join(decompileAPKPath, "AndroidManifest.xml")
-    try:
-        with open(ManifestPath, 'r') as f:
-            lines = f.readlines()
-
-        if 0 < line_num <= len(lines):
-            # Adjust to 0-based index for list access
-            target_line_index = line_num - 1
-            if '@android' in lines[target_line_index]:
-                # Replace '@android' with '@*android' to fix resource visibility error
-                parts = lines[target_line_index].split('@android', 1)
-                lines[target_line_index] = parts[0] + '@*android' + parts[1]
-                print(f"Modified line {line_num} in AndroidManifest.xml.")
-            else:
-                print(f"Line {line_num} does not contain '@android'. No modification needed.")
-        else:
-            print(f"Line number {line_num} is out of bounds for AndroidManifest.xml.")
-
-        with open(ManifestPath, 'w') as f:
-            f.writelines(lines)
-    except FileNotFoundError:
-        print(f"Error: AndroidManifest.xml not found at {ManifestPath}")
-    except Exception as e:
-        print(f"An error occurred while modifying AndroidManifest.xml: {e}")
-
-
 def recompile(decompileAPKPath):
     """
     Recompiles the modified APK using apktool.
     Args:
         decompileAPKPath (str): Path to the decompiled APK directory.
     Returns:
-        str: The standard output from the apktool recompile command.
+        str: The combined standard output and error from the apktool recompile command.
     """
     cmd = ["apktool", "b", decompileAPKPath]
     print("Recompiling...")
     try:
-        # Using subprocess.run to capture output.
         # capture_output=True captures stdout and stderr.
         # text=True decodes stdout/stderr as text.
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False) # check=False because we handle errors based on output content
+        result = deadlines.run(cmd, 'jvm', capture_output=True, check=False) # check=False because we handle errors based on output content
         if result.returncode != 0:
             print(f"Recompilation failed with exit code {result.returncode}.")
             print(f"Stderr: {result.stderr}")
-        return result.stdout
+        # aapt errors are reported on stderr, the fixer needs both streams
+        return result.stdout + '\n' + result.stderr
+    except subprocess.TimeoutExpired:
+        print("Recompilation timed out and was killed.")
+        return ""
     except FileNotFoundError:
         print("Error: apktool command not found. Please ensure apktool is installed and in your PATH.")
         return ""
+    except deadlines.BudgetExpired:
+        raise
     except Exception as e:
         print(f"An error occurred during recompilation: {e}")
         return ""
@@ -89,7 +68,8 @@ def recompile(decompileAPKPath):
 
 def sign_apk(apk_name, decompileAPKPath, repackagedAppPath):
     """
-    Signs the repackaged APK using jarsigner.
+    Signs the repackaged APK in-process (v1 + v2 signatures) with the configured keystore.
+    The signed APK is written directly under its final name, no JDK is required.
     Args:
         apk_name (str): The base name of the APK (without .apk extension).
         decompileAPKPath (str): Path to the decompiled APK directory (where the 'dist' folder is).
@@ -98,72 +78,30 @@ def sign_apk(apk_name, decompileAPKPath, repackagedAppPath):
         str: "success" if signing is successful, "fail" otherwise.
     """
     repackName = apk_name + ".apk"
-    resign_appName = apk_name + "_sign" + ".apk"
     repackAppPath = os.path.join(decompileAPKPath, 'dist', repackName) # Corrected path to the built APK
-    sign_apk_output_path = os.path.join(repackagedAppPath, resign_appName)
+    sign_apk_output_path = os.path.join(repackagedAppPath, repackName)
 
     print(f"Key Path: {keyPath}")
     print(f"Output Signed APK Path: {sign_apk_output_path}")
     print(f"Input Repackaged APK Path: {repackAppPath}")
 
-    # The password '123456' is passed via stdin to jarsigner
-    cmd = [
-        "jarsigner",
-        "-verbose",
-        "-keystore", keyPath,
-        "-signedjar", sign_apk_output_path,
-        repackAppPath,
-        "coolapk" # Alias for the key
-    ]
-
     print("Signing...")
     try:
-        # Using subprocess.run with input to pass the password
-        result = subprocess.run(
-            cmd,
-            input='123456\n', # Password followed by a newline
-            capture_output=True,
-            text=True,
-            check=False # Do not raise an exception for non-zero exit codes, we check output
-        )
-        signlog = result.stdout
-        if result.returncode != 0:
-            print(f"Jarsigner failed with exit code {result.returncode}.")
-            print(f"Stderr: {result.stderr}")
-
-        for line in signlog.split("\n"):
-            if 'jar signed.' in line:
-                print('Sign success...................................................')
-                return "success"
-        print("Sign failed. 'jar signed.' not found in output.")
+        key = apk_signer.load_keystore(keyPath, keyPassword, keyAlias)
+        apk_signer.sign(repackAppPath, sign_apk_output_path, key)
+        print('Sign success...................................................')
+        return "success"
+    except FileNotFoundError as e:
+        print(f"Sign failed. File not found: {e.filename}")
         return "fail"
-    except FileNotFoundError:
-        print("Error: jarsigner command not found. Please ensure Java Development Kit (JDK) is installed and in your PATH.")
+    except apk_signer.SignError as e:
+        print(f"Sign failed: {e}")
         return "fail"
     except Exception as e:
         print(f"An error occurred during signing: {e}")
         return "fail"
 
 
-def rename(apkname, repackagedAppPath):
-    """
-    Renames the signed APK to its original name.
-    Args:
-        apkname (str): The base name of the APK.
-        repackagedAppPath (str): Path to the directory where the signed APK is located.
-    """
-    oldNamePath = os.path.join(repackagedAppPath, apkname + '_sign.apk')
-    newNamePath = os.path.join(repackagedAppPath, apkname + '.apk')
-    try:
-        if os.path.exists(oldNamePath):
-            os.rename(oldNamePath, newNamePath)
-            print(f"Renamed {os.path.basename(oldNamePath)} to {os.path.basename(newNamePath)}")
-        else:
-            print(f"Error: File not found for renaming: {oldNamePath}")
-    except OSError as e:
-        print(f"Error renaming file: {e}")
-
-
 def remove_folder(apkname, decompilePath):
     """
     Removes the decompiled APK folder.
@@ -233,7 +171,7 @@ def modifyManifest_00(decompileAPKPath):
             return "Error"
 
 
-def startRepkg(apk_path, apkname, results_folder, config_folder):
+def startRepkg(apk_path, apkname, results_folder, config_folder, decompile_root=None):
     """
     Starts the repackaging process for an APK.
     Args:
@@ -241,6 +179,7 @@ def startRepkg(apk_path, apkname, results_folder, config_folder):
         apkname (str): The base name of the APK (without .apk extension).
         results_folder (str): Base folder for all results (decompiled, repackaged, error apks).
         config_folder (str): Folder containing configuration files like keystore.
+        decompile_root (str): Folder for the decoded tree (e.g. a workspace); defaults to results/apktool.
     Returns:
         str: Status of the repackaging process (e.g., 'success', 'no manifest file', 'build error', 'sign error').
     """
@@ -251,7 +190,7 @@ def startRepkg(apk_path, apkname, results_folder, config_folder):
     noManifestAppPath = os.path.join(results_folder, "no-manifest-apks")
     buildErrorAppPath = os.path.join(results_folder, "build-error-apks")
     signErrorAppPath = os.path.join(results_folder, "sign-error-apks")
-    decompilePath = os.path.join(results_folder, "apktool")  # decompiled app path (apktool handled)
+    decompilePath = decompile_root or os.path.join(results_folder, "apktool")  # decompiled app path (apktool handled)
     repackagedAppPath = os.path.join(results_folder, "repackaged")  # store the repackaged apps
 
     # Create necessary directories
@@ -281,22 +220,34 @@ def startRepkg(apk_path, apkname, results_folder, config_folder):
             print(f"Error moving APK: {e}")
         return 'no manifest file'
 
-    # Recompile modified apk
-    recompileInfo = recompile(decompileAPKPath)
-    print("Recompiling output received.")
-
+    # Recompile modified apk, fixing every recognized build error between attempts
     builtApk = False
-    for line in recompileInfo.split('\n'):
-        if "Error: Resource is not public." in line:
-            print("Resource not public error detected. Attempting to fix and recompile.")
-            line_num = int(line.split('AndroidManifest.xml:')[1].split(': error')[0])
-            modifyManifestAgain(line_num, decompileAPKPath)
-            recompileInfo = recompile(decompileAPKPath) # Re-attempt recompile after modification
-            break # Exit loop after first fix attempt
-        if "Built apk..." in line:
+    rebuilds = 0
+    applied_total = dict((t, 0) for t in rebuild_fixer.FIX_TYPES)
+    while True:
+        recompileInfo = recompile(decompileAPKPath)
+        print("Recompiling output received.")
+        if "Built apk..." in recompileInfo:
             builtApk = True
             print("Successfully recompiled an apk!!!")
-            break # Exit loop once "Built apk..." is found
+            break
+        if rebuilds >= rebuild_fixer.MAX_REBUILDS:
+            print(f"Giving up after {rebuilds} rebuilds.")
+            break
+        fixes = rebuild_fixer.analyze(recompileInfo, decompileAPKPath)
+        if not fixes:
+            print("No fixable build errors detected.")
+            break
+        print(f"{len(fixes)} fixable build errors detected. Attempting to fix and recompile.")
+        applied = rebuild_fixer.apply_fixes(fixes)
+        if not any(applied.values()):
+            break
+        for t in applied:
+            applied_total[t] += applied[t]
+        rebuilds += 1
+
+    rebuild_fixer.save_fix_stats(results_folder, apkname, rebuilds, applied_total,
+                                 'success' if builtApk else 'build error')
 
     if not builtApk:
         print("Recompilation failed. Moving original APK to build-error-apks.")
@@ -324,8 +275,6 @@ def startRepkg(apk_path, apkname, results_folder, config_folder):
             print(f"Error moving APK: {e}")
         return 'sign error'
 
-    # Rename the signed apk
-    rename(apkname, repackagedAppPath)
     print(f"Repackaging of {apkname} completed successfully.")
 
     # Remove the decompiled and modified resources
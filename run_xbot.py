@@ -6,43 +6,100 @@ import os
 import shutil
 import sys
 import csv
+import time
 import subprocess # Import the subprocess module
+from collections import deque
 
-global paras_path
-
-# Global configurations from command line arguments
-emulator = sys.argv[1] # Emulator name
+# Global configurations from command line arguments, set by parse_args
+emulators = [] # Emulator name(s), comma separated for a device pool
+emulator = '' # Device of this process (set per worker process with a device pool)
 # emulator = 'emulator-5554' # Android Studio emulator (example)
 
 # Derive other paths
 accessbility_folder = os.path.join(os.getcwd(), 'main-folder') 
 
-apkPath = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] else  os.path.join(accessbility_folder, "apks")# APK folder e.g., main-folder/apks/a2dp.Vol_133.apk
+apkPath = os.path.join(accessbility_folder, "apks") # APK folder e.g., main-folder/apks/a2dp.Vol_133.apk
 
 config_folder = os.path.join(accessbility_folder, "config")
-results_folder = os.path.join(accessbility_folder, "results")
+# Results folder (optional XBOT_RESULTS; farm workers give every worker its own)
+results_folder = os.environ.get('XBOT_RESULTS') or os.path.join(accessbility_folder, "results")
 storydroid_folder = os.path.join(accessbility_folder, "storydroid")
-decompilePath = os.path.join(accessbility_folder, "apktool")  # decompiled app path (apktool handled)
 repackagedAppPath = os.path.join(results_folder, "repackaged")  # store the repackaged apps
 keyPath = os.path.join(config_folder, "coolapk.keystore") # pwd: 123456, private key path
 lib_home_path = os.path.join(config_folder, "libs") # configlib path
 results_outputs = os.path.join(results_folder, "outputs") # project results
-tmp_file = os.path.join(results_folder, emulator) # tmp file for parallel execution
+skippedAppPath = os.path.join(results_folder, "triage-skipped-apks") # apks rejected by the pre-flight triage
+spillPath = os.path.join(results_folder, "workspaces") # per-job workspaces that do not fit into RAM
 
 # Java Home Path - **Please verify this path for your system**
 # java_home_path = '/Library/Java/JavaVirtualMachines/jdk1.8.0_211.jdk/Contents/Home/' # For Macbook (example)
 java_home_path = os.environ.get('JAVA_HOME')
 
+# Emulator snapshot reloaded when a device has to be recovered (optional)
+snapshot_name = os.environ.get('XBOT_SNAPSHOT')
+
+# Warm launch mode: reuse the app process between activities instead of 'am start -S' (optional)
+warm_launch = os.environ.get('XBOT_WARM_LAUNCH') == '1'
+
+# Explore every activity of every app version instead of only the ones changed since the last scan (optional)
+full_scan = os.environ.get('XBOT_FULL_SCAN') == '1'
+
+# Local port for the on-device helper agent (optional); its APK is expected at config/xbot-agent.apk
+agent_port = int(os.environ['XBOT_AGENT_PORT']) if os.environ.get('XBOT_AGENT_PORT') else None
+
+# Record every adb/shell command of each exploration into <folder>/<apk_name>.zip for offline replay (optional)
+record_folder = os.environ.get('XBOT_RECORD')
+
+# Tap through the screens of each activity and scan the new ones, within a per-activity budget (optional)
+deep_explore = os.environ.get('XBOT_DEEP_EXPLORE') == '1'
+
+# Wait for the screen to stop changing instead of fixed sleeps: "1" or tuned settings, see settle.py (optional)
+settle_spec = os.environ.get('XBOT_SETTLE')
+
+# Spread the activities of large apps over all given emulators instead of running one APK per emulator (optional)
+shard = os.environ.get('XBOT_SHARD') == '1'
+
+# Run Soot only for apps with activities that crash or finish at once without extras, then retry those (optional)
+lazy_soot = os.environ.get('XBOT_LAZY_SOOT') == '1'
+
+# Infer the intent extras from the dex code in-process instead of running Soot (optional, see dex_extras.py)
+dex_extras_scan = os.environ.get('XBOT_DEX_EXTRAS') == '1'
+
+# Concurrency bounds of the stages, e.g. "soot=1-4,repkg=1-8,explore=1-2" (optional, adjusted at run time)
+concurrency_bounds = os.environ.get('XBOT_CONCURRENCY')
+
 # SDK Platform Path - **Please verify this path for your system**
 sdk_platform_path = os.path.join(lib_home_path, 'android-platforms') # For Macbook (example)
 
-# Global variable for activity parameters file path, set later in main
-paras_path = ''
-
 # Import other modules (assuming they are in the same directory or Python path)
 # Assuming these modules have been refactored to use subprocess.
 import repkg_apk
 import explore_activity
+import apk_triage
+import soot_runner
+import dex_extras
+import deadlines
+import device_health
+import workspace
+import version_delta
+import scheduler
+import adb_session
+import concurrency
+import screen_states
+import settle
+
+
+def parse_args(argv):
+    """
+    Sets the emulators and the APK folder from the command line.
+    Args:
+        argv (list): sys.argv, i.e. [script, emulators, (apk folder)].
+    """
+    global emulators, emulator, apkPath
+    emulators = argv[1].split(',')
+    emulator = emulators[0]
+    if len(argv) > 2 and argv[2]:
+        apkPath = argv[2]
 
 
 def createOutputFolder():
@@ -52,25 +109,31 @@ def createOutputFolder():
     print("Creating output folders...")
     os.makedirs(results_folder, exist_ok=True)
     os.makedirs(storydroid_folder, exist_ok=True)
-    os.makedirs(decompilePath, exist_ok=True)
     os.makedirs(repackagedAppPath, exist_ok=True)
     os.makedirs(results_outputs, exist_ok=True)
+    os.makedirs(skippedAppPath, exist_ok=True)
+    os.makedirs(spillPath, exist_ok=True)
     print("Output folders ensured.")
 
 
-def execute(apk_path, apk_name):
+def execute(apk_path, apk_name, paras_path, ws, uninstall=True, extras_provider=None):
     """
     Executes the repackaging and activity exploration process for a single APK.
     Args:
         apk_path (str): Full path to the original APK.
         apk_name (str): Name of the APK without the '.apk' extension.
+        paras_path (str): Path to the Soot activity parameters file of this APK.
+        ws (workspace.Workspace): Scratch workspace of the job (decoded tree, pulled files).
+        uninstall (bool): Uninstall the app after exploration.
+        extras_provider (callable): Runs the Soot analysis on demand (lazy Soot), None if it already ran.
     """
     # Repackage app
     repackaged_apk_full_path = os.path.join(repackagedAppPath, apk_name + '.apk')
 
     if not os.path.exists(repackaged_apk_full_path):
         print(f"Repackaging {apk_name}...")
-        r = repkg_apk.startRepkg(apk_path, apk_name, results_folder, config_folder)
+        with concurrency.slot('repkg'):
+            r = repkg_apk.startRepkg(apk_path, apk_name, results_folder, config_folder, ws.decompile_root)
 
         if r in ['no manifest file', 'build error', 'sign error']:
             print(f"APK {apk_name} not successfully recompiled ({r}). Will use the original app to execute if possible.")
@@ -82,6 +145,10 @@ def execute(apk_path, apk_name):
             # The explore_activity will then proceed if a repackaged app exists or handle its absence.
     else:
         print(f"Repackaged APK {apk_name} already exists. Skipping repackaging.")
+        # The decoded manifest is still needed for exploration, the workspace starts empty
+        with concurrency.slot('repkg'):
+            repkg_apk.decompile(apk_path, os.path.join(ws.decompile_root, apk_name))
+    workspace.measure(ws)
 
     new_apkpath = os.path.join(repackagedAppPath, apk_name + '.apk')
 
@@ -90,60 +157,52 @@ def execute(apk_path, apk_name):
     # using the original APK or reporting an error.
     if os.path.exists(new_apkpath):
         print(f"Starting activity exploration for repackaged APK: {new_apkpath}")
-        explore_activity.exploreActivity(new_apkpath, apk_name, results_folder, emulator, tmp_file, paras_path)
+        with concurrency.slot('explore'):
+            explore_activity.exploreActivity(new_apkpath, apk_name, results_folder, emulator, ws.tmp, paras_path,
+                                             uninstall, ws.decompile_root, extras_provider)
     else:
         print(f"Repackaged APK {new_apkpath} not found. Cannot proceed with exploration for {apk_name}.")
 
 
-def run_soot(apk_path, pkg):
+def run_soot(apk_path, apk_name, pkg):
     """
-    Runs the Soot analysis tool to get bundle data for UI page rendering.
+    Runs the Soot analysis tool (or the dex scanner) to get bundle data for UI page rendering.
     Args:
         apk_path (str): Full path to the APK.
+        apk_name (str): Name of the APK without the '.apk' extension.
         pkg (str): Package name of the APK.
+    Returns:
+        dict: Result of soot_runner.run_soot (status, duration, paras_path, ...).
     """
-    soot_file = 'run_soot.run' # Binary file name
-    current_dir = os.getcwd() # Save current directory
-    
-    print(f"Changing directory to: {config_folder}")
-    os.chdir(config_folder) # Change to config directory where run_soot.run is located
-
-    cmd = [
-        f'./{soot_file}',
-        storydroid_folder,
-        apk_path,
-        pkg,
-        java_home_path,
-        sdk_platform_path,
-        lib_home_path
-    ]
-    undefined_values = [val for val in cmd if not val]
-    if undefined_values:
-        print("❌ Error: Some required command arguments are undefined or empty:")
-        for i, val in enumerate(cmd):
-            if not val:
-                print(f"  - Argument {i + 1} (missing)")
-
-    print(f"Running Soot command: {' '.join(cmd)}")
-    try:
-        # Use subprocess.run to execute the binary
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        print("Soot analysis completed successfully.")
-        if result.stdout:
-            print(f"Soot Output:\n{result.stdout}")
-        if result.stderr:
-            print(f"Soot Errors (if any):\n{result.stderr}")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running Soot analysis for {pkg}: {e}")
-        print(f"Soot Stderr:\n{e.stderr}")
-    except FileNotFoundError:
-        print(f"Error: Soot binary '{soot_file}' not found in {config_folder}. Please ensure it exists and is executable.")
-    except Exception as e:
-        print(f"An unexpected error occurred during Soot analysis: {e}")
-    finally:
-        # Change back to the original directory
-        print(f"Changing directory back to: {current_dir}")
-        os.chdir(current_dir)
+    if dex_extras_scan:
+        result = dex_extras.run_dex_scan(apk_path, apk_name, pkg, storydroid_folder)
+    else:
+        result = soot_runner.run_soot(apk_path, apk_name, pkg, **soot_kwargs())
+    soot_runner.save_soot_result_to_csv(results_folder, result)
+    return result
+
+
+def lazy_soot_provider(apk_path, apk_name, pkg):
+    """
+    Builds the extras provider of an APK in lazy Soot mode.
+    Args:
+        apk_path (str): Full path to the original APK.
+        apk_name (str): Name of the APK without the '.apk' extension.
+        pkg (str): Package name of the APK.
+    Returns:
+        callable: Runs the Soot analysis and returns the path to its parameters file, or None if it failed.
+    """
+    def provide():
+        with concurrency.slot('soot'):
+            result = run_soot(apk_path, apk_name, pkg)
+        return result['paras_path'] if result['status'] == 'success' else None
+    return provide
+
+
+def soot_kwargs():
+    """Folder arguments shared by every Soot run."""
+    return dict(storydroid_folder=storydroid_folder, config_folder=config_folder, java_home_path=java_home_path,
+                sdk_platform_path=sdk_platform_path, lib_home_path=lib_home_path)
 
 
 def get_pkg(apk_path):
@@ -159,7 +218,10 @@ def get_pkg(apk_path):
     try:
         # Command to get the package name defined in the manifest
         cmd_defined_pkg = f"aapt dump badging \"{apk_path}\" | grep 'package' | awk -v FS=\"'\" '/package: name=/{{print$2}}'"
-        defined_pkg_name = subprocess.run(cmd_defined_pkg, shell=True, capture_output=True, text=True, check=True).stdout.strip()
+        defined_pkg_name = deadlines.run(cmd_defined_pkg, 'shell', shell=True, capture_output=True, check=True).stdout.strip()
+    except subprocess.TimeoutExpired:
+        print(f"Timed out getting defined package name for {apk_path}")
+        return ''
     except subprocess.CalledProcessError as e:
         print(f"Error getting defined package name for {apk_path}: {e.stderr.strip()}")
         return '' # Return empty if aapt fails
@@ -169,7 +231,7 @@ def get_pkg(apk_path):
     try:
         # Command to get the launchable activity
         cmd_launcher = f"aapt dump badging \"{apk_path}\" | grep launchable-activity | awk '{{print $2}}'"
-        launcher_output = subprocess.run(cmd_launcher, shell=True, capture_output=True, text=True, check=True).stdout.strip()
+        launcher_output = deadlines.run(cmd_launcher, 'shell', shell=True, capture_output=True, check=True).stdout.strip()
 
         if launcher_output:
             launcher = launcher_output.strip("'") # Remove potential quotes
@@ -192,29 +254,176 @@ def get_pkg(apk_path):
     return used_pkg_name
 
 
-def remove_folder(apkname, decompilePath):
+def prepare_paras(apk_name):
     """
-    Removes the decompiled APK folder.
+    Waits for the Soot analysis of an APK (if one is running) and makes sure its parameters file exists.
     Args:
-        apkname (str): The base name of the APK.
-        decompilePath (str): Path to the directory containing decompiled APK folders.
+        apk_name (str): Name of the APK without the '.apk' extension.
+    Returns:
+        str: Path to the activity parameters file.
     """
-    folder = os.path.join(decompilePath, apkname)
-    if not os.path.exists(folder):
-        print(f"Decompiled folder not found: {folder}. Nothing to remove.")
-        return
+    current_soot_output_dir = soot_runner.soot_output_dir(storydroid_folder, apk_name)
+    paras_path = os.path.join(current_soot_output_dir, soot_runner.PARAS_FILE)
+    if apk_name in soot_futures:
+        print(f"Waiting for Soot analysis of {apk_name}...")
+        soot_runner.save_soot_result_to_csv(results_folder, soot_futures.pop(apk_name).result())
+
+    # Ensure the parameters file exists, even if empty, before passing to explore_activity
+    os.makedirs(current_soot_output_dir, exist_ok=True)
+    if not os.path.exists(paras_path):
+        open(paras_path, 'w').close() # Create an empty file if Soot didn't create it
+    return paras_path
+
+
+def soot_ready(record):
+    """True if the APK does not wait for a running Soot analysis."""
+    future = soot_futures.get(record['apk_name'])
+    return future is None or future.done()
+
+
+def process_apk(apk_file, pkg, paras_path, monitor, rooted, uninstall=True, may_requeue=True):
+    """
+    Repackages and explores one APK on the emulator of this process, then cleans up its files.
+    Args:
+        apk_file (str): APK file name in apkPath.
+        pkg (str): Package name of the APK.
+        paras_path (str): Path to the Soot activity parameters file of this APK.
+        monitor (device_health.HealthMonitor): Health monitor of the emulator.
+        rooted (bool): Whether adbd runs as root on the emulator.
+        uninstall (bool): Uninstall the app after exploration.
+        may_requeue (bool): Whether the APK may be run again if the device fails under it.
+    Returns:
+        str: scheduler.FINISHED, scheduler.REQUEUE (files kept) or scheduler.DEVICE_LOST.
+    """
+    apk_full_path = os.path.join(apkPath, apk_file) # Get full apk path
+    apk_name = os.path.splitext(apk_file)[0] # Get apk name without .apk extension
+
+    extras_provider = None
+    if lazy_soot and os.path.getsize(paras_path) == 0:
+        extras_provider = lazy_soot_provider(apk_full_path, apk_name, pkg) # Soot has not analysed this APK yet
+
+    if monitor.failed():
+        # The device failed between APKs (triage, Soot wait, cleanup): recover it before this APK runs on it
+        recovered = device_health.recover(emulator, snapshot_name, expect_root=rooted)
+        monitor.reset()
+        if not recovered:
+            print(f"Device {emulator} could not be recovered.")
+            return scheduler.DEVICE_LOST
+
+    device_failed = False
     try:
-        shutil.rmtree(folder)
-        print(f"Successfully removed decompiled folder: {folder}")
-    except OSError as e:
-        print(f"Error removing folder {folder}: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred while removing folder {folder}: {e}")
+        with workspace.allocate(apk_name, apk_full_path, spillPath) as ws, \
+                deadlines.budget('apk', deadlines.APK_BUDGET, apk_name):
+            execute(apk_full_path, apk_name, paras_path, ws, uninstall, extras_provider)
+    except deadlines.BudgetExpired as e:
+        print(f"Giving up on {apk_name}: {e}")
+    except device_health.DeviceFailed as e:
+        # Decided by the exploration itself: the monitor may already have seen a healthy probe since
+        print(f"Exploration of {apk_name} aborted: {e}")
+        device_failed = True
+
+    if device_failed or monitor.failed():
+        # The device failed under this APK: recover it and run the APK again
+        recovered = device_health.recover(emulator, snapshot_name, expect_root=rooted)
+        monitor.reset()
+        if not recovered:
+            print(f"Device {emulator} could not be recovered.")
+            return scheduler.DEVICE_LOST
+        if may_requeue:
+            return scheduler.REQUEUE
+        print(f"{apk_name} was interrupted too often. Not requeueing it again.")
+
+    print(f"Cleaning up files for {apk_name}...")
+    # Delete the original apk (if it was copied or moved by repkg_apk)
+    if os.path.exists(apk_full_path):
+        try:
+            os.remove(apk_full_path)
+            print(f"Removed original APK: {apk_full_path}")
+        except OSError as e:
+            print(f"Error removing original APK {apk_full_path}: {e}")
+
+    # Delete the repackaged apk
+    repackaged_apk_to_remove = os.path.join(repackagedAppPath, apk_name + '.apk')
+    if os.path.exists(repackaged_apk_to_remove):
+        try:
+            os.remove(repackaged_apk_to_remove)
+            print(f"Removed repackaged APK: {repackaged_apk_to_remove}")
+        except OSError as e:
+            print(f"Error removing repackaged APK {repackaged_apk_to_remove}: {e}")
+    # The decompiled and modified resources went away with the workspace
+    return scheduler.FINISHED
+
+
+def connect_device(device):
+    """
+    Gets root on a device and starts its health monitor.
+    Returns:
+        tuple: (monitor, rooted).
+    """
+    print(f"Attempting to root emulator: adb -s {device} root")
+    try:
+        rooted = device_health.ensure_root(device)
+        if not rooted:
+            print("Warning: Failed to get root access or encountered an unexpected error.")
+    except FileNotFoundError:
+        print("Error: adb command not found. Please ensure ADB is installed and in your PATH.")
+        sys.exit(1) # Exit if adb is not found
+    return device_health.start_monitor(device, expect_root=rooted), rooted
+
+
+_device = {} # Monitor and root state of the device of a pool worker process
+
+
+def run_on_device(device, record):
+    """
+    Runs one scheduled APK in a pool worker process (scheduler.run_pool).
+    Args:
+        device (str): Emulator of the worker.
+        record (dict): Triage record of the APK, with 'paras_path' and 'requeues'.
+    Returns:
+        str: Outcome of process_apk.
+    """
+    global emulator
+    if not _device:
+        emulator = device
+        if agent_port:
+            explore_activity.agent_port = agent_port + emulators.index(device) # One forwarded port per device
+        workspace.QUOTA_MB = workspace.QUOTA_MB // len(emulators) # Reservations are tracked per process
+        _device['monitor'], _device['rooted'] = connect_device(device)
+    print(f"\n======== Starting analysis for {record['apk_name']} on {device} (Package: {record['pkg']}) ========")
+    return process_apk(record['apk_file'], record['pkg'], record['paras_path'], _device['monitor'],
+                       _device['rooted'], may_requeue=record['requeues'] < device_health.MAX_REQUEUES)
+
+
+soot_futures = {} # apk_name -> Future of its running Soot analysis
 
 
 if __name__ == '__main__':
     
+    parse_args(sys.argv)
     createOutputFolder()  # Create the folders if not exists
+    deadlines.log_folder = results_folder # Timeout outcomes go to results/timeouts.csv
+    workspace.sweep_stale([workspace.RAM_ROOT, spillPath]) # Workspaces of killed runs
+    explore_activity.warm_launch = warm_launch
+    explore_activity.deep_explore = deep_explore
+    if settle_spec:
+        settle.configure(settle_spec)
+        settle.log_folder = results_folder
+    if deep_explore:
+        deadlines.ACTIVITY_BUDGET += screen_states.MAX_SECONDS
+    version_delta.ENABLED = not full_scan
+    explore_activity.agent_port = agent_port
+    explore_activity.agent_apk = os.path.join(config_folder, 'xbot-agent.apk')
+    if record_folder:
+        adb_session.mode = adb_session.RECORD
+        adb_session.record_folder = record_folder
+
+    # Stage limits shared with the device pool workers, adjusted to host load and memory while running
+    cpus = os.cpu_count() or 1
+    concurrency.setup({'repkg': (1, cpus, max(1, cpus // 2)),
+                       'soot': (1, soot_runner.default_pool_size(), soot_runner.default_pool_size()),
+                       'explore': (1, 1 if shard else len(emulators), 1 if shard else len(emulators))}, concurrency_bounds)
+    concurrency.start_controller(results_folder)
 
     out_csv = os.path.join(results_folder, 'log.csv')
     if not os.path.exists(out_csv):
@@ -224,82 +433,103 @@ if __name__ == '__main__':
             csv.writer(f).writerow(('apk_name', 'pkg_name', 'all_act_num', 'launched_act_num',
                                     'act_not_launched','act_num_with_issue'))
 
-    # Prepare for ADB root command once
-    adb_root_cmd = ["adb", "-s", emulator, "root"]
-    print(f"Attempting to root emulator: {' '.join(adb_root_cmd)}")
-    try:
-        root_output = subprocess.run(adb_root_cmd, capture_output=True, text=True, check=False)
-        print(f"ADB Root Output:\n{root_output.stdout.strip()}")
-        if root_output.stderr:
-            print(f"ADB Root Errors:\n{root_output.stderr.strip()}")
-        if root_output.returncode != 0 and "adbd cannot run as root" not in root_output.stderr:
-            print("Warning: Failed to get root access or encountered an unexpected error.")
-    except FileNotFoundError:
-        print("Error: adb command not found. Please ensure ADB is installed and in your PATH.")
-        sys.exit(1) # Exit if adb is not found
-
-    # Set global paras_path before calling execute
-    # This path is where Soot outputs activity parameters
-    # The assumption is that `run_soot` would have created this path and file.
-    paras_path = os.path.join(storydroid_folder, 'outputs', 'activity_paras.txt') # Adjusted to not include apk_name initially
-
-    for apk_file in os.listdir(apkPath): # Run the apk one by one
-        # Ensure we only process actual APK files and not directories or other files
-        if apk_file.lower().endswith('.apk') and os.path.isfile(os.path.join(apkPath, apk_file)):
-
-            apk_full_path = os.path.join(apkPath, apk_file) # Get full apk path
-            apk_name = os.path.splitext(apk_file)[0] # Get apk name without .apk extension
-            pkg = get_pkg(apk_full_path) # Get pkg name for this APK
-
-            print(f"\n======== Starting analysis for {apk_name} (Package: {pkg}) ========")
-
-            '''
-            Get Bundle Data (Soot Analysis)
-            Trade off by users, open or close
-            '''
-            # Ensure the output directory for this specific APK's Soot results exists
-            current_soot_output_dir = os.path.join(storydroid_folder, 'outputs', apk_name)
-            os.makedirs(current_soot_output_dir, exist_ok=True)
-            current_paras_path = os.path.join(current_soot_output_dir, 'activity_paras.txt')
-
-            # Update the global paras_path for explore_activity to use the correct file for this APK
-            paras_path = current_paras_path
-
-            # Only run Soot if the parameters file doesn't exist or is empty
-            if not os.path.exists(current_paras_path) or os.stat(current_paras_path).st_size == 0:
-                print(f"Running Soot analysis for {apk_name} to generate parameters in {current_soot_output_dir}...")
-                run_soot(apk_full_path, pkg)
-            else:
-                print(f"Soot parameters file already exists for {apk_name}. Skipping Soot analysis.")
-
-            # Ensure the parameters file exists, even if empty, before passing to explore_activity
-            if not os.path.exists(paras_path):
-                open(paras_path, 'w').close() # Create an empty file if Soot didn't create it
-
-            '''
-            Core Execution (Repackaging and Exploration)
-            '''
-            execute(apk_full_path, apk_name)
-
-            print(f"Cleaning up files for {apk_name}...")
-            # Delete the original apk (if it was copied or moved by repkg_apk)
-            if os.path.exists(apk_full_path):
-                try:
-                    os.remove(apk_full_path)
-                    print(f"Removed original APK: {apk_full_path}")
-                except OSError as e:
-                    print(f"Error removing original APK {apk_full_path}: {e}")
-
-            # Delete the repackaged apk
-            repackaged_apk_to_remove = os.path.join(repackagedAppPath, apk_name + '.apk')
-            if os.path.exists(repackaged_apk_to_remove):
-                try:
-                    os.remove(repackaged_apk_to_remove)
-                    print(f"Removed repackaged APK: {repackaged_apk_to_remove}")
-                except OSError as e:
-                    print(f"Error removing repackaged APK {repackaged_apk_to_remove}: {e}")
-
-            # Remove the decompiled and modified resources
-            remove_folder(apk_name, decompilePath)
-
-    print("\nAll APKs processed. Script finished.")
\ No newline at end of file
+    # Pre-flight triage of the whole corpus (in parallel): reject hopeless APKs before any expensive stage
+    device_info = apk_triage.get_device_info(emulator)
+    apk_files = [f for f in os.listdir(apkPath)
+                 if f.lower().endswith('.apk') and os.path.isfile(os.path.join(apkPath, f))]
+    records = []
+    for apk_file, record in zip(apk_files, scheduler.prescan([os.path.join(apkPath, f) for f in apk_files],
+                                                             device_info)):
+        apk_triage.save_triage_to_csv(results_folder, record)
+        if record['verdict'] == apk_triage.SKIP:
+            print(f"Skipping {apk_file}: {record['reason']}")
+            try:
+                shutil.move(os.path.join(apkPath, apk_file), os.path.join(skippedAppPath, apk_file))
+            except (OSError, shutil.Error) as e:
+                print(f"Error moving skipped APK {apk_file}: {e}")
+            continue
+        if record['verdict'] == apk_triage.SPECIAL:
+            print(f"{apk_file} needs special handling: {record['reason']}")
+        record['apk_file'] = apk_file
+        records.append(record)
+    print(f"Triage finished: {len(records)} APK(s) to run.")
+
+    # Longest estimated job first, so no device idles behind one huge app at the end
+    cost_model = scheduler.load_model(results_folder)
+    records = scheduler.lpt_order(records, cost_model)
+
+    # Start the Soot analyses (concurrently, sized to host memory) for APKs without parameters yet
+    soot_jobs = []
+    for record in records:
+        apk_full_path = os.path.join(apkPath, record['apk_file'])
+        apk_name = record['apk_name']
+        record['pkg'] = get_pkg(apk_full_path) # Get pkg name for this APK
+        paras = os.path.join(soot_runner.soot_output_dir(storydroid_folder, apk_name), soot_runner.PARAS_FILE)
+        # Only run Soot if the parameters file doesn't exist or is empty
+        if not os.path.exists(paras) or os.stat(paras).st_size == 0:
+            if not lazy_soot: # Lazy Soot analyses the app during its exploration, if activities fail without extras
+                soot_jobs.append((apk_full_path, apk_name, record['pkg']))
+        else:
+            print(f"Soot parameters file already exists for {apk_name}. Skipping Soot analysis.")
+    if dex_extras_scan:
+        for apk_full_path, apk_name, pkg in soot_jobs: # Seconds per APK, no need for the background pool
+            run_soot(apk_full_path, apk_name, pkg)
+    else:
+        soot_futures.update(soot_runner.run_soot_pool(soot_jobs, **soot_kwargs()))
+
+    if shard:
+        explore_activity.shard_devices = emulators[1:] # Apps run one at a time, large ones on every device
+        for device in emulators[1:]:
+            connect_device(device) # Root, and a monitor so a failing shard device hands its activities on
+    elif len(emulators) > 1:
+        # One worker process per device; each free device gets the most expensive remaining APK
+        def prepare(record):
+            record['paras_path'] = prepare_paras(record['apk_name'])
+        left = scheduler.run_pool(emulators, records, cost_model, results_folder, run_on_device, prepare=prepare,
+                                  is_ready=soot_ready, finish=explore_activity.stop_helper_agent,
+                                  max_requeues=device_health.MAX_REQUEUES)
+        if left:
+            print(f"All devices lost. {len(left)} APK(s) not processed.")
+        print("\nAll APKs processed. Script finished.")
+        sys.exit(0)
+
+    # Get root once, then keep the device healthy in the background
+    monitor, rooted = connect_device(emulator)
+
+    queue = deque(records)
+    requeues = {}
+    while queue: # Run the apk one by one
+        record = queue.popleft()
+        apk_name = record['apk_name']
+        pkg = record['pkg']
+        # Keep the app installed if the next job is the same app
+        next_pkg = queue[0]['pkg'] if queue else None
+
+        print(f"\n======== Starting analysis for {apk_name} (Package: {pkg}) ========")
+
+        '''
+        Get Bundle Data (Soot Analysis)
+        Trade off by users, open or close
+        '''
+        paras_path = prepare_paras(apk_name)
+
+        '''
+        Core Execution (Repackaging and Exploration)
+        '''
+        started = time.monotonic()
+        outcome = process_apk(record['apk_file'], pkg, paras_path, monitor, rooted,
+                              uninstall=(next_pkg != pkg or not pkg),
+                              may_requeue=requeues.get(apk_name, 0) < device_health.MAX_REQUEUES)
+        if outcome == scheduler.DEVICE_LOST:
+            print(f"Device {emulator} could not be recovered. Stopping.")
+            break
+        if outcome == scheduler.REQUEUE:
+            requeues[apk_name] = requeues.get(apk_name, 0) + 1
+            print(f"Requeueing {apk_name} after device recovery.")
+            queue.append(record)
+            continue
+        scheduler.observe(cost_model, record, time.monotonic() - started)
+        scheduler.save_model(results_folder, cost_model, [pkg])
+
+    explore_activity.stop_helper_agent()
+    print("\nAll APKs processed. Script finished.")
@@ -0,0 +1,216 @@
+'''
+Corpus prescan and longest-processing-time-first scheduling across devices.
+
+The prescan triages every input APK in parallel and estimates its cost from the
+activity count, the APK size and the cost model kept in results/cost_model.json
+(seconds per activity and per MB learned from finished jobs, plus the last
+duration of every package). With several devices, each device runs in its own
+worker process and is handed the most expensive remaining APK whenever it
+becomes free. Workers are forked, so they inherit the run options, device list
+and stage limiters that run_xbot sets up in its main process. Estimates are
+refreshed as actual timings arrive, so the pick is always based on the latest
+model.
+'''
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
+
+import apk_triage
+import json_store
+
+COST_MODEL_FILE = 'cost_model.json'
+PRESCAN_WORKERS = 8  # aapt processes run concurrently by the prescan
+BASE_COST = 120  # seconds per APK independent of its size (install, Soot wait, cleanup)
+DEFAULT_PER_ACTIVITY = 30  # seconds per activity until timings have been observed
+DEFAULT_PER_MB = 2  # seconds of repackaging per MB of APK until timings have been observed
+EWMA_ALPHA = 0.3  # Weight of the newest observation in the learned rates
+
+# Worker -> dispatcher message kinds
+READY = 'ready'
+DONE = 'done'
+
+# Outcomes of one APK on a device, reported by the worker
+FINISHED = 'finished'
+REQUEUE = 'requeue'  # The device failed under the APK and was recovered
+DEVICE_LOST = 'device lost'  # The device failed and could not be recovered; the worker exits
+
+
+def load_model(results_folder):
+    """
+    Loads the cost model.
+    Returns:
+        dict: {'per_activity': float, 'per_mb': float, 'packages': {pkg: seconds}}.
+    """
+    model = {'per_activity': DEFAULT_PER_ACTIVITY, 'per_mb': DEFAULT_PER_MB, 'packages': {}}
+    model.update(json_store.load(os.path.join(results_folder, COST_MODEL_FILE), 'cost model'))
+    return model
+
+
+def save_model(results_folder, model, pkgs=None):
+    """
+    Writes the cost model atomically (see json_store.update).
+    Args:
+        results_folder (str): Folder of the cost model.
+        model (dict): Cost model.
+        pkgs (list): Only write the durations of these packages over the current file (the learned rates
+                     are always written), keeping what other processes saved meanwhile. None writes everything.
+    """
+    def change(current):
+        packages = current.get('packages', {}) if pkgs is not None else {}
+        packages.update((pkg, model['packages'][pkg]) for pkg in (model['packages'] if pkgs is None else pkgs)
+                        if pkg in model['packages'])
+        current.update(model, packages=packages)
+
+    json_store.update(os.path.join(results_folder, COST_MODEL_FILE), change, 'cost model')
+
+
+def estimate(model, record):
+    """
+    Estimates the seconds an APK will take.
+    Args:
+        model (dict): Cost model.
+        record (dict): Triage record (package, activity_count, size_mb).
+    Returns:
+        float: Estimated seconds; the last duration of the package if it was run before.
+    """
+    if record['package'] in model['packages']:
+        return model['packages'][record['package']]
+    return BASE_COST + model['per_activity'] * record['activity_count'] + model['per_mb'] * record['size_mb']
+
+
+def observe(model, record, seconds):
+    """
+    Updates the cost model with the actual duration of an APK.
+    Args:
+        model (dict): Cost model, updated in place.
+        record (dict): Triage record of the APK.
+        seconds (float): Wall-clock seconds the APK took.
+    """
+    if record['package']:
+        model['packages'][record['package']] = round(seconds, 1)
+    if record['activity_count'] > 0:
+        repackaging = model['per_mb'] * record['size_mb']
+        per_activity = max(0.0, seconds - BASE_COST - repackaging) / record['activity_count']
+        model['per_activity'] = round((1 - EWMA_ALPHA) * model['per_activity'] + EWMA_ALPHA * per_activity, 2)
+
+
+def prescan(apk_paths, device_info, workers=PRESCAN_WORKERS):
+    """
+    Triages all APKs in parallel.
+    Args:
+        apk_paths (list): APK files.
+        device_info (dict): Result of apk_triage.get_device_info.
+        workers (int): Concurrent triages.
+    Returns:
+        list: Triage records, in the order of apk_paths.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(lambda path: apk_triage.triage_apk(path, device_info), apk_paths))
+
+
+def lpt_order(records, model):
+    """Sorts triage records by estimated cost, most expensive first."""
+    return sorted(records, key=lambda r: -estimate(model, r))
+
+
+def _worker_main(device, conn, work, finish):
+    conn.send((READY,))
+    try:
+        while True:
+            job = conn.recv()
+            if job is None:
+                return
+            started = time.monotonic()
+            outcome = work(device, job)
+            conn.send((DONE, job['apk_name'], outcome, time.monotonic() - started))
+            if outcome == DEVICE_LOST:
+                return
+    finally:
+        if finish is not None:
+            finish()
+
+
+def run_pool(devices, records, model, results_folder, work, prepare=None, is_ready=None, finish=None,
+             max_requeues=2):
+    """
+    Runs APKs on several devices, longest estimated job first.
+    Args:
+        devices (list): Device serials, one worker process each.
+        records (list): Triage records of the APKs to run.
+        model (dict): Cost model, updated and saved as jobs finish.
+        results_folder (str): Folder of the cost model.
+        work (callable): work(device, record) -> FINISHED, REQUEUE or DEVICE_LOST, run in the worker.
+        prepare (callable): prepare(record), run in this process before a job is handed out (e.g. wait for Soot).
+        is_ready (callable): is_ready(record) -> bool; ready jobs are preferred so free devices do not wait.
+        finish (callable): Run in each worker before it exits.
+        max_requeues (int): Times an APK is handed out again; passed to the worker as record['requeues'].
+    Returns:
+        list: Records that could not be run because every device was lost.
+    """
+    pending = list(records)
+    requeues = {}
+    running = {}  # conn -> (device, record)
+    workers = {}
+    context = multiprocessing.get_context('fork') # spawn (the macOS default) would start workers without the options
+    for device in devices:
+        parent_conn, child_conn = context.Pipe()
+        proc = context.Process(target=_worker_main, args=(device, child_conn, work, finish), name=f"xbot-{device}")
+        proc.start()
+        workers[parent_conn] = (device, proc)
+
+    while workers and (pending or running):
+        for conn in wait(list(workers)):
+            device, proc = workers[conn]
+            try:
+                message = conn.recv()
+            except EOFError:
+                print(f"Worker of {device} exited unexpectedly.")
+                message = (DONE, None, DEVICE_LOST, 0)
+            if message[0] == DONE:
+                _, record = running.pop(conn, (device, None))
+                outcome, seconds = message[2], message[3]
+                if record is not None and outcome == FINISHED:
+                    observe(model, record, seconds)
+                    save_model(results_folder, model, [record['package']])
+                    print(f"{record['apk_name']} finished on {device} in {round(seconds)}s.")
+                elif record is not None:
+                    # The worker only reports REQUEUE while record['requeues'] is below the limit
+                    requeues[record['apk_name']] = requeues.get(record['apk_name'], 0) + 1
+                    if outcome == REQUEUE or requeues[record['apk_name']] <= max_requeues:
+                        print(f"Requeueing {record['apk_name']} ({outcome} on {device}).")
+                        pending.append(record)
+                    else:
+                        print(f"{record['apk_name']} was interrupted {requeues[record['apk_name']]} times. Dropping it.")
+                if outcome == DEVICE_LOST:
+                    print(f"Device {device} lost. {len(workers) - 1} device(s) left.")
+                    proc.join(5)
+                    del workers[conn]
+                    continue
+
+            if not pending:
+                conn.send(None) # Nothing left for this device
+                proc.join()
+                del workers[conn]
+                continue
+            # Most expensive job first, preferring jobs that can start right away
+            pending.sort(key=lambda r: -estimate(model, r))
+            ready = [r for r in pending if is_ready is None or is_ready(r)]
+            record = (ready or pending)[0]
+            pending.remove(record)
+            if prepare is not None:
+                prepare(record)
+            print(f"Scheduling {record['apk_name']} on {device} (estimated {round(estimate(model, record))}s).")
+            record['requeues'] = requeues.get(record['apk_name'], 0)
+            running[conn] = (device, record)
+            conn.send(record)
+
+    for conn, (device, proc) in workers.items():
+        try:
+            conn.send(None)
+        except OSError:
+            pass
+        proc.join()
+    return pending
@@ -0,0 +1,156 @@
+'''
+Bounded breadth-first exploration of the screens reachable inside one activity.
+
+From the first screen of a launched activity, the clickable nodes of the
+uiautomator hierarchy are tapped breadth-first. Each resulting screen is reduced
+to a structural hash (node classes, resource ids and checked/selected state of
+the app's own nodes, not texts or positions), so a state seen before is detected
+with one set lookup and only new states (dialogs, tabs, drawers, fragments) are
+scanned. A state is reached again by relaunching the activity and replaying the
+taps that led to it. The number of actions is capped per activity; the caller
+bounds the time with a deadlines budget.
+
+The device is driven through callables, so this module never talks to adb itself.
+'''
+
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+from collections import deque
+
+MAX_ACTIONS = 30  # Taps (including replayed ones) per activity
+MAX_SECONDS = 90  # Time per activity, added to the activity budget when enabled
+SETTLE = 1.0  # seconds after a tap or back press before the screen is dumped
+CRASH_KEYWORDS = ('has stopped', "isn't responding", 'keeps stopping')
+
+_BOUNDS = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+
+
+def _parse(xml_content):
+    try:
+        return ET.fromstring(xml_content)
+    except (ET.ParseError, TypeError, ValueError):
+        return None
+
+
+def structure_hash(xml_content, pkg):
+    """
+    Hashes the structure of a screen.
+    Args:
+        xml_content (str): uiautomator dump.
+        pkg (str): Package of the app; nodes of other packages (overlays, system UI) are ignored.
+    Returns:
+        str: Hex digest, '' if the dump cannot be parsed.
+    """
+    root = _parse(xml_content)
+    if root is None:
+        return ''
+    signature = []
+
+    def walk(node, depth):
+        if node.get('package') == pkg:
+            signature.append(f"{depth}|{node.get('class', '')}|{node.get('resource-id', '')}|"
+                             f"{node.get('checked', '')}|{node.get('selected', '')}")
+        for child in node.findall('node'):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return hashlib.sha1('\n'.join(signature).encode('utf-8')).hexdigest()
+
+
+def screen_package(xml_content):
+    """Returns the package of the first node of a dump ('' if there is none)."""
+    root = _parse(xml_content)
+    node = root.find('.//node') if root is not None else None
+    return node.get('package', '') if node is not None else ''
+
+
+def clickable_nodes(xml_content, pkg):
+    """
+    Lists the tap targets of a screen, in document order.
+    Args:
+        xml_content (str): uiautomator dump.
+        pkg (str): Package of the app.
+    Returns:
+        list: (x, y, label) of the centers of enabled, clickable nodes of the app.
+    """
+    root = _parse(xml_content)
+    if root is None:
+        return []
+    targets = []
+    for node in root.iter('node'):
+        if node.get('package') != pkg or node.get('clickable') != 'true' or node.get('enabled') == 'false':
+            continue
+        m = _BOUNDS.match(node.get('bounds', ''))
+        if not m:
+            continue
+        x1, y1, x2, y2 = (int(v) for v in m.groups())
+        if x2 <= x1 or y2 <= y1:
+            continue
+        label = node.get('resource-id') or node.get('text') or node.get('content-desc') or node.get('class', '')
+        targets.append(((x1 + x2) // 2, (y1 + y2) // 2, label))
+    return targets
+
+
+def _reach(path, ops, stats, pkg):
+    """Relaunches the activity and replays the taps of a path. Returns the hash of the screen reached."""
+    stats['replays'] += 1
+    if not ops['relaunch']():
+        return None
+    for x, y in path:
+        ops['tap'](x, y)
+        stats['actions'] += 1
+    return structure_hash(ops['dump'](), pkg)
+
+
+def explore_states(activity, root_xml, pkg, ops, max_actions=MAX_ACTIONS):
+    """
+    Explores the screens of an activity breadth-first, scanning every new one.
+    Args:
+        activity (str): Activity name, new states are named <activity>_state<n>.
+        root_xml (str): Dump of the first screen (already scanned).
+        pkg (str): Package of the app.
+        ops (dict): Device callables: 'dump'() -> xml, 'tap'(x, y), 'back'(), 'relaunch'() -> bool
+                    and 'scan'(state_name, xml), which may leave the app.
+        max_actions (int): Tap budget.
+    Returns:
+        dict: 'states' (new states scanned), 'actions' and 'replays'.
+    """
+    stats = {'states': 0, 'actions': 0, 'replays': 0}
+    visited = {structure_hash(root_xml, pkg)}
+    queue = deque([([], root_xml)])
+    current = None  # Hash of the screen on the device, None if unknown (e.g. after a scan)
+    while queue and stats['actions'] < max_actions:
+        path, xml = queue.popleft()
+        target = structure_hash(xml, pkg)
+        for x, y, label in clickable_nodes(xml, pkg):
+            if stats['actions'] >= max_actions:
+                break
+            if current != target:
+                current = _reach(path, ops, stats, pkg)
+                if current != target:
+                    print(f"Could not return to a state of {activity}. Skipping its remaining actions.")
+                    current = None
+                    break
+            ops['tap'](x, y)
+            stats['actions'] += 1
+            new_xml = ops['dump']()
+            current = structure_hash(new_xml, pkg)
+            if current == target:
+                continue # The tap changed nothing structural
+            if screen_package(new_xml) != pkg or any(word in (new_xml or '') for word in CRASH_KEYWORDS):
+                print(f"Tap on '{label}' left {activity} or crashed it.")
+                ops['back']()
+                current = None
+                continue
+            if current not in visited:
+                visited.add(current)
+                stats['states'] += 1
+                print(f"New state {stats['states']} of {activity} after tapping '{label}'.")
+                ops['scan'](f"{activity}_state{stats['states']}", new_xml)
+                current = None
+                queue.append((path + [(x, y)], new_xml))
+            else:
+                ops['back']()
+                current = structure_hash(ops['dump'](), pkg)
+    return stats
@@ -0,0 +1,165 @@
+'''
+Visual-stability detection: waits until the screen stops changing instead of
+sleeping for a fixed time.
+
+Consecutive frames are grabbed with `adb exec-out screencap` (raw RGBA),
+downscaled on the host and compared. The wait ends as soon as STABLE_FRAMES
+consecutive comparisons show less than CHANGED_FRACTION of the pixels changed,
+or when the timeout (the fixed wait it replaces) is reached. NumPy is used for
+the comparison when it is installed; otherwise a pure-Python comparison of the
+sampled pixels is used. Every wait is printed and appended to results/settle.csv.
+
+Settings can be tuned with XBOT_SETTLE, e.g. "interval=0.2,frames=3,changed=0.002,delta=16,downscale=8".
+'''
+
+import csv
+import os
+import struct
+import subprocess
+import time
+
+import deadlines
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ENABLED = False
+FRAME_INTERVAL = 0.2  # seconds between frame grabs
+STABLE_FRAMES = 3  # Consecutive stable comparisons needed
+CHANGED_FRACTION = 0.002  # Share of sampled pixels that may change in a stable comparison
+PIXEL_DELTA = 16  # Channel difference (0-255) above which a pixel counts as changed
+DOWNSCALE = 8  # Every DOWNSCALE-th pixel of every DOWNSCALE-th row is compared
+
+log_folder = ''  # Folder of settle.csv, set by the caller; empty disables the log
+
+_SETTINGS = {'interval': 'FRAME_INTERVAL', 'frames': 'STABLE_FRAMES', 'changed': 'CHANGED_FRACTION',
+             'delta': 'PIXEL_DELTA', 'downscale': 'DOWNSCALE'}
+
+
+def configure(spec):
+    """
+    Enables the detector and applies "key=value,..." settings (see _SETTINGS); "1" keeps the defaults.
+    """
+    global ENABLED
+    ENABLED = True
+    for item in filter(None, (s.strip() for s in (spec or '').split(','))):
+        key, _, value = item.partition('=')
+        if key not in _SETTINGS:
+            if item != '1':
+                print(f"Ignoring settle setting '{item}'")
+            continue
+        current = globals()[_SETTINGS[key]]
+        try:
+            globals()[_SETTINGS[key]] = type(current)(value)
+        except ValueError:
+            print(f"Ignoring settle setting '{item}' (not a number)")
+
+
+def grab(serial):
+    """
+    Grabs one raw frame.
+    Returns:
+        tuple: (width, height, pixels) with RGBA bytes, or None if no frame could be read.
+    """
+    try:
+        data = deadlines.run(["adb", "-s", serial, "exec-out", "screencap"], 'shell', capture_output=True,
+                             text=False).stdout
+    except (subprocess.TimeoutExpired, OSError) as e:
+        print(f"screencap failed: {e}")
+        return None
+    if not data or len(data) < 12:
+        return None
+    width, height = struct.unpack('<II', data[:8])
+    header = len(data) - width * height * 4 # 12 bytes, 16 with the color space field of newer releases
+    if width == 0 or header not in (12, 16):
+        return None
+    return width, height, data[header:]
+
+
+def sample(frame, factor=None):
+    """Downscales a frame to every factor-th pixel of every factor-th row (RGB only)."""
+    factor = factor or DOWNSCALE
+    width, height, pixels = frame
+    if np is not None:
+        return np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 4)[::factor, ::factor, :3].astype(np.int16)
+    rows = []
+    for y in range(0, height, factor):
+        row = pixels[y * width * 4:(y + 1) * width * 4]
+        rows.append(bytes(b for x in range(0, width, factor) for b in row[x * 4:x * 4 + 3]))
+    return b''.join(rows)
+
+
+def changed_fraction(a, b):
+    """Share of the sampled pixels that differ by more than PIXEL_DELTA in any channel."""
+    if np is not None:
+        if a.shape != b.shape:
+            return 1.0
+        return float((np.abs(a - b).max(axis=2) > PIXEL_DELTA).mean())
+    if len(a) != len(b) or not a:
+        return 1.0
+    changed = 0
+    for i in range(0, len(a), 3):
+        if abs(a[i] - b[i]) > PIXEL_DELTA or abs(a[i + 1] - b[i + 1]) > PIXEL_DELTA or \
+                abs(a[i + 2] - b[i + 2]) > PIXEL_DELTA:
+            changed += 1
+    return changed / (len(a) // 3)
+
+
+def wait_for_stable(serial, timeout, label, require_change=False):
+    """
+    Waits until the screen is stable.
+    Args:
+        serial (str): Device serial.
+        timeout (float): Longest wait in seconds (the fixed wait this replaces).
+        label (str): What is being waited for, for the log.
+        require_change (bool): Only count stability after the screen changed once (e.g. after a tap
+                               whose effect shows up with a delay).
+    Returns:
+        float: Seconds waited.
+    """
+    started = time.monotonic()
+    previous = None
+    stable = 0
+    changed = not require_change
+    frames = 0
+    settled = False
+    while time.monotonic() - started < timeout:
+        frame = grab(serial)
+        if frame is None:
+            # No frames on this device: fall back to the fixed wait
+            time.sleep(max(0.0, timeout - (time.monotonic() - started)))
+            break
+        frames += 1
+        current = sample(frame)
+        if previous is not None:
+            if changed_fraction(previous, current) <= CHANGED_FRACTION:
+                stable += 1 if changed else 0
+            else:
+                stable = 0
+                changed = True
+            if stable >= STABLE_FRAMES:
+                settled = True
+                break
+        previous = current
+        time.sleep(FRAME_INTERVAL)
+    waited = round(time.monotonic() - started, 2)
+    print(f"Waited {waited}s for {label} ({'stable' if settled else 'timeout'}, {frames} frames).")
+    save_wait(label, waited, timeout, frames, settled)
+    return waited
+
+
+def save_wait(label, waited, timeout, frames, settled):
+    """Appends one wait to settle.csv."""
+    if not log_folder:
+        return
+    csv_file = os.path.join(log_folder, 'settle.csv')
+    try:
+        with open(csv_file, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if os.stat(csv_file).st_size == 0:
+                writer.writerow(('time', 'label', 'waited', 'timeout', 'frames', 'settled'))
+            writer.writerow((time.strftime('%Y-%m-%d %H:%M:%S'), label, waited, timeout, frames, settled))
+    except OSError as e:
+        print(f"Error writing settle log: {e}")
@@ -0,0 +1,169 @@
+'''
+Concurrency-safe runner for the Soot analysis (run_soot.run).
+
+Each analysis runs in its own process group with the config folder as its working
+directory (the host process never changes directory), writes into a private work
+directory and is killed on a wall-clock timeout. The JVM heap is capped through
+_JAVA_OPTIONS so that a pool of analyses can be sized to the host memory.
+'''
+
+import csv
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import concurrency
+import deadlines
+
+SOOT_BINARY = 'run_soot.run'
+SOOT_TIMEOUT = deadlines.TIMEOUTS['soot']  # seconds of wall-clock time per APK
+SOOT_HEAP_MB = 4096  # -Xmx for each analysis
+JVM_OVERHEAD_MB = 512  # Memory used by a JVM on top of its heap
+HOST_RESERVED_MB = 4096  # Memory kept free for the emulators and the OS
+
+PARAS_FILE = 'activity_paras.txt'
+
+
+def soot_output_dir(storydroid_folder, apk_name):
+    """Folder holding the Soot results (activity_paras.txt) of one APK."""
+    return os.path.join(storydroid_folder, 'outputs', apk_name)
+
+
+def _host_memory_mb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_pool_size(heap_mb=SOOT_HEAP_MB):
+    """
+    Number of concurrent analyses that fit into host memory (and CPU count).
+    Args:
+        heap_mb (int): Heap cap of each analysis.
+    Returns:
+        int: Pool size, at least 1.
+    """
+    cpus = os.cpu_count() or 1
+    memory = _host_memory_mb()
+    if memory is None:
+        return 1
+    fits = (memory - HOST_RESERVED_MB) // (heap_mb + JVM_OVERHEAD_MB)
+    return max(1, min(cpus, fits))
+
+
+def run_soot(apk_path, apk_name, pkg, storydroid_folder, config_folder, java_home_path, sdk_platform_path,
+             lib_home_path, timeout=SOOT_TIMEOUT, heap_mb=SOOT_HEAP_MB):
+    """
+    Runs the Soot analysis for one APK.
+    Args:
+        apk_path (str): Full path to the APK.
+        apk_name (str): APK name, used for the per-APK work and output directories.
+        pkg (str): Package name of the APK.
+        storydroid_folder (str): Root folder of the Soot work and output directories.
+        config_folder (str): Folder containing run_soot.run.
+        java_home_path (str): JAVA_HOME passed to the analysis.
+        sdk_platform_path (str): Android platforms folder.
+        lib_home_path (str): Folder with the analysis libraries.
+        timeout (int): Wall-clock timeout in seconds.
+        heap_mb (int): JVM heap cap in MB.
+    Returns:
+        dict: apk_name, pkg, status ('success', 'failed', 'timeout' or 'error'), returncode,
+              duration (seconds) and paras_path.
+    """
+    output_dir = soot_output_dir(storydroid_folder, apk_name)
+    work_dir = os.path.join(storydroid_folder, 'work', apk_name)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    result = {'apk_name': apk_name, 'pkg': pkg, 'status': 'error', 'returncode': None, 'duration': 0.0,
+              'paras_path': os.path.join(output_dir, PARAS_FILE)}
+
+    cmd = [os.path.join(config_folder, SOOT_BINARY), work_dir, apk_path, pkg, java_home_path,
+           sdk_platform_path, lib_home_path]
+    if not all(cmd):
+        print("❌ Error: Some required command arguments are undefined or empty:")
+        for i, val in enumerate(cmd):
+            if not val:
+                print(f"  - Argument {i + 1} (missing)")
+        return result
+
+    env = dict(os.environ)
+    env['_JAVA_OPTIONS'] = (env.get('_JAVA_OPTIONS', '') + f' -Xmx{heap_mb}m').strip()
+
+    print(f"Running Soot command: {' '.join(cmd)}")
+    start = time.time()
+    try:
+        proc = deadlines.run(cmd, 'soot', capture_output=True, timeout=timeout, cwd=config_folder, env=env)
+        result['returncode'] = proc.returncode
+        result['status'] = 'success' if proc.returncode == 0 else 'failed'
+        if proc.returncode != 0:
+            print(f"Error running Soot analysis for {pkg}: exit code {proc.returncode}")
+            print(f"Soot Stderr:\n{proc.stderr}")
+    except subprocess.TimeoutExpired:
+        result['status'] = 'timeout'
+        print(f"Soot analysis for {pkg} timed out after {timeout}s and was killed.")
+    except FileNotFoundError:
+        print(f"Error: Soot binary '{SOOT_BINARY}' not found in {config_folder}. Please ensure it exists and is executable.")
+    except OSError as e:
+        print(f"An unexpected error occurred during Soot analysis: {e}")
+    result['duration'] = round(time.time() - start, 2)
+
+    # Collect the parameters file from the private work directory (a killed run may have left it half-written)
+    for root, _, files in os.walk(work_dir):
+        if result['status'] != 'timeout' and PARAS_FILE in files:
+            shutil.move(os.path.join(root, PARAS_FILE), result['paras_path'])
+            break
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"Soot analysis for {apk_name} finished: {result['status']} in {result['duration']}s")
+    return result
+
+
+def _run_soot_in_slot(*args, **kwargs):
+    with concurrency.slot('soot'):
+        return run_soot(*args, **kwargs)
+
+
+def run_soot_pool(jobs, workers=None, **kwargs):
+    """
+    Starts Soot analyses concurrently.
+    Args:
+        jobs (list): (apk_path, apk_name, pkg) tuples.
+        workers (int): Pool size, defaults to the upper bound of the 'soot' concurrency limiter (which then
+                       decides how many run at once) or default_pool_size() for the configured heap.
+        **kwargs: Remaining arguments of run_soot (folders, timeout, heap_mb).
+    Returns:
+        dict: apk_name -> Future resolving to the run_soot result. The executor shuts down
+              by itself once all jobs are done.
+    """
+    limiter = concurrency.limiters.get('soot')
+    if workers is None:
+        workers = limiter.high if limiter else default_pool_size(kwargs.get('heap_mb', SOOT_HEAP_MB))
+    print(f"Running Soot analyses with {workers} concurrent worker(s)"
+          + (f", {limiter.limit} at a time for now." if limiter else "."))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {}
+    for apk_path, apk_name, pkg in jobs:
+        futures[apk_name] = executor.submit(_run_soot_in_slot, apk_path, apk_name, pkg, **kwargs)
+    executor.shutdown(wait=False)
+    return futures
+
+
+def save_soot_result_to_csv(results_folder, result):
+    """
+    Appends a Soot run record to soot.csv.
+    Args:
+        results_folder (str): Base results folder.
+        result (dict): Result returned by run_soot.
+    """
+    csv_file = os.path.join(results_folder, 'soot.csv')
+    with open(csv_file, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if os.stat(csv_file).st_size == 0:
+            writer.writerow(('apk_name', 'pkg_name', 'status', 'returncode', 'duration'))
+        writer.writerow((result['apk_name'], result['pkg'], result['status'], result['returncode'],
+                         result['duration']))
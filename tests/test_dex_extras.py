@@ -0,0 +1,56 @@
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dex_extras
+
+READERS = {0: 'getString'}  # method 0 is Intent.getStringExtra
+
+
+def _dex(strings, insns):
+    """Builds a dex buffer holding a string table and one code_item, returning (DexFile, code_off)."""
+    string_ids_off = 0x70
+    data = bytearray()
+    data_off = string_ids_off + 4 * len(strings)
+    offsets = []
+    for s in strings:
+        offsets.append(data_off + len(data))
+        data += bytes([len(s)]) + s.encode() + b'\0'
+    while len(data) % 4:
+        data.append(0)
+    code_off = data_off + len(data)
+    data += struct.pack('<HHHHII', 4, 1, 2, 0, 0, len(insns)) + struct.pack(f'<{len(insns)}H', *insns)
+    header = bytearray(b'dex\n035\0' + bytes(24)) + struct.pack('<6I', 0, 0x70, 0x12345678, 0, 0, 0)
+    header += struct.pack('<12I', len(strings), string_ids_off, *([0] * 10)) + struct.pack('<2I', len(data), data_off)
+    buf = bytes(header) + struct.pack(f'<{len(strings)}I', *offsets) + bytes(data)
+    return dex_extras.DexFile(buf), code_off
+
+
+class ScanCodeTest(unittest.TestCase):
+
+    def scan(self, insns):
+        dex, code_off = _dex(['TAG'], insns)
+        return dex_extras.scan_code(dex, code_off, READERS)
+
+    def test_const_string_key(self):
+        # const-string v1, "TAG"; invoke-virtual {v0, v1}, getStringExtra; return-void
+        self.assertEqual(self.scan([0x011a, 0, 0x206e, 0, 0x0010, 0x000e]), {'getString__TAG'})
+
+    def test_iget_overwrites_key(self):
+        # const-string v1, "TAG"; iget-object v1, v0, field@0; invoke-virtual {v0, v1}, getStringExtra
+        self.assertEqual(self.scan([0x011a, 0, 0x0154, 0, 0x206e, 0, 0x0010, 0x000e]), set())
+
+    def test_wide_write_overwrites_next_register(self):
+        # const-string v1, "TAG"; const-wide/16 v0, #0; invoke-virtual {v0, v1}, getStringExtra
+        self.assertEqual(self.scan([0x011a, 0, 0x0016, 0, 0x206e, 0, 0x0010, 0x000e]), set())
+
+    def test_move_object_from16_keeps_key(self):
+        # const-string v2, "TAG"; move-object/from16 v1, v2; invoke-virtual {v0, v1}, getStringExtra
+        self.assertEqual(self.scan([0x021a, 0, 0x0108, 2, 0x206e, 0, 0x0010, 0x000e]), {'getString__TAG'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import apk_triage
+import farm
+import scheduler
+
+
+def _triage(apk_path, device_info=None):
+    return {'apk_name': os.path.splitext(os.path.basename(apk_path))[0], 'verdict': apk_triage.RUN, 'reason': '',
+            'package': 'com.example', 'min_sdk': None, 'target_sdk': None, 'activity_count': 3,
+            'native_abis': [], 'size_mb': 0.0}
+
+
+def _run_xbot(device, apk_path, results):
+    """Does what run_xbot.py leaves behind for one APK: its log.csv row, its outputs, the APK removed."""
+    apk_name = os.path.splitext(os.path.basename(apk_path))[0]
+    os.makedirs(os.path.join(results, 'outputs', apk_name), exist_ok=True)
+    with open(os.path.join(results, 'outputs', apk_name, 'launch_times.csv'), 'w') as f:
+        f.write('activity,mode\n')
+    with open(os.path.join(results, 'log.csv'), 'a', newline='') as f:
+        csv.writer(f).writerow((apk_name, 'com.example', 3, 2, 1, 0))
+    os.remove(apk_path)
+    return scheduler.FINISHED
+
+
+class SingleHostFarmTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.apks = os.path.join(self.root, 'apks')
+        self.results = os.path.join(self.root, 'results')
+        os.makedirs(self.apks)
+        with open(os.path.join(self.apks, 'app.apk'), 'wb') as f:
+            f.write(b'PK')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_results_merged_once(self):
+        with mock.patch.object(apk_triage, 'triage_apk', _triage), \
+                mock.patch.object(farm, 'results_folder', self.results):
+            server = farm.serve(self.apks, 0, self.results, block=False)
+            try:
+                worker = farm.Worker(f"http://127.0.0.1:{server.server_address[1]}", ['emulator-5554'],
+                                     os.path.join(self.root, 'jobs'), runner=_run_xbot)
+                worker.run()
+            finally:
+                server.shutdown()
+        self.assertNotEqual(os.path.realpath(worker.results), os.path.realpath(self.results))
+        with open(os.path.join(self.results, 'log.csv'), newline='') as f:
+            rows = [row for row in csv.reader(f) if row and row[0] == 'app']
+        self.assertEqual(len(rows), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.results, 'outputs', 'app', 'launch_times.csv')))
+
+
+if __name__ == '__main__':
+    unittest.main()
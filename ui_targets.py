@@ -0,0 +1,167 @@
+'''
+Resolution-independent tap targets for the Accessibility Scanner and
+permission dialogs.
+
+Targets are looked up in the uiautomator hierarchy by resource-id, text or
+content-desc the first time they are needed on a device, and cached in
+results/ui_targets.json per device serial, scanner version and screen size, so
+later taps cost no extra dumps. Targets that cannot be found in a dump fall back
+to the original 1080x1920 coordinates scaled to the device screen.
+'''
+
+import os
+import re
+import xml.etree.ElementTree as ET
+
+import json_store
+
+CACHE_FILE = 'ui_targets.json'
+SCANNER_PKG = 'com.google.android.apps.accessibility.auditor'
+BASE_SIZE = (1080, 1920)  # Screen the fallback coordinates were measured on
+DUMP_PATH = '/sdcard/xbot_ui_targets.xml'
+PERMISSION_PKGS = ['com.android.permissioncontroller', 'com.google.android.permissioncontroller',
+                   'com.android.packageinstaller', 'com.google.android.packageinstaller']
+
+# name -> how to find the element; only nodes of the listed packages count (never the app under test),
+# ids match on the part after ':id/', texts/descs case-insensitively
+TARGETS = {
+    'scan': {'packages': [SCANNER_PKG], 'ids': ['fab', 'large_button', 'scan_button'], 'texts': [],
+             'descs': ['scan', 'accessibility scanner'], 'fallback': (945, 1650)},
+    'share': {'packages': [SCANNER_PKG], 'ids': ['share', 'action_share', 'menu_share'], 'texts': [],
+              'descs': ['share'], 'fallback': (910, 128)},
+    'cancel': {'packages': [SCANNER_PKG], 'ids': ['cancel', 'button2'], 'texts': ['cancel'], 'descs': [],
+               'fallback': (654, 1078)},
+    'allow': {'packages': PERMISSION_PKGS, 'ids': ['permission_allow_button', 'permission_allow_foreground_only_button'],
+              'texts': ['allow', 'while using the app'], 'descs': [], 'fallback': (780, 1080)},
+}
+
+_BOUNDS = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+_SIZE = re.compile(r'(Physical|Override) size: (\d+)x(\d+)')
+_VERSION = re.compile(r'versionName=(\S+)')
+
+_retried = set()  # (key, name) of fallback targets already re-resolved in this run
+
+
+def screen_size(run_adb):
+    """
+    Reads the screen size of the device, preferring an override set with 'wm size'.
+    Args:
+        run_adb (callable): Function running an adb command list, returning stdout or False.
+    Returns:
+        tuple: (width, height), or BASE_SIZE if it cannot be read.
+    """
+    output = run_adb(["shell", "wm", "size"], check_output=True) or ''
+    sizes = {m.group(1): (int(m.group(2)), int(m.group(3))) for m in _SIZE.finditer(output)}
+    return sizes.get('Override') or sizes.get('Physical') or BASE_SIZE
+
+
+def scanner_version(run_adb):
+    """Returns the versionName of the installed Accessibility Scanner ('' if unknown)."""
+    output = run_adb(["shell", "dumpsys", "package", SCANNER_PKG], check_output=True) or ''
+    m = _VERSION.search(output)
+    return m.group(1) if m else ''
+
+
+def device_key(serial, run_adb):
+    """
+    Builds the cache key of a device: serial, scanner version and screen size.
+    Returns:
+        dict: 'key' (str) and 'size' ((width, height)).
+    """
+    size = screen_size(run_adb)
+    return {'key': f"{serial}|{scanner_version(run_adb)}|{size[0]}x{size[1]}", 'size': size}
+
+
+def scaled_fallback(name, size):
+    """Scales the 1080x1920 fallback coordinates of a target to the given screen size."""
+    x, y = TARGETS[name]['fallback']
+    return (round(x * size[0] / BASE_SIZE[0]), round(y * size[1] / BASE_SIZE[1]))
+
+
+def _matches(node, spec):
+    if node.get('package', '') not in spec['packages']:
+        return False
+    resource_id = node.get('resource-id', '')
+    if resource_id and resource_id.split(':id/')[-1] in spec['ids']:
+        return True
+    if node.get('text', '').strip().lower() in spec['texts']:
+        return True
+    return node.get('content-desc', '').strip().lower() in spec['descs']
+
+
+def _find_node(xml_content, name):
+    try:
+        root = ET.fromstring(xml_content)
+    except ET.ParseError:
+        return None, None
+    spec = TARGETS[name]
+    for node in root.iter('node'):
+        if node.get('enabled') == 'false' or not _matches(node, spec):
+            continue
+        m = _BOUNDS.match(node.get('bounds', ''))
+        if m:
+            x1, y1, x2, y2 = (int(v) for v in m.groups())
+            return ((x1 + x2) // 2, (y1 + y2) // 2), node.get('package')
+    return None, None
+
+
+def find_target(xml_content, name):
+    """
+    Finds a target in a uiautomator dump.
+    Args:
+        xml_content (str): Content of the dump.
+        name (str): Key of TARGETS.
+    Returns:
+        tuple: Center (x, y) of the first enabled matching element of the target's packages, or None.
+    """
+    return _find_node(xml_content, name)[0]
+
+
+def _load_cache(results_folder):
+    return json_store.load(os.path.join(results_folder, CACHE_FILE), 'UI target cache')
+
+
+def _dump(run_adb):
+    run_adb(["shell", "uiautomator", "dump", DUMP_PATH])
+    content = run_adb(["shell", "cat", DUMP_PATH], check_output=True) or ''
+    run_adb(["shell", "rm", DUMP_PATH])
+    return content
+
+
+def resolve(results_folder, device, name, run_adb):
+    """
+    Returns the tap coordinates of a target, dumping the screen only on a cache miss.
+    Fallback coordinates are cached too, but re-resolved once per run in case the
+    element was just not on screen yet.
+    Args:
+        results_folder (str): Base results folder holding the cache.
+        device (dict): Result of device_key.
+        name (str): Key of TARGETS.
+        run_adb (callable): Function running an adb command list.
+    Returns:
+        tuple: (x, y).
+    """
+    cache = _load_cache(results_folder)
+    entry = cache.get(device['key'], {}).get(name)
+    # Dump matches cached without their package predate the package check and may be nodes of an app
+    trusted = entry and entry['source'] == 'dump' and entry.get('package') in TARGETS[name]['packages']
+    if trusted or (entry and entry['source'] != 'dump' and (device['key'], name) in _retried):
+        return tuple(entry['xy'])
+
+    _retried.add((device['key'], name))
+    xy, package = _find_node(_dump(run_adb), name)
+    source = 'dump'
+    if xy is None:
+        xy = scaled_fallback(name, device['size'])
+        source = 'scaled'
+    print(f"UI target '{name}' on {device['key']}: {xy} ({source})")
+    entry = {'xy': list(xy), 'source': source, 'package': package}
+    json_store.update(os.path.join(results_folder, CACHE_FILE),
+                      lambda cache: cache.setdefault(device['key'], {}).update({name: entry}), 'UI target cache')
+    return xy
+
+
+def tap(results_folder, device, name, run_adb):
+    """Taps a target resolved with resolve()."""
+    x, y = resolve(results_folder, device, name, run_adb)
+    run_adb(["shell", "input", "tap", str(x), str(y)])
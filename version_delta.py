@@ -0,0 +1,192 @@
+'''
+Delta exploration across successive versions of the same app.
+
+Every explored activity gets a fingerprint built from the decoded tree: its
+manifest entry, the layout resources its classes reference and the smali of the
+activity class and its inner classes (resource ids are replaced by resource
+names, so renumbering alone does not count as a change). Fingerprints and
+outcomes are stored per package in results/versions/<pkg>.json. A new version
+only explores activities whose fingerprint changed or that were not explored
+before; the results of the others are carried forward from the last version.
+'''
+
+import glob
+import hashlib
+import os
+import re
+import shutil
+import xml.etree.ElementTree as ET
+
+import json_store
+
+VERSIONS_DIR = 'versions'
+ENABLED = True  # Set to False (XBOT_FULL_SCAN=1) to explore every activity of every version
+
+ANDROID_NS = '{http://schemas.android.com/apk/res/android}'
+_RES_ID = re.compile(r'0x7f[0-9a-f]{6}')
+_VERSION_CODE = re.compile(r"versionCode:\s*'?(\d+)'?")
+
+
+def _record_path(results_folder, pkg):
+    return os.path.join(results_folder, VERSIONS_DIR, f"{pkg}.json")
+
+
+def load_record(results_folder, pkg):
+    """
+    Loads what is known about the last scanned version of a package.
+    Returns:
+        dict: {'apk_name', 'version_code', 'activities': {activity: {'fingerprint', 'launched'}}}, or None.
+    """
+    return json_store.load(_record_path(results_folder, pkg), 'version record') or None
+
+
+def save_record(results_folder, pkg, record):
+    """Writes the version record of a package atomically (see json_store.update)."""
+    path = _record_path(results_folder, pkg)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def change(current):
+        current.clear()
+        current.update(record)
+
+    json_store.update(path, change, 'version record')
+
+
+def version_code(decoded_dir):
+    """Reads the versionCode from apktool.yml ('' if unknown)."""
+    try:
+        with open(os.path.join(decoded_dir, 'apktool.yml'), 'r', errors='ignore') as f:
+            m = _VERSION_CODE.search(f.read())
+        return m.group(1) if m else ''
+    except OSError:
+        return ''
+
+
+def _resource_names(decoded_dir):
+    """Maps resource ids to 'type/name' using res/values/public.xml."""
+    names = {}
+    try:
+        root = ET.parse(os.path.join(decoded_dir, 'res', 'values', 'public.xml')).getroot()
+    except (OSError, ET.ParseError):
+        return names
+    for node in root.iter('public'):
+        rid = node.get('id', '').lower()
+        if rid:
+            names[rid] = f"{node.get('type')}/{node.get('name')}"
+    return names
+
+
+def _manifest_entries(decoded_dir, pkg_prefix):
+    """Maps full activity names to their serialized manifest elements (activity and activity-alias)."""
+    entries = {}
+    try:
+        root = ET.parse(os.path.join(decoded_dir, 'AndroidManifest.xml')).getroot()
+    except (OSError, ET.ParseError):
+        return entries
+    application = root.find('application')
+    if application is None:
+        return entries
+    for node in application:
+        if node.tag not in ('activity', 'activity-alias'):
+            continue
+        name = node.get(ANDROID_NS + 'name', '')
+        if name.startswith('.'):
+            name = pkg_prefix + name
+        entries[name] = ET.tostring(node)
+    return entries
+
+
+def _class_files(decoded_dir, activity):
+    relative = activity.replace('.', os.sep)
+    files = []
+    for smali_dir in sorted(glob.glob(os.path.join(decoded_dir, 'smali*'))):
+        base = os.path.join(smali_dir, relative)
+        if os.path.exists(base + '.smali'):
+            files.append(base + '.smali')
+        files.extend(sorted(glob.glob(glob.escape(base) + '$*.smali')))
+    return files
+
+
+def fingerprints(decoded_dir, activities, pkg_prefix):
+    """
+    Fingerprints activities from the decoded tree.
+    Args:
+        decoded_dir (str): apktool output folder of the APK.
+        activities (list): Full activity names.
+        pkg_prefix (str): Package used to expand relative activity names in the manifest.
+    Returns:
+        dict: activity -> hex digest.
+    """
+    res_names = _resource_names(decoded_dir)
+    entries = _manifest_entries(decoded_dir, pkg_prefix)
+    layout_cache = {}
+    result = {}
+    for activity in activities:
+        digest = hashlib.sha256()
+        digest.update(entries.get(activity, b''))
+        layouts = set()
+        for path in _class_files(decoded_dir, activity):
+            with open(path, 'r', errors='ignore') as f:
+                smali = f.read()
+            # Resource ids are renumbered between builds, their names are stable
+            referenced = set(res_names.get(rid, rid) for rid in _RES_ID.findall(smali))
+            smali = _RES_ID.sub(lambda m: res_names.get(m.group(0), m.group(0)), smali)
+            digest.update(smali.encode('utf-8'))
+            layouts.update(n for n in referenced if n.startswith('layout/'))
+        for layout in sorted(layouts):
+            if layout not in layout_cache:
+                layout_digest = hashlib.sha256()
+                for path in sorted(glob.glob(os.path.join(decoded_dir, 'res', 'layout*', layout[7:] + '.xml'))):
+                    with open(path, 'rb') as f:
+                        layout_digest.update(f.read())
+                layout_cache[layout] = layout_digest.hexdigest()
+            digest.update(f"{layout}={layout_cache[layout]}".encode('utf-8'))
+        result[activity] = digest.hexdigest()
+    return result
+
+
+def split_activities(record, current):
+    """
+    Splits activities into the ones to explore and the ones to carry forward.
+    Args:
+        record (dict): Result of load_record, or None.
+        current (dict): activity -> fingerprint of the new version.
+    Returns:
+        tuple: (to_explore, carried) lists in the order of current.
+    """
+    previous = (record or {}).get('activities', {})
+    to_explore = []
+    carried = []
+    for activity, fingerprint in current.items():
+        if ENABLED and activity in previous and previous[activity]['fingerprint'] == fingerprint:
+            carried.append(activity)
+        else:
+            to_explore.append(activity)
+    return to_explore, carried
+
+
+def carry_forward(results_outputs, old_app, new_app, activities):
+    """
+    Copies the outputs (issues, screenshot, layout) of unchanged activities to the new version.
+    Args:
+        results_outputs (str): Outputs folder.
+        old_app (str): APK name of the last scanned version.
+        new_app (str): APK name of the new version.
+        activities (list): Activities to carry forward.
+    """
+    if old_app == new_app:
+        return # Same outputs folder, nothing to copy
+    for activity in activities:
+        for sub, suffix in (('issues', ''), ('issues', '.zip'), ('screenshot', '.png'), ('layouts', '.xml')):
+            src = os.path.join(results_outputs, old_app, sub, activity + suffix)
+            dest = os.path.join(results_outputs, new_app, sub, activity + suffix)
+            if not os.path.exists(src) or os.path.exists(dest):
+                continue
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            try:
+                if os.path.isdir(src):
+                    shutil.copytree(src, dest)
+                else:
+                    shutil.copy2(src, dest)
+            except (OSError, shutil.Error) as e:
+                print(f"Error carrying forward {src}: {e}")
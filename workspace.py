@@ -0,0 +1,178 @@
+'''
+Per-job scratch directories on a RAM-backed filesystem.
+
+Each APK job gets its own workspace holding the apktool tree and the tmp folder
+for files pulled from the device, so concurrent jobs never share a directory.
+Workspaces live under XBOT_WORKSPACE (default /dev/shm/xbot) as long as the
+reservations of all live workspaces fit into the quota; a job that does not fit
+waits for others to finish, and APKs whose expected tree would take too large a
+share of the quota are spilled to disk right away. Workspaces are removed when
+the job ends, at interpreter exit, on SIGTERM/SIGINT, and, for processes that
+were killed outright, by the stale sweep of the next run.
+'''
+
+import atexit
+import os
+import shutil
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+RAM_ROOT = os.environ.get('XBOT_WORKSPACE', '/dev/shm/xbot')
+QUOTA_MB = int(os.environ.get('XBOT_WORKSPACE_QUOTA_MB', '2048'))  # Total reservations allowed in RAM
+EXPANSION = 6  # Expected size of a decoded tree (plus pulled files) relative to the APK size
+SPILL_SHARE = 0.5  # Jobs expected to need more than this share of the quota go to disk
+WAIT_TIMEOUT = 600  # seconds a job waits for quota before it is spilled to disk instead
+
+_cond = threading.Condition()
+_reserved = 0  # bytes reserved by live RAM workspaces
+_live = {}  # path -> Workspace
+_handlers_installed = False
+
+
+class Workspace(object):
+    """Scratch directory of one job: 'apktool' holds decoded trees, 'tmp' pulled files."""
+
+    def __init__(self, path, in_ram, reserved):
+        self.path = path
+        self.in_ram = in_ram
+        self.reserved = reserved
+        self.decompile_root = os.path.join(path, 'apktool')
+        self.tmp = os.path.join(path, 'tmp')
+
+
+def _quota():
+    return QUOTA_MB * 1024 * 1024
+
+
+def _ram_available():
+    parent = os.path.dirname(RAM_ROOT.rstrip('/')) or '/'
+    return os.path.isdir(parent) and os.access(parent, os.W_OK)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_stale(roots):
+    """
+    Removes workspaces left behind by processes that no longer exist.
+    Workspace folders are named '<pid>-<job>'.
+    Args:
+        roots (list): Workspace root folders to sweep.
+    """
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            pid = name.split('-', 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+                print(f"Removing stale workspace {os.path.join(root, name)}")
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def _remove(ws):
+    global _reserved
+    shutil.rmtree(ws.path, ignore_errors=True)
+    with _cond:
+        if _live.pop(ws.path, None) is not None and ws.in_ram:
+            _reserved -= ws.reserved
+        _cond.notify_all()
+
+
+def cleanup_all():
+    """Removes every live workspace of this process."""
+    for ws in list(_live.values()):
+        _remove(ws)
+
+
+def _on_signal(signum, frame):
+    cleanup_all()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def _install_handlers():
+    global _handlers_installed
+    if _handlers_installed:
+        return
+    _handlers_installed = True
+    atexit.register(cleanup_all)
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            if signal.getsignal(signum) in (signal.SIG_DFL, signal.default_int_handler):
+                signal.signal(signum, _on_signal)
+
+
+def _reserve(estimate):
+    """Waits until the estimate fits into the RAM quota. Returns False if it never will (spill)."""
+    global _reserved
+    if not _ram_available() or estimate > _quota() * SPILL_SHARE:
+        return False
+    end = time.monotonic() + WAIT_TIMEOUT
+    with _cond:
+        while _reserved + estimate > _quota():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            print(f"Workspace quota full ({_reserved // (1024 * 1024)} MB reserved). Waiting...")
+            _cond.wait(min(remaining, 30))
+        _reserved += estimate
+    return True
+
+
+def measure(ws):
+    """
+    Replaces the reservation of a RAM workspace by its actual size, e.g. once the APK is decoded,
+    so waiting jobs see the real usage.
+    """
+    global _reserved
+    if not ws.in_ram:
+        return
+    used = 0
+    for dirpath, _, filenames in os.walk(ws.path):
+        for f in filenames:
+            try:
+                used += os.lstat(os.path.join(dirpath, f)).st_size
+            except OSError:
+                pass
+    with _cond:
+        if ws.path in _live:
+            _reserved += used - ws.reserved
+            ws.reserved = used
+        _cond.notify_all()
+
+
+@contextmanager
+def allocate(job, apk_path, disk_root):
+    """
+    Allocates a scratch workspace for one job and removes it afterwards.
+    Args:
+        job (str): Job name (APK name), part of the folder name.
+        apk_path (str): APK of the job, its size decides the reservation.
+        disk_root (str): Folder used when the job does not fit into RAM.
+    Yields:
+        Workspace: The allocated workspace.
+    """
+    _install_handlers()
+    estimate = os.path.getsize(apk_path) * EXPANSION if os.path.exists(apk_path) else 0
+    in_ram = _reserve(estimate)
+    root = RAM_ROOT if in_ram else disk_root
+    ws = Workspace(os.path.join(root, f"{os.getpid()}-{job}"), in_ram, estimate if in_ram else 0)
+    with _cond:
+        _live[ws.path] = ws
+    try:
+        shutil.rmtree(ws.path, ignore_errors=True)
+        os.makedirs(ws.decompile_root, exist_ok=True)
+        os.makedirs(ws.tmp, exist_ok=True)
+        print(f"Workspace for {job}: {ws.path} ({'RAM' if in_ram else 'disk'})")
+        yield ws
+    finally:
+        _remove(ws)